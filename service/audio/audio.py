@@ -17,64 +17,168 @@
 This module contains functions to extract, split and transcribe audio files.
 """
 
-import datetime
+import collections
+import gc
 import io
 import logging
 import os
 import pathlib
 import re
 import shutil
-from typing import Optional, Sequence, Tuple
+import tempfile
+import threading
+from typing import Any, List, Optional, Sequence, Tuple
+import wave
 
 import config as ConfigService
-from faster_whisper import WhisperModel
-from iso639 import languages
+import numpy as np
 import pandas as pd
 import storage as StorageService
 import utils as Utils
-import vertexai
-from vertexai.generative_models import GenerativeModel, Part
-import whisper
+from vertexai.generative_models import Part
+
+_SPLEETER_MODEL = 'spleeter:2stems'
+_WHISPER_COMPUTE_TYPE = 'int8'
+# The number of audio frames to copy at once when appending WAV files.
+_WAV_COPY_FRAMES = 1024 * 1024
+# WAV files store their data size in 32 bits, after a 36 byte header.
+_WAV_MAX_DATA_SIZE = 0xFFFFFFFF - 36
+
+_whisper_models_lock = threading.Lock()
+# Loaded models and their sizes, keyed by model name, device and compute type,
+# from least to most recently used.
+_whisper_models: collections.OrderedDict = collections.OrderedDict()
+# Serialises separations, as the separator feeds a single TensorFlow predictor.
+_separator_lock = threading.Lock()
+_separator = None
+
+
+def _reset_after_fork():
+  """Drops the separator in a forked child, as TensorFlow isn't fork-safe."""
+  global _whisper_models_lock, _separator_lock, _separator
+  _whisper_models_lock = threading.Lock()
+  _separator_lock = threading.Lock()
+  _separator = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 def combine_audio_files(output_path: str, audio_files: Sequence[str]):
-  """Combines audio analysis files into a single file."""
-  ffmpeg_cmds = ['ffmpeg']
-  for audio_file in audio_files:
-    ffmpeg_cmds.extend(['-i', audio_file])
+  """Combines audio analysis files into a single file.
 
-  ffmpeg_cmds += ['-filter_complex'] + [
-      ''.join([f'[{index}:0]' for index, _ in enumerate(audio_files)])
-      + f'concat=n={len(audio_files)}:v=0:a=1[outa]'
-  ] + ['-map', '[outa]', output_path]
+  PCM WAV files of the same format, like the stems of all chunks, are appended
+  to each other without decoding. Any other files are decoded and concatenated
+  with ffmpeg.
 
-  Utils.execute_subprocess_commands(
-      cmds=ffmpeg_cmds,
-      description=(
-          f'Merge {len(audio_files)} audio files and output to {output_path}.'
-      ),
-  )
+  Args:
+    output_path: The path to write the combined audio to.
+    audio_files: The paths of the audio files to combine, in order.
+  """
+  if _combine_wav_files(output_path, audio_files):
+    logging.info(
+        'AUDIO - Appended %d WAV files into %s.', len(audio_files), output_path
+    )
+  else:
+    ffmpeg_cmds = ['ffmpeg']
+    for audio_file in audio_files:
+      ffmpeg_cmds.extend(['-i', audio_file])
+
+    ffmpeg_cmds += ['-filter_complex'] + [
+        ''.join([f'[{index}:0]' for index, _ in enumerate(audio_files)])
+        + f'concat=n={len(audio_files)}:v=0:a=1[outa]'
+    ] + ['-map', '[outa]', output_path]
+
+    Utils.execute_subprocess_commands(
+        cmds=ffmpeg_cmds,
+        description=(
+            f'Merge {len(audio_files)} audio files and output to '
+            f'{output_path}.'
+        ),
+    )
   os.chmod(output_path, 777)
 
 
+def _combine_wav_files(output_path: str, audio_files: Sequence[str]) -> bool:
+  """Concatenates PCM WAV files of the same format by copying their frames.
+
+  Args:
+    output_path: The path to write the combined audio to.
+    audio_files: The paths of the WAV files to combine, in order.
+
+  Returns:
+    Whether the files could be combined, i.e. were all PCM WAV files with the
+    same channels, sample width and sample rate, fitting in a single WAV file.
+  """
+  if not output_path.lower().endswith('.wav'):
+    return False
+  formats = set()
+  data_size = 0
+  try:
+    for audio_file in audio_files:
+      with wave.open(audio_file, 'rb') as wav_file:
+        formats.add((
+            wav_file.getnchannels(),
+            wav_file.getsampwidth(),
+            wav_file.getframerate(),
+        ))
+        data_size += (
+            wav_file.getnframes() * wav_file.getsampwidth()
+            * wav_file.getnchannels()
+        )
+  except (wave.Error, EOFError):
+    return False
+  if len(formats) != 1 or data_size > _WAV_MAX_DATA_SIZE:
+    return False
+
+  channels, sample_width, frame_rate = formats.pop()
+  with wave.open(output_path, 'wb') as output_file:
+    output_file.setnchannels(channels)
+    output_file.setsampwidth(sample_width)
+    output_file.setframerate(frame_rate)
+    for audio_file in audio_files:
+      with wave.open(audio_file, 'rb') as wav_file:
+        while frames := wav_file.readframes(_WAV_COPY_FRAMES):
+          output_file.writeframes(frames)
+  return True
+
+
 def combine_analysis_chunks(
     analysis_chunks: Sequence[pd.DataFrame]
 ) -> pd.DataFrame:
-  """Combines audio analysis chunks into a single response."""
-  combined_df = pd.DataFrame()
-  max_audio_segment_id = 0
-  max_end_s = 0
+  """Combines audio analysis chunks into a single response.
 
-  for df in analysis_chunks:
-    df['audio_segment_id'] += max_audio_segment_id
-    df['start_s'] += max_end_s
-    df['end_s'] += max_end_s
+  The segment ids and timestamps of each chunk are offset by the last segment
+  id and end time of the chunks before it, in a single concatenation. The input
+  chunks are not modified.
 
-    max_audio_segment_id = df['audio_segment_id'].max()
-    max_end_s = df['end_s'].max()
+  Args:
+    analysis_chunks: The transcription dataframes of the chunks, in order.
 
-    combined_df = pd.concat([combined_df, df], ignore_index=True)
+  Returns:
+    The combined transcription dataframe.
+  """
+  if all(df.empty for df in analysis_chunks):
+    # Keeps the columns of the empty chunks, as the combined chunks would.
+    return pd.concat([pd.DataFrame(), *analysis_chunks], ignore_index=True)
+  analysis_chunks = [df for df in analysis_chunks if not df.empty]
+
+  chunk_sizes = [len(df) for df in analysis_chunks]
+  audio_segment_id_offsets = np.repeat(
+      np.cumsum(
+          [0] + [df['audio_segment_id'].max() for df in analysis_chunks[:-1]]
+      ),
+      chunk_sizes,
+  )
+  time_offsets = np.repeat(
+      np.cumsum([0] + [df['end_s'].max() for df in analysis_chunks[:-1]]),
+      chunk_sizes,
+  )
 
+  combined_df = pd.concat(analysis_chunks, ignore_index=True)
+  combined_df['audio_segment_id'] += audio_segment_id_offsets
+  combined_df['start_s'] += time_offsets
+  combined_df['end_s'] += time_offsets
   return combined_df
 
 
@@ -82,56 +186,92 @@ def combine_subtitle_files(
     audio_output_dir: str,
     subtitles_output_path: str,
 ):
-  """Combines audio analysis subtitle files content into a single file."""
-  subtitles_files = [
-      str(file_path) for file_path in pathlib.Path(audio_output_dir).
-      glob(f'*.{ConfigService.OUTPUT_SUBTITLES_TYPE}')
-  ]
+  """Combines audio analysis subtitle files content into a single file.
+
+  Files are merged in the order of their chunk index, and the cues of each file
+  are shifted by the end time of the last cue of the files before it. Cues are
+  written out as they are read, so memory use doesn't grow with the length of
+  the transcript. Both VTT and SRT files are supported, as per
+  `OUTPUT_SUBTITLES_TYPE`, with or without hours in their timestamps.
+
+  Args:
+    audio_output_dir: The directory holding the subtitle files of all chunks.
+    subtitles_output_path: The path to write the combined subtitles to.
+  """
+  subtitles_type = ConfigService.OUTPUT_SUBTITLES_TYPE
+  subtitles_files = sorted(
+      pathlib.Path(audio_output_dir).glob(f'*.{subtitles_type}'),
+      key=_get_chunk_sort_key,
+  )
   logging.info(
       'THREADING - Combining %d subtitle files found in %s...',
       len(subtitles_files),
       audio_output_dir,
   )
-  combined_content = ''
-  last_timestamp = datetime.datetime.strptime('00:00:00.000', '%H:%M:%S.%f')
-
-  for index, subtitles_file in enumerate(subtitles_files):
-    with open(subtitles_file, 'r', encoding='utf-8') as f:
-      lines = f.readlines()
-
-      if index:
-        lines = lines[2:]
-
-      for line in lines:
-        if '-->' in line:
-          start, end = line.strip().split(' --> ')
-          start_time = last_timestamp + datetime.timedelta(
-              minutes=int(start[:2]),
-              seconds=int(start[3:5]),
-              milliseconds=int(start[6:]),
-          )
-          end_time = last_timestamp + datetime.timedelta(
-              minutes=int(end[:2]),
-              seconds=int(end[3:5]),
-              milliseconds=int(end[6:]),
-          )
-
-          start = start_time.strftime('%H:%M:%S.%f')[:-3]
-          end = end_time.strftime('%H:%M:%S.%f')[:-3]
-
-          combined_content += f'{start} --> {end}\n'
-        else:
-          combined_content += line
-
-      _, end = lines[-3].strip().split(' --> ')
-      last_timestamp += datetime.timedelta(
-          minutes=int(end[:2]),
-          seconds=int(end[3:5]),
-          milliseconds=int(end[6:]),
-      )
-
-  with open(subtitles_output_path, 'w', encoding='utf-8') as f:
-    f.write(combined_content)
+  is_srt = subtitles_type == 'srt'
+  offset_ms = 0
+  cue_count = 0
+
+  with open(subtitles_output_path, 'w', encoding='utf-8') as output_file:
+    if not is_srt:
+      output_file.write('WEBVTT\n\n')
+    for subtitles_file in subtitles_files:
+      last_end_ms = 0
+      # The VTT header block runs until the first blank line.
+      in_header = not is_srt
+      at_block_start = True
+      with open(subtitles_file, 'r', encoding='utf-8') as f:
+        for line in f:
+          is_blank = not line.strip()
+          if in_header:
+            in_header = not is_blank
+            continue
+          if '-->' in line:
+            start, _, rest = line.strip().partition(' --> ')
+            end, _, settings = rest.partition(' ')
+            last_end_ms = _parse_subtitles_timestamp(end)
+            output_file.write(
+                _format_subtitles_timestamp(
+                    offset_ms + _parse_subtitles_timestamp(start), is_srt
+                ) + ' --> '
+                + _format_subtitles_timestamp(offset_ms + last_end_ms, is_srt)
+                + (f' {settings}' if settings else '') + '\n'
+            )
+          elif is_srt and at_block_start and line.strip().isdigit():
+            cue_count += 1
+            output_file.write(f'{cue_count}\n')
+          else:
+            output_file.write(line if line.endswith('\n') else f'{line}\n')
+          at_block_start = is_blank
+      if not at_block_start:
+        output_file.write('\n')
+      offset_ms += last_end_ms
+
+
+def _get_chunk_sort_key(file_path: pathlib.Path) -> Tuple[int, str]:
+  """Sorts chunk files by their leading chunk index, e.g. `2-5_aaa.vtt`."""
+  match = re.match(r'\d+', file_path.name)
+  return (int(match.group()) if match else 0, file_path.name)
+
+
+def _parse_subtitles_timestamp(timestamp: str) -> int:
+  """Parses a `[hh:]mm:ss.mmm` or `hh:mm:ss,mmm` timestamp to milliseconds."""
+  time_part, _, millis = timestamp.replace(',', '.').partition('.')
+  seconds = 0
+  for part in time_part.split(':'):
+    seconds = seconds*60 + int(part)
+  return seconds*1000 + int(millis.ljust(3, '0')[:3])
+
+
+def _format_subtitles_timestamp(timestamp_ms: int, is_srt: bool) -> str:
+  """Formats milliseconds as an `hh:mm:ss.mmm` (VTT) or `hh:mm:ss,mmm` (SRT)."""
+  seconds, millis = divmod(timestamp_ms, 1000)
+  minutes, seconds = divmod(seconds, 60)
+  hours, minutes = divmod(minutes, 60)
+  return (
+      f'{hours:02d}:{minutes:02d}:{seconds:02d}'
+      f'{"," if is_srt else "."}{millis:03d}'
+  )
 
 
 def extract_audio(video_file_path: str) -> Optional[str]:
@@ -145,20 +285,7 @@ def extract_audio(video_file_path: str) -> Optional[str]:
     The path to the extracted audio file if it exists, or None if the video does
     not contain an audio track.
   """
-  output = Utils.execute_subprocess_commands(
-      cmds=[
-          'ffprobe',
-          '-i',
-          video_file_path,
-          '-show_streams',
-          '-select_streams',
-          'a',
-          '-loglevel',
-          'error',
-      ],
-      description='check if video has audio with ffprobe',
-  )
-  if not output:
+  if not Utils.probe_media(video_file_path).has_audio:
     logging.warning(
         'AUDIO_EXTRACTION - Video does not contain an audio track! '
         'Skipping audio extraction...'
@@ -192,10 +319,148 @@ def split_audio(
   Args:
     output_dir: directory where the split audio tracks will be saved.
     audio_file_path: path to the audio file that will be split.
+    prefix: prefix of the split audio track file names.
 
   Returns:
     A tuple with the path to the vocals and music tracks.
   """
+  return split_audio_files(
+      output_dir=output_dir,
+      audio_file_paths=[audio_file_path],
+      prefixes=[prefix],
+  )[0]
+
+
+def split_audio_files(
+    output_dir: str,
+    audio_file_paths: Sequence[str],
+    prefixes: Sequence[str],
+) -> List[Tuple[str, str]]:
+  """Splits several audio files into vocals and music tracks.
+
+  With `CONFIG_SPLEETER_IN_PROCESS`, the files are split in this process by a
+  separator whose model stays loaded for subsequent invocations on a warm
+  instance, and the tracks are written directly to their output paths.
+  Otherwise, the spleeter CLI is run once per file.
+
+  Args:
+    output_dir: directory where the split audio tracks will be saved.
+    audio_file_paths: paths to the audio files that will be split.
+    prefixes: prefixes of the split audio track file names, per file.
+
+  Returns:
+    A tuple with the path to the vocals and music tracks, per file.
+  """
+  if ConfigService.CONFIG_SPLEETER_IN_PROCESS:
+    with _separator_lock:
+      separator = _get_separator()
+      for audio_file_path, prefix in zip(audio_file_paths, prefixes):
+        separator.separate_to_file(
+            audio_file_path,
+            output_dir,
+            codec='wav',
+            filename_format=f'{prefix}{{instrument}}.{{codec}}',
+            synchronous=True,
+        )
+        logging.info('AUDIO - Split %s with spleeter.', audio_file_path)
+  else:
+    for audio_file_path, prefix in zip(audio_file_paths, prefixes):
+      _split_audio_cli(output_dir, audio_file_path, prefix)
+
+  return [(
+      str(
+          pathlib.Path(
+              output_dir, f'{prefix}{ConfigService.OUTPUT_SPEECH_FILE}'
+          )
+      ),
+      str(
+          pathlib.Path(output_dir, f'{prefix}{ConfigService.OUTPUT_MUSIC_FILE}')
+      ),
+  ) for prefix in prefixes]
+
+
+def separate_audio_tracks(
+    output_dir: str,
+    audio_file_path: str,
+) -> Tuple[str, str]:
+  """Splits audio of any duration into vocals and music tracks.
+
+  The audio is cut into chunks of `CONFIG_MAX_AUDIO_CHUNK_SIZE`, as for
+  extraction, which are split in a single batch and whose tracks are combined.
+
+  Args:
+    output_dir: directory where the split audio tracks will be saved.
+    audio_file_path: path to the audio file that will be split.
+
+  Returns:
+    A tuple with the path to the vocals and music tracks.
+  """
+  chunks_dir = tempfile.mkdtemp()
+  _, file_ext = os.path.splitext(audio_file_path)
+  Utils.execute_subprocess_commands(
+      cmds=[
+          'ffmpeg',
+          '-i',
+          audio_file_path,
+          '-f',
+          'segment',
+          '-segment_time',
+          str(ConfigService.CONFIG_MAX_AUDIO_CHUNK_SIZE),
+          '-c',
+          'copy',
+          str(pathlib.Path(chunks_dir, f'%d{file_ext}')),
+      ],
+      description=(
+          f'Cut audio into {ConfigService.CONFIG_MAX_AUDIO_CHUNK_SIZE/60}min '
+          'chunks to split.'
+      ),
+  )
+  chunk_paths = sorted(
+      pathlib.Path(chunks_dir).glob(f'*{file_ext}'),
+      key=lambda path: int(path.stem),
+  )
+  tracks = split_audio_files(
+      output_dir=chunks_dir,
+      audio_file_paths=[str(path) for path in chunk_paths],
+      prefixes=[f'{path.stem}_' for path in chunk_paths],
+  )
+
+  vocals_file_path = str(
+      pathlib.Path(output_dir, ConfigService.OUTPUT_SPEECH_FILE)
+  )
+  music_file_path = str(
+      pathlib.Path(output_dir, ConfigService.OUTPUT_MUSIC_FILE)
+  )
+  combine_audio_files(vocals_file_path, [vocals for vocals, _ in tracks])
+  combine_audio_files(music_file_path, [music for _, music in tracks])
+  shutil.rmtree(chunks_dir, ignore_errors=True)
+
+  return vocals_file_path, music_file_path
+
+
+def _get_separator() -> Any:
+  """Returns the process-wide spleeter separator, creating it on first use.
+
+  The model itself is loaded by the first separation. Must be called while
+  holding `_separator_lock`.
+
+  Returns:
+    The `spleeter.separator.Separator`.
+  """
+  global _separator
+  if _separator is None:
+    # Imported here as TensorFlow is slow to import and only needed here.
+    # pylint: disable=import-outside-toplevel
+    from spleeter.separator import Separator
+
+    logging.info('AUDIO - Loading spleeter model %s...', _SPLEETER_MODEL)
+    # Output files are written synchronously, without a pool of processes.
+    _separator = Separator(_SPLEETER_MODEL, multiprocess=False)
+  return _separator
+
+
+def _split_audio_cli(output_dir: str, audio_file_path: str, prefix: str):
+  """Splits the audio with the spleeter CLI. See `split_audio`."""
   Utils.execute_subprocess_commands(
       cmds=[
           'spleeter',
@@ -224,8 +489,6 @@ def split_audio(
   )
   os.rmdir(base_path)
 
-  return vocals_file_path, music_file_path
-
 
 def transcribe_audio(
     output_dir: str,
@@ -267,12 +530,8 @@ def _transcribe_gemini(
   language_probability = 0.0
   subtitles_content = None
 
-  vertexai.init(
-      project=ConfigService.GCP_PROJECT_ID,
-      location=ConfigService.GCP_LOCATION,
-  )
-  transcription_model = (
-      GenerativeModel(ConfigService.CONFIG_TRANSCRIPTION_MODEL_GEMINI)
+  transcription_model = Utils.get_generative_model(
+      ConfigService.CONFIG_TRANSCRIPTION_MODEL_GEMINI
   )
   audio_file_gcs_uri = f'gs://{gcs_bucket_name}/{gcs_folder}' + (
       f'/{ConfigService.OUTPUT_ANALYSIS_CHUNKS_DIR}'
@@ -345,32 +604,118 @@ def _transcribe_gemini(
   return transcription_dataframe, video_language, float(language_probability)
 
 
-def _transcribe_whisper(
-    output_dir: str,
-    audio_file_path: str,
-) -> Tuple[pd.DataFrame, str, float]:
-  """Transcribes audio using Whisper."""
+def get_whisper_model(
+    model_name: str = ConfigService.CONFIG_TRANSCRIPTION_MODEL_WHISPER,
+    compute_type: str = _WHISPER_COMPUTE_TYPE,
+) -> Any:
+  """Returns a Whisper model, loading it unless it is already loaded.
+
+  Models stay loaded in this process, so that they are reused by subsequent
+  invocations on a warm instance. The least recently used models are unloaded
+  to keep the total size of loaded models within
+  `CONFIG_TRANSCRIPTION_MODEL_WHISPER_CACHE_MAX_SIZE`, and larger models are
+  not kept loaded at all.
+
+  Args:
+    model_name: The name of the Whisper model.
+    compute_type: The type to quantize the model weights to.
+
+  Returns:
+    The `faster_whisper.WhisperModel`.
+  """
+  # Imported here as it is slow to import and only needed for transcription.
+  # pylint: disable=import-outside-toplevel
+  from faster_whisper import WhisperModel
+
+  key = (model_name, ConfigService.DEVICE, compute_type)
+  max_size = ConfigService.CONFIG_TRANSCRIPTION_MODEL_WHISPER_CACHE_MAX_SIZE
+  # Loading is serialised, as concurrent loads would exceed the memory cap.
+  with _whisper_models_lock:
+    if key in _whisper_models:
+      _whisper_models.move_to_end(key)
+      logging.info('TRANSCRIPTION - Reusing loaded Whisper model %r.', key)
+      return _whisper_models[key][0]
+
+    model_path = _get_whisper_model_path(model_name)
+    size = _get_dir_size(model_path)
+    cached = 0 < size <= max_size
+    while cached and _whisper_models and (
+        sum(entry[1] for entry in _whisper_models.values()) + size > max_size
+    ):
+      evicted_key, _ = _whisper_models.popitem(last=False)
+      logging.info('TRANSCRIPTION - Unloaded Whisper model %r.', evicted_key)
+    # Frees the memory of evicted models before loading the new one.
+    gc.collect()
+
+    logging.info('TRANSCRIPTION - Loading Whisper model %r...', key)
+    model = WhisperModel(
+        model_path,
+        device=ConfigService.DEVICE,
+        compute_type=compute_type,
+    )
+    if cached:
+      _whisper_models[key] = (model, size)
+    return model
+
+
+def preload_whisper_model():
+  """Loads the configured Whisper model, e.g. when an instance starts."""
+  try:
+    get_whisper_model()
+  # Transcription will retry loading the model when needed
+  # pylint: disable=broad-exception-caught
+  except Exception:
+    logging.exception('Encountered error while preloading Whisper model!')
+
+
+def _get_whisper_model_path(model_name: str) -> str:
+  """Returns the local directory of a Whisper model, fetching it if needed.
+
+  Models are fetched from `CONFIG_TRANSCRIPTION_MODEL_WHISPER_GCS_BUCKET`, or
+  from the Hugging Face Hub if the bucket does not hold the model.
+
+  Args:
+    model_name: The name of the Whisper model.
+
+  Returns:
+    The path to the directory holding the model files.
+  """
+  # pylint: disable=import-outside-toplevel
+  from faster_whisper import download_model
+
   model_download_dir_base = (
       f'/tmp/{ConfigService.CONFIG_TRANSCRIPTION_MODEL_WHISPER_GCS_BUCKET}'
   )
-  model_download_dir = str(
-      pathlib.Path(
-          model_download_dir_base,
-          ConfigService.CONFIG_TRANSCRIPTION_MODEL_WHISPER,
-      )
-  )
+  model_download_dir = str(pathlib.Path(model_download_dir_base, model_name))
   os.makedirs(model_download_dir, exist_ok=True)
   count_files = StorageService.download_gcs_dir(
       bucket_name=ConfigService.CONFIG_TRANSCRIPTION_MODEL_WHISPER_GCS_BUCKET,
-      dir_path=ConfigService.CONFIG_TRANSCRIPTION_MODEL_WHISPER,
+      dir_path=model_name,
       output_dir=model_download_dir,
+      versioned=True,
   )
-  model = WhisperModel(
-      model_download_dir
-      if count_files else ConfigService.CONFIG_TRANSCRIPTION_MODEL_WHISPER,
-      device=ConfigService.DEVICE,
-      compute_type='int8',
+  return model_download_dir if count_files else download_model(model_name)
+
+
+def _get_dir_size(dir_path: str) -> int:
+  return sum(
+      path.stat().st_size
+      for path in pathlib.Path(dir_path).rglob('*')
+      if path.is_file()
   )
+
+
+def _transcribe_whisper(
+    output_dir: str,
+    audio_file_path: str,
+) -> Tuple[pd.DataFrame, str, float]:
+  """Transcribes audio using Whisper."""
+  # Imported here as they are slow to import and only needed by this trigger.
+  # pylint: disable=import-outside-toplevel
+  from iso639 import languages
+  import whisper
+
+  model = get_whisper_model()
   segments, info = model.transcribe(
       audio_file_path,
       beam_size=5,
@@ -0,0 +1,137 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks combining transcription chunks.
+
+Compares `AudioService.combine_analysis_chunks` with the previous
+implementation, which concatenated the combined dataframe once per chunk, on
+synthetic transcripts, and checks that both produce the same output.
+
+Usage:
+  python benchmarks/combine_analysis_chunks.py --chunks 500 --utterances 100
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Callable, Sequence
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio as AudioService  # pylint: disable=wrong-import-position
+
+
+def _combine_analysis_chunks_per_chunk(
+    analysis_chunks: Sequence[pd.DataFrame]
+) -> pd.DataFrame:
+  """The previous implementation, concatenating once per chunk."""
+  combined_df = pd.DataFrame()
+  max_audio_segment_id = 0
+  max_end_s = 0
+
+  for df in analysis_chunks:
+    df['audio_segment_id'] += max_audio_segment_id
+    df['start_s'] += max_end_s
+    df['end_s'] += max_end_s
+
+    max_audio_segment_id = df['audio_segment_id'].max()
+    max_end_s = df['end_s'].max()
+
+    combined_df = pd.concat([combined_df, df], ignore_index=True)
+
+  return combined_df
+
+
+def _make_chunks(
+    chunks: int,
+    utterances: int,
+    seed: int,
+) -> Sequence[pd.DataFrame]:
+  """Creates transcription chunks shaped like those of `transcribe_audio`."""
+  rng = np.random.default_rng(seed)
+  analysis_chunks = []
+  for _ in range(chunks):
+    durations = rng.uniform(0.5, 5, utterances)
+    end_s = np.cumsum(durations)
+    analysis_chunks.append(
+        pd.DataFrame({
+            'audio_segment_id': np.arange(1, utterances + 1),
+            'start_s': end_s - durations,
+            'end_s': end_s,
+            'duration_s': durations,
+            'transcript': ['lorem ipsum dolor sit amet'] * utterances,
+        })
+    )
+  return analysis_chunks
+
+
+def _time(
+    combine: Callable[[Sequence[pd.DataFrame]], pd.DataFrame],
+    analysis_chunks: Sequence[pd.DataFrame],
+    runs: int,
+) -> pd.DataFrame:
+  """Runs `combine` on copies of the chunks and prints the best time."""
+  timings = []
+  for _ in range(runs):
+    chunk_copies = [df.copy() for df in analysis_chunks]
+    started = time.perf_counter()
+    result = combine(chunk_copies)
+    timings.append(time.perf_counter() - started)
+  print(f'{combine.__name__:<40}{min(timings):>10.4f}s')
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument(
+      '--chunks',
+      type=int,
+      default=500,
+      help='The number of chunks.',
+  )
+  parser.add_argument(
+      '--utterances',
+      type=int,
+      default=100,
+      help='The number of utterances per chunk.',
+  )
+  parser.add_argument(
+      '--runs',
+      type=int,
+      default=3,
+      help='The number of runs to take the best time of.',
+  )
+  args = parser.parse_args()
+
+  analysis_chunks = _make_chunks(args.chunks, args.utterances, seed=0)
+  print(
+      f'Combining {args.chunks} chunks of {args.utterances} utterances '
+      f'({args.chunks * args.utterances} in total):'
+  )
+  expected = _time(
+      _combine_analysis_chunks_per_chunk, analysis_chunks, args.runs
+  )
+  actual = _time(
+      AudioService.combine_analysis_chunks, analysis_chunks, args.runs
+  )
+  pd.testing.assert_frame_equal(actual, expected)
+  print('Outputs are identical.')
+
+
+if __name__ == '__main__':
+  main()
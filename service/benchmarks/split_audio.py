@@ -0,0 +1,121 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks splitting audio into vocals and music tracks.
+
+Compares running the spleeter CLI once per chunk with the in-process separator
+of `AudioService.split_audio_files`, on synthetic audio chunks. The in-process
+separator is timed twice: on a cold process, which includes loading the model,
+and on a warm one, as for subsequent invocations on the same instance.
+
+Usage:
+  python benchmarks/split_audio.py --chunks 4 --duration 30
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Sequence
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+import audio as AudioService
+import config as ConfigService
+
+_SAMPLE_RATE = 44100
+
+
+def _make_chunks(
+    output_dir: str,
+    chunks: int,
+    duration: float,
+    seed: int,
+) -> Sequence[str]:
+  """Writes stereo WAV chunks of a melody over bursts of voice-like noise."""
+  rng = np.random.default_rng(seed)
+  t = np.arange(int(duration * _SAMPLE_RATE)) / _SAMPLE_RATE
+  file_paths = []
+  for index in range(chunks):
+    notes = rng.uniform(110, 880, size=int(duration) + 1)
+    music = 0.3 * np.sin(2 * np.pi * notes[t.astype(int)] * t)
+    envelope = (np.sin(2 * np.pi * rng.uniform(0.5, 2) * t) > 0).astype(float)
+    voice = 0.2 * envelope * rng.standard_normal(t.size)
+    samples = np.clip(music + voice, -1, 1)
+    frames = (np.stack([samples, samples], axis=1) * 32767).astype('<i2')
+
+    file_path = os.path.join(output_dir, f'{index}.wav')
+    with wave.open(file_path, 'wb') as wav_file:
+      wav_file.setnchannels(2)
+      wav_file.setsampwidth(2)
+      wav_file.setframerate(_SAMPLE_RATE)
+      wav_file.writeframes(frames.tobytes())
+    file_paths.append(file_path)
+  return file_paths
+
+
+def _time(
+    name: str,
+    in_process: bool,
+    audio_file_paths: Sequence[str],
+) -> float:
+  """Splits the chunks in a fresh output directory and prints the time."""
+  ConfigService.CONFIG_SPLEETER_IN_PROCESS = in_process
+  output_dir = tempfile.mkdtemp()
+  started = time.perf_counter()
+  results = AudioService.split_audio_files(
+      output_dir=output_dir,
+      audio_file_paths=audio_file_paths,
+      prefixes=[f'{index}_' for index, _ in enumerate(audio_file_paths)],
+  )
+  elapsed = time.perf_counter() - started
+  for vocals_file_path, music_file_path in results:
+    assert os.path.isfile(vocals_file_path), vocals_file_path
+    assert os.path.isfile(music_file_path), music_file_path
+  print(f'{name:<40}{elapsed:>10.2f}s')
+  return elapsed
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument(
+      '--chunks',
+      type=int,
+      default=4,
+      help='The number of audio chunks.',
+  )
+  parser.add_argument(
+      '--duration',
+      type=float,
+      default=30,
+      help='The duration of each chunk in seconds.',
+  )
+  args = parser.parse_args()
+
+  input_dir = tempfile.mkdtemp()
+  audio_file_paths = _make_chunks(input_dir, args.chunks, args.duration, seed=0)
+  print(f'Splitting {args.chunks} chunks of {args.duration:g}s:')
+  cli = _time('spleeter CLI', False, audio_file_paths)
+  cold = _time('in-process separator (cold)', True, audio_file_paths)
+  warm = _time('in-process separator (warm)', True, audio_file_paths)
+  print(f'Speed-up: {cli / cold:.1f}x cold, {cli / warm:.1f}x warm.')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,180 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the cold-start import time of the service per trigger type.
+
+Each run starts a fresh interpreter, imports `main` and then the service module
+that `main.gcs_file_uploaded` imports to handle the trigger type. Modules that
+are only imported while handling a trigger, such as Whisper for transcription,
+are not included.
+
+It also checks that the lazily resolved config variables are only resolved
+once per process, on first access.
+
+Usage:
+  python benchmarks/startup.py --runs 5 --top 10
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+_SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The service module imported by `main` per trigger type, as dispatched there.
+_TRIGGER_SERVICES = {
+    'none': None,
+    'extractor_initial': 'extractor',
+    'extractor_audio': 'extractor',
+    'extractor_video': 'extractor',
+    'extractor_finalise_audio': 'extractor',
+    'extractor_finalise_video': 'extractor',
+    'extractor_finalise': 'extractor',
+    'extractor_split_segment': 'extractor',
+    'extractor_combine_segment': 'extractor',
+    'combiner_initial': 'combiner',
+    'combiner_render': 'combiner',
+    'combiner_finalise': 'combiner',
+}
+
+_MEASURE_CODE = """
+import time
+started = time.perf_counter()
+import main
+imported_main = time.perf_counter()
+{service_import}
+print(imported_main - started, time.perf_counter() - imported_main)
+"""
+
+_CHECK_CONFIG_CODE = """
+import config
+import config.config
+
+resolved = []
+resolve = config.config.__getattr__
+
+
+def counting_resolve(name):
+  resolved.append(name)
+  return resolve(name)
+
+
+config.__getattr__ = config.config.__getattr__ = counting_resolve
+for _ in range(2):
+  config.DEVICE
+  config.CONFIG_DEFAULT_SAFETY_CONFIG
+assert resolved == ['DEVICE', 'CONFIG_DEFAULT_SAFETY_CONFIG'], resolved
+"""
+
+_IMPORT_TIME_PATTERN = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (.*)$')
+
+
+def _measure(
+    service: Optional[str],
+    import_time: bool = False,
+) -> Tuple[float, float, str]:
+  """Imports `main` and the service in a fresh interpreter.
+
+  Args:
+    service: The service module to import after `main`, if any.
+    import_time: Whether to report the import time of each module.
+
+  Returns:
+    The seconds taken to import `main` and the service, and the interpreter's
+    standard error output.
+  """
+  code = _MEASURE_CODE.format(
+      service_import=f'import {service}' if service else ''
+  )
+  result = subprocess.run(
+      [sys.executable] + (['-X', 'importtime'] if import_time else [])
+      + ['-c', code],
+      cwd=_SERVICE_DIR,
+      capture_output=True,
+      text=True,
+      check=True,
+  )
+  main_s, service_s = map(float, result.stdout.split()[-2:])
+  return main_s, service_s, result.stderr
+
+
+def _check_config():
+  """Checks that lazy config variables are resolved once, in a fresh process."""
+  subprocess.run(
+      [sys.executable, '-c', _CHECK_CONFIG_CODE],
+      cwd=_SERVICE_DIR,
+      check=True,
+  )
+  print('Lazy config variables are resolved once.')
+
+
+def _slowest_modules(import_time_output: str,
+                     top: int) -> List[Tuple[str, float]]:
+  """Returns the modules that took the longest to import themselves."""
+  modules = []
+  for line in import_time_output.splitlines():
+    match = _IMPORT_TIME_PATTERN.match(line)
+    if match:
+      modules.append((match.group(3).strip(), int(match.group(1)) / 1e6))
+  return sorted(modules, key=lambda module: module[1], reverse=True)[:top]
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument(
+      '--runs',
+      type=int,
+      default=5,
+      help='The number of runs to take the median of.',
+  )
+  parser.add_argument(
+      '--top',
+      type=int,
+      default=0,
+      help='Also list the modules that are slowest to import per service.',
+  )
+  args = parser.parse_args()
+
+  _check_config()
+  timings: Dict[Optional[str], Tuple[float, float]] = {}
+  for service in dict.fromkeys(_TRIGGER_SERVICES.values()):
+    samples = [_measure(service)[:2] for _ in range(args.runs)]
+    timings[service] = tuple(
+        statistics.median(values) for values in zip(*samples)
+    )
+
+  print(f'{"trigger":<28}{"service":<12}{"main s":>10}{"service s":>12}'
+        f'{"total s":>10}')
+  for trigger_type, service in _TRIGGER_SERVICES.items():
+    main_s, service_s = timings[service]
+    print(
+        f'{trigger_type:<28}{service or "-":<12}{main_s:>10.3f}'
+        f'{service_s:>12.3f}{main_s + service_s:>10.3f}'
+    )
+
+  if args.top:
+    for service in timings:
+      print(f'\nSlowest imports for service {service or "-"}:')
+      for module, seconds in _slowest_modules(
+          _measure(service, import_time=True)[2], args.top
+      ):
+        print(f'  {seconds:>8.3f}s  {module}')
+
+
+if __name__ == '__main__':
+  main()
@@ -18,6 +18,7 @@ This module provides functionality to combine individual cuts of the input video
 based on user-specific rendering settings.
 """
 
+import asyncio
 import dataclasses
 import gc
 import json
@@ -33,8 +34,8 @@ from urllib import parse
 import config as ConfigService
 import pandas as pd
 import storage as StorageService
+import storage.aio as StorageAsync
 import utils as Utils
-import vertexai
 from vertexai.generative_models import GenerativeModel, Part
 
 
@@ -165,12 +166,12 @@ class Combiner:
     """
     self.gcs_bucket_name = gcs_bucket_name
     self.render_file = render_file
-    vertexai.init(
-        project=ConfigService.GCP_PROJECT_ID,
-        location=ConfigService.GCP_LOCATION,
+    self.text_model = Utils.get_generative_model(
+        ConfigService.CONFIG_TEXT_MODEL
+    )
+    self.vision_model = Utils.get_generative_model(
+        ConfigService.CONFIG_VISION_MODEL
     )
-    self.text_model = GenerativeModel(ConfigService.CONFIG_TEXT_MODEL)
-    self.vision_model = GenerativeModel(ConfigService.CONFIG_VISION_MODEL)
 
   def check_finalise_render(self, variants_count: int):
     """Checks whether all variants have been rendered to trigger `finalise`."""
@@ -251,106 +252,115 @@ class Combiner:
         ), None
     )
     logging.info('RENDERING - Video file name: %s', video_file_name)
-    video_file_path = StorageService.download_gcs_file(
-        file_path=Utils.TriggerFile(video_file_name),
-        output_dir=tmp_dir,
-        bucket_name=self.gcs_bucket_name,
-    )
-    logging.info('RENDERING - Video file path: %s', video_file_path)
-    _, video_ext = os.path.splitext(video_file_path)
-    has_audio = StorageService.download_gcs_file(
-        file_path=Utils.TriggerFile(
-            str(
-                pathlib.Path(
-                    root_video_folder, f'{ConfigService.INPUT_FILENAME}.wav'
+    _, video_ext = os.path.splitext(video_file_name)
+    input_files = StorageAsync.download_gcs_files(
+        file_paths=[
+            Utils.TriggerFile(video_file_name),
+            Utils.TriggerFile(
+                str(
+                    pathlib.Path(
+                        root_video_folder, f'{ConfigService.INPUT_FILENAME}.wav'
+                    )
                 )
-            )
-        ),
-        output_dir=tmp_dir,
-        bucket_name=self.gcs_bucket_name,
-    ) is not None
-    logging.info('RENDERING - Video has audio track? %s', has_audio)
-    speech_track_path = StorageService.download_gcs_file(
-        file_path=Utils.TriggerFile(
-            str(
-                pathlib.Path(
-                    root_video_folder, ConfigService.OUTPUT_SPEECH_FILE
+            ),
+            Utils.TriggerFile(
+                str(
+                    pathlib.Path(
+                        root_video_folder, ConfigService.OUTPUT_SPEECH_FILE
+                    )
                 )
-            )
-        ),
+            ),
+            Utils.TriggerFile(
+                str(
+                    pathlib.Path(
+                        root_video_folder, ConfigService.OUTPUT_MUSIC_FILE
+                    )
+                )
+            ),
+            Utils.TriggerFile(
+                str(
+                    pathlib.Path(
+                        self.render_file.gcs_folder,
+                        ConfigService.INPUT_SQUARE_CROP_FILE.replace(
+                            '.txt', video_ext
+                        )
+                    )
+                )
+            ),
+            Utils.TriggerFile(
+                str(
+                    pathlib.Path(
+                        self.render_file.gcs_folder,
+                        ConfigService.INPUT_VERTICAL_CROP_FILE.replace(
+                            '.txt', video_ext
+                        )
+                    )
+                )
+            ),
+        ],
         output_dir=tmp_dir,
         bucket_name=self.gcs_bucket_name,
+        sliced=True,
+        cached=True,
     )
-    logging.info('RENDERING - Speech track path: %s', speech_track_path)
-    music_track_path = StorageService.download_gcs_file(
-        file_path=Utils.TriggerFile(
-            str(
-                pathlib.Path(
-                    root_video_folder, ConfigService.OUTPUT_MUSIC_FILE
+    input_contents = StorageAsync.download_gcs_files(
+        file_paths=[
+            Utils.TriggerFile(
+                str(
+                    pathlib.
+                    Path(root_video_folder, ConfigService.OUTPUT_LANGUAGE_FILE)
                 )
-            )
-        ),
-        output_dir=tmp_dir,
+            ),
+            self.render_file,
+        ],
         bucket_name=self.gcs_bucket_name,
+        fetch_contents=True,
+        small=True,
     )
-    logging.info('RENDERING - Music track path: %s', music_track_path)
-    video_language = StorageService.download_gcs_file(
-        file_path=Utils.TriggerFile(
-            str(
-                pathlib.
-                Path(root_video_folder, ConfigService.OUTPUT_LANGUAGE_FILE)
-            )
+    (
+        (
+            video_file_path,
+            audio_file_path,
+            speech_track_path,
+            music_track_path,
+            square_video_file_path,
+            vertical_video_file_path,
         ),
-        output_dir=tmp_dir,
-        bucket_name=self.gcs_bucket_name,
-        fetch_contents=True,
-    ) or ConfigService.DEFAULT_VIDEO_LANGUAGE
+        (video_language, render_file_contents),
+    ) = asyncio.run(_gather(input_files, input_contents))
+    video_language = video_language or ConfigService.DEFAULT_VIDEO_LANGUAGE
+    has_audio = audio_file_path is not None
+    logging.info('RENDERING - Video file path: %s', video_file_path)
+    logging.info('RENDERING - Video has audio track? %s', has_audio)
+    logging.info('RENDERING - Speech track path: %s', speech_track_path)
+    logging.info('RENDERING - Music track path: %s', music_track_path)
     logging.info('RENDERING - Video language: %s', video_language)
-    square_video_file_path = StorageService.download_gcs_file(
-        file_path=Utils.TriggerFile(
-            str(
-                pathlib.Path(
-                    self.render_file.gcs_folder,
-                    ConfigService.INPUT_SQUARE_CROP_FILE.replace(
-                        '.txt', video_ext
-                    )
-                )
-            )
-        ),
-        output_dir=tmp_dir,
-        bucket_name=self.gcs_bucket_name,
-    )
     logging.info(
         'RENDERING - Square video file path: %s', square_video_file_path
     )
-    vertical_video_file_path = StorageService.download_gcs_file(
-        file_path=Utils.TriggerFile(
-            str(
-                pathlib.Path(
-                    self.render_file.gcs_folder,
-                    ConfigService.INPUT_VERTICAL_CROP_FILE.replace(
-                        '.txt', video_ext
-                    )
-                )
-            )
-        ),
-        output_dir=tmp_dir,
-        bucket_name=self.gcs_bucket_name,
-    )
     logging.info(
         'RENDERING - Vertical video file path: %s', vertical_video_file_path
     )
-    render_file_contents = StorageService.download_gcs_file(
-        file_path=self.render_file,
-        bucket_name=self.gcs_bucket_name,
-        fetch_contents=True,
-    )
     video_variant = list(
         map(
             _video_variant_mapper,
             enumerate(json.loads(render_file_contents.decode('utf-8'))),
         )
     )[0]
+    if (
+        has_audio and video_variant.render_settings.use_music_overlay
+        and not (speech_track_path and music_track_path)
+    ):
+      speech_track_path, music_track_path = _separate_audio_tracks(
+          audio_file_path=audio_file_path,
+          gcs_folder=root_video_folder,
+          gcs_bucket_name=self.gcs_bucket_name,
+      )
+    video_probe = StorageService.probe_gcs_media(
+        file_path=Utils.TriggerFile(video_file_name),
+        bucket_name=self.gcs_bucket_name,
+        local_file_path=video_file_path,
+    )
     combos_dir = tempfile.mkdtemp()
     rendered_combos = {}
     rendered_variant_paths = _render_video_variant(
@@ -358,6 +368,7 @@ class Combiner:
         gcs_folder_path=self.render_file.gcs_folder,
         gcs_bucket_name=self.gcs_bucket_name,
         video_file_path=video_file_path,
+        video_duration=video_probe.duration,
         square_video_file_path=square_video_file_path,
         vertical_video_file_path=vertical_video_file_path,
         has_audio=has_audio,
@@ -389,6 +400,7 @@ class Combiner:
         source_directory=combos_dir,
         bucket_name=self.gcs_bucket_name,
         target_dir=self.render_file.gcs_folder,
+        incremental=True,
     )
 
     self.check_finalise_render(variants_count=int(variant_id.split('-')[1]))
@@ -413,37 +425,37 @@ class Combiner:
         ), None
     )
     logging.info('RENDERING - Video file name: %s', video_file_name)
-    video_file_path = StorageService.download_gcs_file(
-        file_path=Utils.TriggerFile(video_file_name),
-        output_dir=tmp_dir,
-        bucket_name=self.gcs_bucket_name,
-    )
-    logging.info('RENDERING - Video file path: %s', video_file_path)
-    square_crop_file_path = StorageService.download_gcs_file(
-        file_path=Utils.TriggerFile(
-            str(
-                pathlib.Path(
-                    self.render_file.gcs_folder,
-                    ConfigService.INPUT_SQUARE_CROP_FILE
+    (
+        video_file_path,
+        square_crop_file_path,
+        vertical_crop_file_path,
+    ) = StorageService.download_gcs_files(
+        file_paths=[
+            Utils.TriggerFile(video_file_name),
+            Utils.TriggerFile(
+                str(
+                    pathlib.Path(
+                        self.render_file.gcs_folder,
+                        ConfigService.INPUT_SQUARE_CROP_FILE
+                    )
                 )
-            )
-        ),
-        output_dir=tmp_dir,
-        bucket_name=self.gcs_bucket_name,
-    )
-    logging.info('RENDERING - Square crop commands: %s', square_crop_file_path)
-    vertical_crop_file_path = StorageService.download_gcs_file(
-        file_path=Utils.TriggerFile(
-            str(
-                pathlib.Path(
-                    self.render_file.gcs_folder,
-                    ConfigService.INPUT_VERTICAL_CROP_FILE
+            ),
+            Utils.TriggerFile(
+                str(
+                    pathlib.Path(
+                        self.render_file.gcs_folder,
+                        ConfigService.INPUT_VERTICAL_CROP_FILE
+                    )
                 )
-            )
-        ),
+            ),
+        ],
         output_dir=tmp_dir,
         bucket_name=self.gcs_bucket_name,
+        sliced=True,
+        cached=True,
     )
+    logging.info('RENDERING - Video file path: %s', video_file_path)
+    logging.info('RENDERING - Square crop commands: %s', square_crop_file_path)
     logging.info(
         'RENDERING - Vertical crop commands: %s', vertical_crop_file_path
     )
@@ -451,6 +463,7 @@ class Combiner:
         file_path=self.render_file,
         bucket_name=self.gcs_bucket_name,
         fetch_contents=True,
+        small=True,
     )
     video_variants = list(
         map(
@@ -506,6 +519,48 @@ class Combiner:
     logging.info('COMBINER - Initial render completed successfully!')
 
 
+async def _gather(*awaitables):
+  """Awaits the given awaitables concurrently, for use with `asyncio.run`."""
+  return await asyncio.gather(*awaitables)
+
+
+def _separate_audio_tracks(
+    audio_file_path: str,
+    gcs_folder: str,
+    gcs_bucket_name: str,
+) -> Tuple[str, str]:
+  """Splits the video's audio into speech and music tracks on demand.
+
+  This is needed for videos extracted with `CONFIG_SPLIT_AUDIO_ON_DEMAND`. The
+  tracks are uploaded to the video folder, where later renders will find them.
+
+  Args:
+    audio_file_path: The path to the audio of the video.
+    gcs_folder: The root folder of the video in GCS.
+    gcs_bucket_name: The name of the GCS bucket.
+
+  Returns:
+    A tuple with the path to the speech and music tracks.
+  """
+  # Imported here as it is only needed by renders that split the audio.
+  # pylint: disable=import-outside-toplevel
+  import audio as AudioService
+
+  logging.info('RENDERING - Splitting audio into speech and music tracks...')
+  output_dir = tempfile.mkdtemp()
+  speech_track_path, music_track_path = AudioService.separate_audio_tracks(
+      output_dir=output_dir,
+      audio_file_path=audio_file_path,
+  )
+  # Files uploaded meanwhile by concurrent renders are kept.
+  StorageService.upload_gcs_dir(
+      source_directory=output_dir,
+      bucket_name=gcs_bucket_name,
+      target_dir=gcs_folder,
+  )
+  return speech_track_path, music_track_path
+
+
 def _video_variant_mapper(index_variant_dict_tuple: Tuple[int, Dict[str, Any]]):
   index, variant_dict = index_variant_dict_tuple
   segment_dicts = variant_dict.pop('av_segments', None)
@@ -624,6 +679,7 @@ def _create_cropped_video(
             cropped_video_path,
         ],
         description=(f'render full {format_type} format using ffmpeg'),
+        priority=Utils.JobPriority.HIGH,
     )
   return cropped_video_path
 
@@ -633,6 +689,7 @@ def _render_video_variant(
     gcs_folder_path: str,
     gcs_bucket_name: str,
     video_file_path: str,
+    video_duration: float,
     square_video_file_path: Optional[str],
     vertical_video_file_path: Optional[str],
     has_audio: bool,
@@ -649,6 +706,7 @@ def _render_video_variant(
     gcs_folder_path: The GCS folder path to use.
     gcs_bucket_name: The GCS bucket name to upload to.
     video_file_path: The path to the input video file.
+    video_duration: The duration of the input video file in seconds.
     square_video_file_path: The path to the square crop of the input video file.
     vertical_video_file_path: The path to the vertical crop of the input video
       file.
@@ -676,7 +734,6 @@ def _render_video_variant(
           shot_groups,
       )
   )
-  video_duration = Utils.get_media_duration(video_file_path)
   (
       full_av_select_filter,
       music_overlay_select_filter,
@@ -710,6 +767,8 @@ def _render_video_variant(
           'render horizontal variant with id '
           f'{video_variant.variant_id} using ffmpeg'
       ),
+      media_duration=sum(end - start for start, end in shot_timestamps),
+      priority=Utils.JobPriority.HIGH,
   )
   rendered_paths = {
       Utils.RenderFormatType.HORIZONTAL.value: {
@@ -721,6 +780,7 @@ def _render_video_variant(
         source_directory=output_dir,
         bucket_name=gcs_bucket_name,
         target_dir=gcs_folder_path,
+        incremental=True,
     )
     assets = _generate_image_assets(
         vision_model=vision_model,
@@ -784,6 +844,7 @@ def _render_video_variant(
       source_directory=output_dir,
       bucket_name=gcs_bucket_name,
       target_dir=gcs_folder_path,
+      incremental=True,
   )
   result = {'variants': {}}
   if video_variant.render_settings.generate_text_assets:
@@ -897,6 +958,7 @@ def _render_format(
         description=(
             f'render {format_type} variant with id {variant_id} using ffmpeg'
         ),
+        priority=Utils.JobPriority.HIGH,
     )
   else:
     Utils.execute_subprocess_commands(
@@ -913,6 +975,7 @@ def _render_format(
             f'render {format_type} variant with id {variant_id} and '
             'blur filter using ffmpeg'
         ),
+        priority=Utils.JobPriority.HIGH,
     )
   output = {
       'path': format_name,
@@ -922,6 +985,7 @@ def _render_format(
         source_directory=output_path,
         bucket_name=gcs_bucket_name,
         target_dir=gcs_folder_path,
+        incremental=True,
     )
     assets = _generate_image_assets(
         vision_model=vision_model,
@@ -1102,21 +1166,26 @@ def _generate_image_assets(
   assets = []
   try:
     os.makedirs(image_assets_path, exist_ok=True)
-    _extract_video_thumbnails(
-        video_file_path=video_file_path,
-        image_assets_path=image_assets_path,
-        variant_id=variant_id,
-        format_type=format_type,
-    )
-    _identify_and_extract_key_frames(
-        vision_model=vision_model,
-        video_file_path=video_file_path,
-        image_assets_path=image_assets_path,
-        gcs_bucket_name=gcs_bucket_name,
-        gcs_folder_path=gcs_folder_path,
-        output_path=output_path,
-        variant_id=variant_id,
-        format_type=format_type,
+    # Thumbnails are extracted while Gemini identifies the key frames.
+    asyncio.run(
+        _gather(
+            _extract_video_thumbnails(
+                video_file_path=video_file_path,
+                image_assets_path=image_assets_path,
+                variant_id=variant_id,
+                format_type=format_type,
+            ),
+            _identify_and_extract_key_frames(
+                vision_model=vision_model,
+                video_file_path=video_file_path,
+                image_assets_path=image_assets_path,
+                gcs_bucket_name=gcs_bucket_name,
+                gcs_folder_path=gcs_folder_path,
+                output_path=output_path,
+                variant_id=variant_id,
+                format_type=format_type,
+            ),
+        )
     )
     assets = [
         f'{ConfigService.GCS_BASE_URL}/{gcs_bucket_name}/'
@@ -1144,7 +1213,7 @@ def _generate_image_assets(
   return assets
 
 
-def _extract_video_thumbnails(
+async def _extract_video_thumbnails(
     video_file_path: str,
     image_assets_path: str,
     variant_id: int,
@@ -1158,7 +1227,7 @@ def _extract_video_thumbnails(
     variant_id: The id of the variant to render.
     format_type: The type of the output format (horizontal, vertical, square).
   """
-  Utils.execute_subprocess_commands(
+  await Utils.execute_subprocess_commands_async(
       cmds=[
           'ffmpeg',
           '-i',
@@ -1173,10 +1242,11 @@ def _extract_video_thumbnails(
           f'extract thumbnails for {format_type} type for '
           f'variant with id {variant_id} using ffmpeg'
       ),
+      priority=Utils.JobPriority.LOW,
   )
 
 
-def _identify_and_extract_key_frames(
+async def _identify_and_extract_key_frames(
     vision_model: GenerativeModel,
     video_file_path: str,
     image_assets_path: str,
@@ -1201,7 +1271,10 @@ def _identify_and_extract_key_frames(
   results = []
   try:
     gcs_video_file_path = video_file_path.replace(f'{output_path}/', '')
-    response = vision_model.generate_content(
+    # The model's async client is bound to the first event loop it is used
+    # on, so the blocking client is used from a worker thread instead.
+    response = await asyncio.to_thread(
+        vision_model.generate_content,
         [
             Part.from_uri(
                 f'gs://{gcs_bucket_name}/{gcs_folder_path}/'
@@ -1226,26 +1299,29 @@ def _identify_and_extract_key_frames(
   except Exception:
     logging.exception('Encountered error while identifying key frames!')
 
-  if results:
-    for index, key_frame_timestamp in enumerate(results):
-      Utils.execute_subprocess_commands(
-          cmds=[
-              'ffmpeg',
-              '-ss',
-              key_frame_timestamp,
-              '-i',
-              video_file_path,
-              '-frames:v',
-              '1',
-              '-q:v',
-              '2',
-              str(pathlib.Path(image_assets_path, f'{index+1}.jpg')),
-          ],
-          description=(
-              f'extract key frames for {format_type} type for '
-              f'variant with id {variant_id} using ffmpeg'
-          ),
-      )
+  await asyncio.gather(
+      *[
+          Utils.execute_subprocess_commands_async(
+              cmds=[
+                  'ffmpeg',
+                  '-ss',
+                  key_frame_timestamp,
+                  '-i',
+                  video_file_path,
+                  '-frames:v',
+                  '1',
+                  '-q:v',
+                  '2',
+                  str(pathlib.Path(image_assets_path, f'{index+1}.jpg')),
+              ],
+              description=(
+                  f'extract key frame {index+1} for {format_type} type for '
+                  f'variant with id {variant_id} using ffmpeg'
+              ),
+              priority=Utils.JobPriority.LOW,
+          ) for index, key_frame_timestamp in enumerate(results)
+      ]
+  )
 
 
 def _group_consecutive_segments(
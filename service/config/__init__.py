@@ -15,3 +15,4 @@
 """Vigenair config module."""
 
 from .config import *
+from .config import __getattr__
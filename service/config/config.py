@@ -18,10 +18,10 @@ This module contains all configuration constants and runtime variables used by
 Vigenair.
 """
 
+import json
 import os
-
-import torch
-from vertexai import generative_models
+import sys
+from typing import Any
 
 GCP_PROJECT_ID = os.environ.get('GCP_PROJECT_ID', 'my-gcp-project')
 GCP_LOCATION = os.environ.get('GCP_LOCATION', 'us-central1')
@@ -34,6 +34,21 @@ CONFIG_TRANSCRIPTION_MODEL_WHISPER_GCS_BUCKET = os.environ.get(
 CONFIG_TRANSCRIPTION_MODEL_WHISPER = os.environ.get(
     'CONFIG_TRANSCRIPTION_MODEL_WHISPER', 'small'
 )
+CONFIG_TRANSCRIPTION_MODEL_WHISPER_CACHE_MAX_SIZE = int(
+    os.environ.get(
+        'CONFIG_TRANSCRIPTION_MODEL_WHISPER_CACHE_MAX_SIZE',
+        '2000000000'  # 2 GB, 0 disables keeping models loaded
+    )
+)
+CONFIG_TRANSCRIPTION_MODEL_WHISPER_PRELOAD = os.environ.get(
+    'CONFIG_TRANSCRIPTION_MODEL_WHISPER_PRELOAD', 'false'
+).lower() == 'true'
+CONFIG_SPLEETER_IN_PROCESS = os.environ.get(
+    'CONFIG_SPLEETER_IN_PROCESS', 'true'
+).lower() == 'true'
+CONFIG_SPLIT_AUDIO_ON_DEMAND = os.environ.get(
+    'CONFIG_SPLIT_AUDIO_ON_DEMAND', 'false'
+).lower() == 'true'
 CONFIG_TRANSCRIPTION_MODEL_GEMINI = os.environ.get(
     'CONFIG_TRANSCRIPTION_MODEL_GEMINI', 'gemini-2.5-flash'
 )
@@ -57,6 +72,162 @@ CONFIG_DEFAULT_FADE_OUT_DURATION = os.environ.get(
     '1'  # seconds
 )
 
+CONFIG_STORAGE_BACKEND = os.environ.get(
+    'CONFIG_STORAGE_BACKEND',
+    'gcs'  # 'gcs', 'local' or 'memory'
+)
+CONFIG_STORAGE_LOCAL_DIR = os.environ.get(
+    'CONFIG_STORAGE_LOCAL_DIR', '/tmp/vigenair-storage'
+)
+CONFIG_STORAGE_IO_REPORT = os.environ.get(
+    'CONFIG_STORAGE_IO_REPORT', 'false'
+).lower() == 'true'
+
+CONFIG_GCS_CONNECTION_POOL_SIZE = int(
+    os.environ.get('CONFIG_GCS_CONNECTION_POOL_SIZE', '32')
+)
+CONFIG_GCS_TRANSFER_WORKER_TYPE = os.environ.get(
+    'CONFIG_GCS_TRANSFER_WORKER_TYPE',
+    'process'  # 'process' or 'thread'
+)
+CONFIG_GCS_TRANSFER_MAX_WORKERS = int(
+    os.environ.get('CONFIG_GCS_TRANSFER_MAX_WORKERS', '8')
+)
+CONFIG_GCS_ASYNC_MAX_CONCURRENCY = int(
+    os.environ.get('CONFIG_GCS_ASYNC_MAX_CONCURRENCY', '16')
+)
+# Retry policy per GCS operation type: exponential backoff between attempts
+# (initial, maximum and multiplier), overall deadline and per-request timeout,
+# all in seconds. Override any of them via a JSON object in the environment,
+# e.g. '{"read": {"deadline": 60}}'.
+_CONFIG_GCS_RETRY_OVERRIDES = json.loads(
+    os.environ.get('CONFIG_GCS_RETRY_POLICIES', '{}')
+)
+CONFIG_GCS_RETRY_POLICIES = {
+    op_type: {**policy, **_CONFIG_GCS_RETRY_OVERRIDES.get(op_type, {})}
+    for op_type, policy in {
+        'metadata': {
+            'initial': 0.5,
+            'maximum': 8,
+            'multiplier': 2,
+            'deadline': 30,
+            'timeout': 10,
+        },
+        'list': {
+            'initial': 0.5,
+            'maximum': 8,
+            'multiplier': 2,
+            'deadline': 60,
+            'timeout': 30,
+        },
+        'read': {
+            'initial': 1,
+            'maximum': 32,
+            'multiplier': 2,
+            'deadline': 120,
+            'timeout': 60,
+        },
+        'write': {
+            'initial': 1,
+            'maximum': 32,
+            'multiplier': 2,
+            'deadline': 300,
+            'timeout': 120,
+        },
+        'delete': {
+            'initial': 0.5,
+            'maximum': 8,
+            'multiplier': 2,
+            'deadline': 30,
+            'timeout': 10,
+        },
+    }.items()
+}
+CONFIG_GCS_HEDGED_READS = os.environ.get(
+    'CONFIG_GCS_HEDGED_READS', 'false'
+).lower() == 'true'
+CONFIG_GCS_HEDGE_MAX_SIZE = int(
+    os.environ.get(
+        'CONFIG_GCS_HEDGE_MAX_SIZE',
+        '1000000'  # 1 MB
+    )
+)
+CONFIG_GCS_HEDGE_PERCENTILE = float(
+    os.environ.get('CONFIG_GCS_HEDGE_PERCENTILE', '95')
+)
+CONFIG_GCS_HEDGE_DEFAULT_DELAY = float(
+    os.environ.get(
+        'CONFIG_GCS_HEDGE_DEFAULT_DELAY',
+        '0.5'  # seconds, until enough latencies have been observed
+    )
+)
+CONFIG_GCS_SLICED_TRANSFER_THRESHOLD = int(
+    os.environ.get(
+        'CONFIG_GCS_SLICED_TRANSFER_THRESHOLD',
+        '100000000'  # 100 MB
+    )
+)
+CONFIG_GCS_SLICED_TRANSFER_CHUNK_SIZE = int(
+    os.environ.get(
+        'CONFIG_GCS_SLICED_TRANSFER_CHUNK_SIZE',
+        '33554432'  # 32 MiB
+    )
+)
+CONFIG_GCS_CACHE_DIR = os.environ.get(
+    'CONFIG_GCS_CACHE_DIR', '/tmp/vigenair-cache'
+)
+CONFIG_GCS_CACHE_MAX_SIZE = int(
+    os.environ.get(
+        'CONFIG_GCS_CACHE_MAX_SIZE',
+        '5000000000'  # 5 GB, 0 disables the cache
+    )
+)
+
+CONFIG_FFMPEG_STREAM_INPUT = os.environ.get(
+    'CONFIG_FFMPEG_STREAM_INPUT', 'false'
+).lower() == 'true'
+CONFIG_FFMPEG_STREAM_CHUNK_SIZE = int(
+    os.environ.get(
+        'CONFIG_FFMPEG_STREAM_CHUNK_SIZE',
+        '8388608'  # 8 MiB
+    )
+)
+
+CONFIG_FFMPEG_CORE_BUDGET = int(
+    os.environ.get(
+        'CONFIG_FFMPEG_CORE_BUDGET',
+        '0'  # 0 uses all cores
+    )
+)
+CONFIG_FFMPEG_MAX_JOBS = int(
+    os.environ.get(
+        'CONFIG_FFMPEG_MAX_JOBS',
+        '0'  # 0 allows one job per core of the budget
+    )
+)
+CONFIG_FFMPEG_MAX_JOB_CORES = int(
+    os.environ.get(
+        'CONFIG_FFMPEG_MAX_JOB_CORES',
+        '0'  # 0 allows half of the budget per job
+    )
+)
+
+CONFIG_SUBPROCESS_TIMEOUT = float(
+    os.environ.get(
+        'CONFIG_SUBPROCESS_TIMEOUT',
+        '0'  # seconds, 0 disables the timeout
+    )
+)
+CONFIG_SUBPROCESS_OUTPUT_BUFFER_LINES = int(
+    os.environ.get('CONFIG_SUBPROCESS_OUTPUT_BUFFER_LINES', '100')
+)
+CONFIG_SUBPROCESS_PROGRESS_LOG_INTERVAL = float(
+    os.environ.get(
+        'CONFIG_SUBPROCESS_PROGRESS_LOG_INTERVAL',
+        '10'  # seconds
+    )
+)
+
 CONFIG_BACKEND_VERSION = os.environ.get('CONFIG_BACKEND_VERSION', 'v1')
 
 USER_AGENT_ID = f'cloud-solutions/mas-vigenair-backend-{CONFIG_BACKEND_VERSION}'
@@ -65,22 +236,6 @@ USER_AGENT_ID = f'cloud-solutions/mas-vigenair-backend-{CONFIG_BACKEND_VERSION}'
 # https://en.wikipedia.org/wiki/Fade_(audio_engineering)#:~:text=Appropriate%20fade%2Din%20time,10ms.%5B14%5D
 CONFIG_DEFAULT_FADE_OUT_BUFFER = 0.1
 
-CONFIG_DEFAULT_SAFETY_CONFIG = {
-    generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: (
-        generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH
-    ),
-    generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: (
-        generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH
-    ),
-    generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: (
-        generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH
-    ),
-    generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: (
-        generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH
-    ),
-}
-
-DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
 INPUT_FILENAME = 'input'
 INPUT_RENDERING_FILE = 'render.json'
 INPUT_RENDERING_FINALISE_FILE = 'finalise.txt'
@@ -113,6 +268,12 @@ OUTPUT_COMBINATIONS_FILE = 'combos.json'
 OUTPUT_AV_SEGMENTS_DIR = 'av_segments_cuts'
 OUTPUT_ANALYSIS_CHUNKS_DIR = 'analysis_chunks'
 OUTPUT_COMBINATION_ASSETS_DIR = 'assets'
+OUTPUT_STORAGE_IO_DIR = 'storage_io'
+OUTPUT_MEDIA_PROBE_SUFFIX = '.probe.json'
+# Top-level folder for media probes, outside of the watched video folders.
+OUTPUT_MEDIA_PROBES_DIR = '.vigenair-probes'
+# Top-level folder for the parts of conditional sliced uploads.
+OUTPUT_PARTIAL_UPLOADS_DIR = '.vigenair-uploads'
 OUTPUT_COMBINED_VIDEOS_DIR = 'combined_videos'  # Folder for combined videos
 GCS_BASE_URL = 'https://storage.mtls.cloud.google.com'
 
@@ -266,3 +427,48 @@ Provide precise timestamps in the format [minutes:seconds]. Once you've identifi
 Output a list of timestamps along with a brief explanation of why each frame is significant.
 Do not output any other text before or after the timestamps list.
 """
+
+
+def __getattr__(name: str) -> Any:
+  """Resolves the runtime variables that are slow to import on first use.
+
+  `CONFIG_DEFAULT_SAFETY_CONFIG` needs the Vertex AI SDK and `DEVICE` needs
+  torch, which would otherwise be imported by every trigger.
+
+  Args:
+    name: The name of the variable.
+
+  Returns:
+    The value of the variable.
+
+  Raises:
+    AttributeError: If the variable does not exist.
+  """
+  # pylint: disable=import-outside-toplevel
+  if name == 'CONFIG_DEFAULT_SAFETY_CONFIG':
+    from vertexai import generative_models
+    value = {
+        generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: (
+            generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH
+        ),
+        generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: (
+            generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH
+        ),
+        generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: (
+            generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH
+        ),
+        generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: (
+            generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH
+        ),
+    }
+  elif name == 'DEVICE':
+    import torch
+    value = 'cuda' if torch.cuda.is_available() else 'cpu'
+  else:
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+  # Cached on the `config` package too, as it is what callers read from and
+  # it only falls back to this hook for attributes it doesn't have.
+  globals()[name] = value
+  if __package__:
+    setattr(sys.modules[__package__], name, value)
+  return value
@@ -24,7 +24,7 @@ import logging
 import os
 import pathlib
 import tempfile
-from typing import Sequence, Tuple
+from typing import Optional, Sequence, Tuple
 
 import audio as AudioService
 import config as ConfigService
@@ -77,6 +77,7 @@ def _process_video_with_audio(
       source_directory=output_dir,
       bucket_name=gcs_bucket_name,
       target_dir=media_file.gcs_folder,
+      incremental=True,
   )
   if size == 1:
     extract_audio(
@@ -180,6 +181,7 @@ def extract_audio(media_file: Utils.TriggerFile, gcs_bucket_name: str):
       source_directory=tmp_dir,
       bucket_name=gcs_bucket_name,
       target_dir=media_file.gcs_root_folder,
+      incremental=True,
   )
   _check_finalise_extract_audio(
       total_count=(
@@ -199,50 +201,49 @@ def _analyse_audio(
     transcription_service: Utils.TranscriptionService,
     gcs_folder: str,
     gcs_bucket_name=str,
-) -> Tuple[str, str, str, str, float]:
-  """Runs audio analysis in parallel."""
-  vocals_file_path = None
-  music_file_path = None
-  transcription_dataframe = None
+) -> Tuple[Optional[str], Optional[str], str, str, float]:
+  """Runs audio analysis in parallel.
 
-  with concurrent.futures.ProcessPoolExecutor() as process_executor:
-    futures_dict = {
-        process_executor.submit(
-            AudioService.transcribe_audio,
+  With `CONFIG_SPLIT_AUDIO_ON_DEMAND`, the audio is not split into vocals and
+  music tracks, which are then only produced by renders using them.
+  """
+  # Splits and transcribes in this process, so that the spleeter and Whisper
+  # models stay loaded for subsequent invocations on this instance. Both
+  # release the GIL while running their models.
+  with concurrent.futures.ThreadPoolExecutor(max_workers=1) as thread_executor:
+    split_audio_future = None
+    if not ConfigService.CONFIG_SPLIT_AUDIO_ON_DEMAND:
+      split_audio_future = thread_executor.submit(
+          AudioService.split_audio,
+          output_dir=output_dir,
+          audio_file_path=audio_file_path,
+          prefix='' if root_dir == output_dir else f'{file_id}_',
+      )
+    transcription_dataframe, language, probability = (
+        AudioService.transcribe_audio(
             output_dir=output_dir,
             audio_file_path=audio_file_path,
             transcription_service=transcription_service,
             gcs_folder=gcs_folder,
             gcs_bucket_name=gcs_bucket_name,
-        ): 'transcribe_audio',
-        process_executor.submit(
-            AudioService.split_audio,
-            output_dir=output_dir,
-            audio_file_path=audio_file_path,
-            prefix='' if root_dir == output_dir else f'{file_id}_',
-        ): 'split_audio',
-    }
-
-    for future in concurrent.futures.as_completed(futures_dict):
-      source = futures_dict[future]
-      match source:
-        case 'transcribe_audio':
-          transcription_dataframe, language, probability = future.result()
-          logging.info(
-              'THREADING - transcribe_audio finished for chunk#%s!',
-              file_id,
-          )
-          logging.info(
-              'TRANSCRIPTION - Transcription dataframe for chunk#%s: %r',
-              file_id,
-              transcription_dataframe.to_json(orient='records'),
-          )
-        case 'split_audio':
-          vocals_file_path, music_file_path = future.result()
-          logging.info(
-              'THREADING - split_audio finished for chunk#%s!',
-              file_id,
-          )
+        )
+    )
+    logging.info(
+        'THREADING - transcribe_audio finished for chunk#%s!',
+        file_id,
+    )
+    logging.info(
+        'TRANSCRIPTION - Transcription dataframe for chunk#%s: %r',
+        file_id,
+        transcription_dataframe.to_json(orient='records'),
+    )
+    vocals_file_path, music_file_path = None, None
+    if split_audio_future:
+      vocals_file_path, music_file_path = split_audio_future.result()
+      logging.info(
+          'THREADING - split_audio finished for chunk#%s!',
+          file_id,
+      )
 
   return (
       vocals_file_path,
@@ -19,6 +19,7 @@ input video file and create coherent audio/video segments.
 """
 
 import concurrent.futures
+import contextlib
 import dataclasses
 import json
 import logging
@@ -38,7 +39,6 @@ import extractor.video_extractor as VideoExtractor
 import pandas as pd
 import storage as StorageService
 import utils as Utils
-import vertexai
 from vertexai.generative_models import GenerativeModel, Part
 import video as VideoService
 
@@ -82,11 +82,9 @@ class Extractor:
     """
     self.gcs_bucket_name = gcs_bucket_name
     self.media_file = media_file
-    vertexai.init(
-        project=ConfigService.GCP_PROJECT_ID,
-        location=ConfigService.GCP_LOCATION,
+    self.vision_model = Utils.get_generative_model(
+        ConfigService.CONFIG_VISION_MODEL
     )
-    self.vision_model = GenerativeModel(ConfigService.CONFIG_VISION_MODEL)
 
   def initial_extract(self):
     """Extracts all the available data from the input video."""
@@ -96,6 +94,13 @@ class Extractor:
         file_path=self.media_file,
         output_dir=tmp_dir,
         bucket_name=self.gcs_bucket_name,
+        sliced=True,
+        cached=True,
+    )
+    StorageService.probe_gcs_media(
+        file_path=self.media_file,
+        bucket_name=self.gcs_bucket_name,
+        local_file_path=input_video_file_path,
     )
     input_audio_file_path = AudioService.extract_audio(input_video_file_path)
     if input_audio_file_path:
@@ -103,9 +108,14 @@ class Extractor:
           source_directory=tmp_dir,
           bucket_name=self.gcs_bucket_name,
           target_dir=self.media_file.gcs_folder,
+          incremental=True,
       )
 
-    with concurrent.futures.ProcessPoolExecutor() as process_executor:
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=2,
+        initializer=Utils.share_ffmpeg_core_budget,
+        initargs=(2,),
+    ) as process_executor:
       concurrent.futures.wait([
           process_executor.submit(
               AudioExtractor.process_audio,
@@ -127,13 +137,24 @@ class Extractor:
     """Extracts audio information from the input video."""
     AudioExtractor.extract_audio(self.media_file, self.gcs_bucket_name)
 
-  def extract_audio_finalise(self, output_dir: str) -> pd.DataFrame:
-    """Combines all generated audio analysis files together."""
+  def extract_audio_finalise(
+      self,
+      output_dir: str,
+      files_snapshot: StorageService.PrefixSnapshot,
+  ) -> pd.DataFrame:
+    """Combines all generated audio analysis files together.
+
+    Args:
+      output_dir: The local directory to store the combined files in.
+      files_snapshot: A listing of all files in the root video folder.
+
+    Returns:
+      The combined transcription data.
+    """
     logging.info('EXTRACTOR - Finalising audio extraction...')
     transcription_dataframes = [
         pd.DataFrame(json.loads(json_file_contents.decode('utf-8')))
-        for json_file_contents in StorageService.filter_files(
-            bucket_name=self.gcs_bucket_name,
+        for json_file_contents in files_snapshot.filter_files(
             prefix=f'{self.media_file.gcs_folder}/',
             suffix=ConfigService.OUTPUT_TRANSCRIPT_FILE,
             fetch_content=True,
@@ -149,22 +170,19 @@ class Extractor:
     )
     output_subdir = audio_output_dir if is_chunk else output_dir
     os.makedirs(output_subdir, exist_ok=True)
-    vocals_files = StorageService.filter_files(
-        bucket_name=self.gcs_bucket_name,
+    vocals_files = files_snapshot.filter_files(
         prefix=f'{self.media_file.gcs_root_folder}/',
         suffix=ConfigService.OUTPUT_SPEECH_FILE,
         download=True,
         download_dir=output_subdir,
     )
-    music_files = StorageService.filter_files(
-        bucket_name=self.gcs_bucket_name,
+    music_files = files_snapshot.filter_files(
         prefix=f'{self.media_file.gcs_root_folder}/',
         suffix=ConfigService.OUTPUT_MUSIC_FILE,
         download=True,
         download_dir=output_subdir,
     )
-    StorageService.filter_files(
-        bucket_name=self.gcs_bucket_name,
+    files_snapshot.filter_files(
         prefix=f'{self.media_file.gcs_root_folder}/',
         suffix=f'.{ConfigService.OUTPUT_SUBTITLES_TYPE}',
         download=True,
@@ -198,8 +216,7 @@ class Extractor:
     language_probability_dict = {}
     language_infos = [
         json.loads(json_file_contents.decode('utf-8'))
-        for json_file_contents in StorageService.filter_files(
-            bucket_name=self.gcs_bucket_name,
+        for json_file_contents in files_snapshot.filter_files(
             prefix=f'{self.media_file.gcs_folder}/',
             suffix=ConfigService.OUTPUT_LANGUAGE_INFO_FILE,
             fetch_content=True,
@@ -278,14 +295,25 @@ class Extractor:
     """Extracts visual information from the input video."""
     VideoExtractor.extract_video(self.media_file, self.gcs_bucket_name)
 
-  def extract_video_finalise(self, output_dir: str):
-    """Combines all generated <id>_analysis.json into a single one."""
+  def extract_video_finalise(
+      self,
+      output_dir: str,
+      files_snapshot: StorageService.PrefixSnapshot,
+  ):
+    """Combines all generated <id>_analysis.json into a single one.
+
+    Args:
+      output_dir: The local directory to store the combined analysis in.
+      files_snapshot: A listing of all files in the root video folder.
+
+    Returns:
+      The combined video annotation results.
+    """
     logging.info('EXTRACTOR - Finalising video extraction...')
     annotation_results = [
         VideoService.video_annotation_from_json(
             json.loads(json_file_contents.decode('utf-8'))
-        ) for json_file_contents in StorageService.filter_files(
-            bucket_name=self.gcs_bucket_name,
+        ) for json_file_contents in files_snapshot.filter_files(
             prefix=f'{self.media_file.gcs_root_folder}/',
             suffix=ConfigService.OUTPUT_ANALYSIS_FILE,
             fetch_content=True,
@@ -345,27 +373,26 @@ class Extractor:
     """Combines all analysis outpus and creates the optimised segments."""
     logging.info('EXTRACTOR - Finalising extraction...')
     tmp_dir = tempfile.mkdtemp()
+    files_snapshot = StorageService.PrefixSnapshot(
+        bucket_name=self.gcs_bucket_name,
+        prefix=f'{self.media_file.gcs_root_folder}/',
+    )
     video_file_name = next(
         iter(
-            StorageService.filter_video_files(
+            files_snapshot.filter_video_files(
                 prefix=(
                     f'{self.media_file.gcs_root_folder}/'
                     f'{ConfigService.INPUT_FILENAME}'
                 ),
-                bucket_name=self.gcs_bucket_name,
                 first_only=True,
             )
         ), None
     )
-    input_video_file_path = StorageService.download_gcs_file(
-        file_path=Utils.TriggerFile(video_file_name),
-        output_dir=tmp_dir,
-        bucket_name=self.gcs_bucket_name,
+    annotation_results = self.extract_video_finalise(tmp_dir, files_snapshot)
+    transcription_dataframe = self.extract_audio_finalise(
+        tmp_dir, files_snapshot
     )
 
-    annotation_results = self.extract_video_finalise(tmp_dir)
-    transcription_dataframe = self.extract_audio_finalise(tmp_dir)
-
     optimised_av_segments = _create_optimised_segments(
         annotation_results,
         transcription_dataframe,
@@ -374,12 +401,21 @@ class Extractor:
         'SEGMENTS - Optimised segments: %r',
         optimised_av_segments.to_json(orient='records')
     )
-    self.finalise_av_segments(
-        tmp_dir,
-        input_video_file_path,
-        video_file_name,
-        optimised_av_segments,
-    )
+    with contextlib.ExitStack() as stack:
+      input_video_file_path = StorageService.open_gcs_input(
+          stack,
+          file_path=Utils.TriggerFile(video_file_name),
+          output_dir=tmp_dir,
+          bucket_name=self.gcs_bucket_name,
+          sliced=True,
+          cached=True,
+      )
+      self.finalise_av_segments(
+          tmp_dir,
+          input_video_file_path,
+          video_file_name,
+          optimised_av_segments,
+      )
     logging.info('EXTRACTOR - Extraction completed successfully!')
 
   def finalise_av_segments(
@@ -415,6 +451,7 @@ class Extractor:
         source_directory=tmp_dir,
         bucket_name=self.gcs_bucket_name,
         target_dir=self.media_file.gcs_root_folder,
+        incremental=True,
     )
 
   def cut_and_annotate_av_segments(
@@ -514,6 +551,8 @@ class Extractor:
       )
 
       tmp_dir = tempfile.mkdtemp()
+      # Keeps streamed segment inputs open until the concatenation is done.
+      stack = contextlib.ExitStack()
 
       try:
           # ========================================
@@ -523,6 +562,7 @@ class Extractor:
               file_path=self.media_file,
               bucket_name=self.gcs_bucket_name,
               fetch_contents=True,
+              small=True,
           )
 
           # Check if file was downloaded successfully
@@ -571,7 +611,8 @@ class Extractor:
               ))
 
               try:
-                  file_path = StorageService.download_gcs_file(
+                  file_path = StorageService.open_gcs_input(
+                      stack,
                       file_path=Utils.TriggerFile(seg_path),
                       output_dir=tmp_dir,
                       bucket_name=self.gcs_bucket_name,
@@ -615,6 +656,7 @@ class Extractor:
                   'ffmpeg',
                   '-f', 'concat',
                   '-safe', '0',
+                  '-protocol_whitelist', 'file,http,tcp',
                   '-i', concat_file_path,
                   '-c', 'copy',
                   combined_video_path,
@@ -656,6 +698,7 @@ class Extractor:
           raise
 
       finally:
+          stack.close()
           # Cleanup temp directory
           if os.path.exists(tmp_dir):
               shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -757,12 +800,6 @@ class Extractor:
             )
         ), None
     )
-    input_video_file_path = StorageService.download_gcs_file(
-        file_path=Utils.TriggerFile(video_file_name),
-        output_dir=tmp_dir,
-        bucket_name=self.gcs_bucket_name,
-    )
-
     av_segments_file_path = StorageService.download_gcs_file(
         file_path=Utils.TriggerFile(
             str(
@@ -791,18 +828,28 @@ class Extractor:
         file_path=self.media_file,
         bucket_name=self.gcs_bucket_name,
         fetch_contents=True,
+        small=True,
     )
     av_segment_markers = [
         AvSegmentSplitMarker(**segment_marker)
         for segment_marker in json.loads(split_file_contents.decode('utf-8'))
     ]
     av_segments = _finalise_split(av_segments, av_segment_markers)
-    self.finalise_av_segments(
-        tmp_dir,
-        input_video_file_path,
-        video_file_name,
-        av_segments,
-    )
+    with contextlib.ExitStack() as stack:
+      input_video_file_path = StorageService.open_gcs_input(
+          stack,
+          file_path=Utils.TriggerFile(video_file_name),
+          output_dir=tmp_dir,
+          bucket_name=self.gcs_bucket_name,
+          sliced=True,
+          cached=True,
+      )
+      self.finalise_av_segments(
+          tmp_dir,
+          input_video_file_path,
+          video_file_name,
+          av_segments,
+      )
     StorageService.delete_gcs_file(
         file_path=Utils.TriggerFile(
             str(
@@ -974,6 +1021,7 @@ def _cut_and_annotate_av_segment(
           full_screenshot_path,
       ],
       description=f'screenshot mid-segment {av_segment_id} with ffmpeg',
+      priority=Utils.JobPriority.LOW,
   )
   os.chmod(full_screenshot_path, 777)
   gcs_cut_dest_file_prefix, _ = os.path.splitext(gcs_cut_dest_file)
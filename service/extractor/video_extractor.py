@@ -46,6 +46,7 @@ def process_video(
       source_directory=output_dir,
       bucket_name=gcs_bucket_name,
       target_dir=media_file.gcs_folder,
+      incremental=True,
   )
   if size == 1:
     extract_video(media_file, gcs_bucket_name)
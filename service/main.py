@@ -20,18 +20,27 @@ This file is the target of a "Cloud Storage" Trigger (Finalize/Create) Cloud
 Function, with `gcs_file_uploaded` as the main entry point.
 """
 
+import json
 import logging
+import tempfile
+import time
 from typing import Any, Dict
 
-import combiner as CombinerService
 import config as ConfigService
-import extractor as ExtractorService
 import functions_framework
 from google.api_core.client_info import ClientInfo
 from google.cloud import logging as cloudlogging
+import storage as StorageService
+import storage.accounting as StorageAccounting
 import utils as Utils
 import os
 
+if ConfigService.CONFIG_TRANSCRIPTION_MODEL_WHISPER_PRELOAD:
+  # Loads the model as the instance starts rather than in the first
+  # transcription, which then runs on a warm model.
+  import audio as AudioService
+  AudioService.preload_whisper_model()
+
 
 @functions_framework.cloud_event
 def gcs_file_uploaded(cloud_event: Dict[str, Any]):
@@ -60,25 +69,31 @@ def gcs_file_uploaded(cloud_event: Dict[str, Any]):
   bucket = data['bucket']
   filepath = data['name']
 
+  if Utils.is_internal_file(filepath):
+    logging.info('TRIGGER - Ignoring internal file %s', filepath)
+    return
+
   logging.info('BEGIN - Processing uploaded file: %s...', filepath)
+  StorageAccounting.start_invocation()
 
   trigger_file = Utils.TriggerFile(filepath)
+  handled = True
 
   if trigger_file.is_extractor_initial_trigger():
     logging.info('TRIGGER - Extractor initial trigger')
-    extractor_instance = ExtractorService.Extractor(
+    extractor_instance = _extractor_service().Extractor(
         gcs_bucket_name=bucket, media_file=trigger_file
     )
     extractor_instance.initial_extract()
   elif trigger_file.is_extractor_audio_trigger():
     logging.info('TRIGGER - Extractor audio trigger')
-    extractor_instance = ExtractorService.Extractor(
+    extractor_instance = _extractor_service().Extractor(
         gcs_bucket_name=bucket, media_file=trigger_file
     )
     extractor_instance.extract_audio()
   elif trigger_file.is_extractor_video_trigger():
     logging.info('TRIGGER - Extractor video trigger')
-    extractor_instance = ExtractorService.Extractor(
+    extractor_instance = _extractor_service().Extractor(
         gcs_bucket_name=bucket, media_file=trigger_file
     )
     extractor_instance.extract_video()
@@ -87,46 +102,113 @@ def gcs_file_uploaded(cloud_event: Dict[str, Any]):
       or trigger_file.is_extractor_finalise_video_trigger()
   ):
     logging.info('TRIGGER - Extractor finalise audio/video trigger')
-    extractor_instance = ExtractorService.Extractor(
+    extractor_instance = _extractor_service().Extractor(
         gcs_bucket_name=bucket, media_file=trigger_file
     )
     extractor_instance.check_finalise_extraction()
   elif trigger_file.is_extractor_finalise_trigger():
     logging.info('TRIGGER - Extractor finalise trigger')
-    extractor_instance = ExtractorService.Extractor(
+    extractor_instance = _extractor_service().Extractor(
         gcs_bucket_name=bucket, media_file=trigger_file
     )
     extractor_instance.finalise_extraction()
   elif trigger_file.is_extractor_split_segment_trigger():
     logging.info('TRIGGER - Extractor split segment trigger')
-    extractor_instance = ExtractorService.Extractor(
+    extractor_instance = _extractor_service().Extractor(
         gcs_bucket_name=bucket, media_file=trigger_file
     )
     extractor_instance.split_av_segment()
   elif trigger_file.is_extractor_combine_segment_trigger():
     logging.info('TRIGGER - Extractor combine segment trigger')
-    extractor_instance = ExtractorService.Extractor(
+    extractor_instance = _extractor_service().Extractor(
       gcs_bucket_name=bucket, media_file=trigger_file
     )
     extractor_instance.combine_av_segments()
 
   elif trigger_file.is_combiner_initial_trigger():
     logging.info('TRIGGER - Combiner initial trigger')
-    combiner_instance = CombinerService.Combiner(
+    combiner_instance = _combiner_service().Combiner(
         gcs_bucket_name=bucket, render_file=trigger_file
     )
     combiner_instance.initial_render()
   elif trigger_file.is_combiner_render_trigger():
     logging.info('TRIGGER - Combiner render trigger')
-    combiner_instance = CombinerService.Combiner(
+    combiner_instance = _combiner_service().Combiner(
         gcs_bucket_name=bucket, render_file=trigger_file
     )
     combiner_instance.render()
   elif trigger_file.is_combiner_finalise_trigger():
     logging.info('TRIGGER - Combiner finalise trigger')
-    combiner_instance = CombinerService.Combiner(
+    combiner_instance = _combiner_service().Combiner(
         gcs_bucket_name=bucket, render_file=trigger_file
     )
     combiner_instance.finalise_render()
+  else:
+    handled = False
+
+  storage_io = StorageAccounting.get_summary()
+  totals = storage_io['totals']
+  logging.info(
+      'END - Finished processing uploaded file: %s. Storage I/O: %d requests, '
+      '%d bytes in, %d bytes out, %d cache hits, %d errors in %.2fs: %s',
+      filepath,
+      totals.get('requests', 0),
+      totals.get('bytes_in', 0),
+      totals.get('bytes_out', 0),
+      totals.get('cache_hits', 0),
+      totals.get('errors', 0),
+      totals.get('latency_s', 0),
+      json.dumps(storage_io['by_stage']),
+  )
+  logging.info(
+      'END - ffmpeg scheduler: %s',
+      json.dumps(Utils.get_ffmpeg_scheduler_metrics()),
+  )
+  if handled and ConfigService.CONFIG_STORAGE_IO_REPORT:
+    _upload_storage_io_report(bucket, trigger_file, storage_io)
+
+
+def _extractor_service():
+  """Imports the extractor service, only when handling an extractor trigger."""
+  # pylint: disable=import-outside-toplevel
+  import extractor as ExtractorService
+  return ExtractorService
+
 
-  logging.info('END - Finished processing uploaded file: %s.', filepath)
+def _combiner_service():
+  """Imports the combiner service, only when handling a combiner trigger."""
+  # pylint: disable=import-outside-toplevel
+  import combiner as CombinerService
+  return CombinerService
+
+
+def _upload_storage_io_report(
+    bucket: str,
+    trigger_file: Utils.TriggerFile,
+    storage_io: Dict[str, Any],
+):
+  """Uploads the storage I/O summary of an invocation next to its outputs.
+
+  The report's name matches no trigger, so uploading it only causes a no-op
+  invocation, which does not write a report itself.
+
+  Args:
+    bucket: The name of the bucket the trigger file was uploaded to.
+    trigger_file: The file that triggered the invocation.
+    storage_io: The storage I/O summary of the invocation.
+  """
+  storage_io['trigger_file'] = trigger_file.full_gcs_path
+  with tempfile.NamedTemporaryFile(
+      'w', suffix='.json', encoding='utf8'
+  ) as report_file:
+    json.dump(storage_io, report_file, indent=2)
+    report_file.flush()
+    StorageService.upload_gcs_file(
+        file_path=report_file.name,
+        bucket_name=bucket,
+        destination_file_name=(
+            f'{trigger_file.gcs_root_folder}/'
+            f'{ConfigService.OUTPUT_STORAGE_IO_DIR}/'
+            f'{int(time.time() * 1000)}.json'
+        ),
+    )
@@ -0,0 +1,149 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Replays storage trigger events against a local storage backend.
+
+This script feeds `main.gcs_file_uploaded` with events for objects stored in a
+local directory laid out as `<root>/<bucket>/<object path>`, so that the
+compute time of each trigger type can be measured without any GCS network time.
+Calls to Vertex AI and other Cloud APIs are still made as usual.
+
+Usage:
+  python replay.py --root /path/to/root --bucket my-bucket \\
+      'my-video--n--0--/input.mp4' --follow
+
+With `--follow`, trigger files written while handling an event are replayed in
+turn, emulating the chain of Eventarc triggers of a deployment.
+"""
+
+import argparse
+import collections
+import os
+import resource
+import time
+import types
+from typing import Dict, Optional
+
+_TRIGGER_TYPES = [
+    'extractor_initial',
+    'extractor_audio',
+    'extractor_video',
+    'extractor_finalise_audio',
+    'extractor_finalise_video',
+    'extractor_finalise',
+    'extractor_split_segment',
+    'extractor_combine_segment',
+    'combiner_initial',
+    'combiner_render',
+    'combiner_finalise',
+]
+
+
+def _trigger_type(name: str) -> Optional[str]:
+  """Returns the type of trigger the file represents, as dispatched by main."""
+  # Imported here as the configuration must be set up first, see `main`.
+  import utils as Utils  # pylint: disable=import-outside-toplevel
+
+  if Utils.is_internal_file(name):
+    return None
+  trigger_file = Utils.TriggerFile(name)
+  for trigger_type in _TRIGGER_TYPES:
+    if getattr(trigger_file, f'is_{trigger_type}_trigger')():
+      return trigger_type
+  return None
+
+
+def _list_generations(backend, bucket_name: str) -> Dict[str, int]:
+  return {info.name: info.generation for info in backend.list(bucket_name, '')}
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument(
+      '--root',
+      required=True,
+      help='Local directory holding one subdirectory per bucket.',
+  )
+  parser.add_argument('--bucket', required=True, help='The bucket name.')
+  parser.add_argument(
+      '--follow',
+      action='store_true',
+      help='Also replay trigger files written while handling events.',
+  )
+  parser.add_argument(
+      '--max-events',
+      type=int,
+      default=100,
+      help='The maximum number of events to replay.',
+  )
+  parser.add_argument('names', nargs='+', help='Object paths to replay.')
+  args = parser.parse_args()
+
+  # Must be set before the service modules read their configuration.
+  os.environ['CONFIG_STORAGE_BACKEND'] = 'local'
+  os.environ['CONFIG_STORAGE_LOCAL_DIR'] = args.root
+
+  # pylint: disable=import-outside-toplevel
+  import main as MainService
+  import storage as StorageService
+
+  backend = StorageService.get_backend()
+  generations = _list_generations(backend, args.bucket)
+  events = collections.deque(args.names)
+  timings = collections.defaultdict(list)
+  replayed = 0
+
+  while events and replayed < args.max_events:
+    name = events.popleft()
+    trigger_type = _trigger_type(name) or 'none'
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_before = time.process_time()
+    wall_before = time.perf_counter()
+
+    MainService.gcs_file_uploaded(
+        types.SimpleNamespace(data={'bucket': args.bucket, 'name': name})
+    )
+
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    timings[trigger_type].append((
+        time.perf_counter() - wall_before,
+        time.process_time() - cpu_before,
+        (children_after.ru_utime + children_after.ru_stime)
+        - (children_before.ru_utime + children_before.ru_stime),
+    ))
+    replayed += 1
+
+    if args.follow:
+      current_generations = _list_generations(backend, args.bucket)
+      events.extend(
+          name for name, generation in sorted(current_generations.items())
+          if generations.get(name) != generation
+          and _trigger_type(name)
+      )
+      generations = current_generations
+
+  print(
+      f'{"trigger":<28}{"events":>8}{"wall s":>10}{"cpu s":>10}'
+      f'{"child cpu s":>13}'
+  )
+  for trigger_type, samples in timings.items():
+    wall, cpu, child_cpu = (sum(values) for values in zip(*samples))
+    print(
+        f'{trigger_type:<28}{len(samples):>8}{wall:>10.2f}{cpu:>10.2f}'
+        f'{child_cpu:>13.2f}'
+    )
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,401 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Vigenair storage I/O accounting.
+
+This module records the requests, bytes transferred, latencies and cache hits
+of all storage operations, per operation and per calling stage, so that the
+I/O profile of each trigger can be reported.
+
+The calling stage of an operation is the innermost function outside the
+storage service and the standard library's concurrency modules, e.g.
+`extractor.finalise_extraction`, unless set explicitly via `stage`. Records are
+kept per process and reset by `start_invocation`, so the totals of invocations
+that overlap on the same instance are combined, and operations performed in
+child processes are not recorded.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import storage.backend as StorageBackend
+
+# Upper bounds of the latency histogram buckets, in milliseconds.
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+_SKIPPED_MODULES = (
+    'storage',
+    'asyncio',
+    'concurrent',
+    'contextlib',
+    'functools',
+    'threading',
+)
+
+_stage_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    'storage_stage', default=None
+)
+_records_lock = threading.Lock()
+_records: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+
+def _reset_after_fork():
+  global _records_lock
+  _records_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+  """Attributes storage operations within the context to the given stage."""
+  token = _stage_var.set(name)
+  try:
+    yield
+  finally:
+    _stage_var.reset(token)
+
+
+def current_stage() -> str:
+  """Returns the stage to attribute a storage operation to from this thread."""
+  explicit_stage = _stage_var.get()
+  if explicit_stage:
+    return explicit_stage
+  frame = sys._getframe(1)  # pylint: disable=protected-access
+  while frame:
+    module = frame.f_globals.get('__name__', '')
+    if module.split('.')[0] not in _SKIPPED_MODULES:
+      return f'{module.split(".")[0]}.{frame.f_code.co_name}'
+    frame = frame.f_back
+  return 'unknown'
+
+
+def bind_stage(func: Callable[..., Any]) -> Callable[..., Any]:
+  """Wraps `func` to attribute its operations to the current stage.
+
+  Use this for functions submitted to thread pools, whose threads would
+  otherwise not know which stage they are working for.
+
+  Args:
+    func: The function to wrap.
+
+  Returns:
+    The wrapped function.
+  """
+  bound_stage = current_stage()
+
+  def wrapper(*args, **kwargs):
+    with stage(bound_stage):
+      return func(*args, **kwargs)
+
+  return wrapper
+
+
+def start_invocation():
+  """Discards all records, to start accounting for a new invocation."""
+  with _records_lock:
+    _records.clear()
+
+
+def record(
+    op_name: str,
+    requests: int = 1,
+    bytes_in: int = 0,
+    bytes_out: int = 0,
+    latency_s: float = 0,
+    errors: int = 0,
+    cache_hits: int = 0,
+    cache_misses: int = 0,
+):
+  """Records a storage operation against the current stage.
+
+  Args:
+    op_name: The name of the operation, e.g. `read`.
+    requests: The number of requests the operation issued.
+    bytes_in: The number of bytes downloaded.
+    bytes_out: The number of bytes uploaded.
+    latency_s: The duration of the operation in seconds.
+    errors: The number of requests that failed.
+    cache_hits: The number of requests served from a local cache.
+    cache_misses: The number of requests that missed a local cache.
+  """
+  key = (current_stage(), op_name)
+  with _records_lock:
+    entry = _records.get(key)
+    if entry is None:
+      entry = _records[key] = {
+          'requests': 0,
+          'bytes_in': 0,
+          'bytes_out': 0,
+          'errors': 0,
+          'cache_hits': 0,
+          'cache_misses': 0,
+          'latency_s': 0,
+          'latency_ms_histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+      }
+    entry['requests'] += requests
+    entry['bytes_in'] += bytes_in
+    entry['bytes_out'] += bytes_out
+    entry['errors'] += errors
+    entry['cache_hits'] += cache_hits
+    entry['cache_misses'] += cache_misses
+    if requests:
+      entry['latency_s'] += latency_s
+      entry['latency_ms_histogram'][
+          bisect.bisect_left(LATENCY_BUCKETS_MS, latency_s * 1000)
+      ] += 1
+
+
+def get_summary() -> Dict[str, Any]:
+  """Returns the records of the current invocation.
+
+  Returns:
+    A dictionary with the `totals` of all operations, the records `by_op`, and
+    the records `by_stage` keyed by stage and then operation. Histograms count
+    operations per latency bucket, bounded as per `LATENCY_BUCKETS_MS` with a
+    final unbounded bucket.
+  """
+  with _records_lock:
+    records = {key: dict(entry) for key, entry in _records.items()}
+
+  totals = _merge(records.values())
+  by_op = {}
+  by_stage = {}
+  for (stage_name, op_name), entry in sorted(records.items()):
+    by_op[op_name] = _merge([by_op.get(op_name), entry])
+    by_stage.setdefault(stage_name, {})[op_name] = entry
+  return {
+      'totals': totals,
+      'by_op': by_op,
+      'by_stage': by_stage,
+      'latency_buckets_ms': LATENCY_BUCKETS_MS,
+  }
+
+
+def _merge(entries: Sequence[Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+  merged = {}
+  for entry in entries:
+    for name, value in (entry or {}).items():
+      if isinstance(value, list):
+        merged[name] = [
+            a + b for a, b in zip(merged.get(name, [0] * len(value)), value)
+        ]
+      else:
+        merged[name] = merged.get(name, 0) + value
+  return merged
+
+
+class AccountingBackend(StorageBackend.StorageBackend):
+  """Records all operations of another storage backend."""
+
+  def __init__(self, backend: StorageBackend.StorageBackend):
+    """Initialiser.
+
+    Args:
+      backend: The backend to perform the operations with.
+    """
+    self.backend = backend
+
+  def _call(
+      self,
+      op_name: str,
+      func: Callable[..., Any],
+      *args,
+      bytes_in: Optional[Callable[[Any], int]] = None,
+      bytes_out: Optional[Callable[[Any], int]] = None,
+  ):
+    """Calls `func` with `args` and records the call.
+
+    Args:
+      op_name: The name of the operation to record.
+      func: The backend method to call.
+      *args: The arguments to call `func` with.
+      bytes_in: Optional callable returning the downloaded bytes given the
+        result of `func`.
+      bytes_out: Optional callable returning the uploaded bytes given the
+        result of `func`.
+
+    Returns:
+      The result of `func`.
+    """
+    started = time.monotonic()
+    try:
+      result = func(*args)
+    except Exception:
+      record(op_name, latency_s=time.monotonic() - started, errors=1)
+      raise
+    record(
+        op_name,
+        bytes_in=bytes_in(result) if bytes_in else 0,
+        bytes_out=bytes_out(result) if bytes_out else 0,
+        latency_s=time.monotonic() - started,
+    )
+    return result
+
+  def stat(
+      self,
+      bucket_name: str,
+      name: str,
+  ) -> Optional[StorageBackend.ObjectInfo]:
+    return self._call('stat', self.backend.stat, bucket_name, name)
+
+  def list(
+      self,
+      bucket_name: str,
+      prefix: str,
+      match_glob: Optional[str] = None,
+  ) -> Iterator[StorageBackend.ObjectInfo]:
+    # Resolved now, as the listing may be finished from another frame.
+    return self._list(
+        current_stage(), self.backend.list(bucket_name, prefix, match_glob)
+    )
+
+  def _list(
+      self,
+      stage_name: str,
+      infos: Iterator[StorageBackend.ObjectInfo],
+  ) -> Iterator[StorageBackend.ObjectInfo]:
+    """Yields a listing lazily, recording it once it is finished or closed.
+
+    Only the time spent fetching items counts towards the latency, so callers
+    that stop early, e.g. at the first match, don't page the whole listing.
+
+    Args:
+      stage_name: The stage to attribute the listing to.
+      infos: The listing of the wrapped backend.
+
+    Yields:
+      The listed objects.
+    """
+    latency_s = 0
+    errors = 0
+    try:
+      while True:
+        started = time.monotonic()
+        try:
+          info = next(infos)
+        except StopIteration:
+          break
+        except Exception:
+          errors = 1
+          raise
+        finally:
+          latency_s += time.monotonic() - started
+        yield info
+    finally:
+      with stage(stage_name):
+        record('list', latency_s=latency_s, errors=errors)
+
+  def read(
+      self,
+      bucket_name: str,
+      ref: StorageBackend.ObjectRef,
+      start: Optional[int] = None,
+      end: Optional[int] = None,
+  ) -> bytes:
+    return self._call(
+        'read',
+        self.backend.read,
+        bucket_name,
+        ref,
+        start,
+        end,
+        bytes_in=len,
+    )
+
+  def download(
+      self,
+      bucket_name: str,
+      ref: StorageBackend.ObjectRef,
+      file_name: str,
+  ):
+    self._call(
+        'download',
+        self.backend.download,
+        bucket_name,
+        ref,
+        file_name,
+        bytes_in=lambda _: os.path.getsize(file_name),
+    )
+
+  def upload(
+      self,
+      bucket_name: str,
+      name: str,
+      file_name: str,
+      overwrite: bool = False,
+  ):
+    self._call(
+        'upload',
+        self.backend.upload,
+        bucket_name,
+        name,
+        file_name,
+        overwrite,
+        bytes_out=lambda _: os.path.getsize(file_name),
+    )
+
+  def delete(self, bucket_name: str, name: str):
+    self._call('delete', self.backend.delete, bucket_name, name)
+
+  def download_many(
+      self,
+      bucket_name: str,
+      ref_file_pairs: Sequence[Tuple[StorageBackend.ObjectRef, str]],
+  ) -> List[Optional[Exception]]:
+    started = time.monotonic()
+    results = self.backend.download_many(bucket_name, ref_file_pairs)
+    record(
+        'download_many',
+        requests=len(ref_file_pairs),
+        bytes_in=sum(
+            os.path.getsize(file_name)
+            for (_, file_name), result in zip(ref_file_pairs, results)
+            if result is None
+        ),
+        latency_s=time.monotonic() - started,
+        errors=sum(isinstance(result, Exception) for result in results),
+    )
+    return results
+
+  def upload_many(
+      self,
+      bucket_name: str,
+      file_name_pairs: Sequence[Tuple[str, str]],
+  ) -> List[Optional[Exception]]:
+    started = time.monotonic()
+    results = self.backend.upload_many(bucket_name, file_name_pairs)
+    record(
+        'upload_many',
+        requests=len(file_name_pairs),
+        bytes_out=sum(
+            os.path.getsize(file_name)
+            for (file_name, _), result in zip(file_name_pairs, results)
+            if result is None
+        ),
+        latency_s=time.monotonic() - started,
+        errors=sum(
+            isinstance(result, Exception)
+            and getattr(result, 'code', None) != 412
+            for result in results
+        ),
+    )
+    return results
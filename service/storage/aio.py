@@ -0,0 +1,177 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Vigenair asynchronous storage service.
+
+This module provides asyncio variants of the storage service functions, so that
+independent transfers can be awaited together and overlapped with other work,
+e.g. uploading a finished render while the next format is being encoded:
+
+  upload = asyncio.create_task(StorageAsync.upload_gcs_file(...))
+  await asyncio.to_thread(render_next_format)
+  await upload
+
+The storage client libraries are blocking, so each operation runs in a worker
+thread. At most `CONFIG_GCS_ASYNC_MAX_CONCURRENCY` operations run at once per
+event loop; further operations wait for a free slot.
+"""
+
+import asyncio
+import functools
+import threading
+from typing import Optional, Sequence, Union
+import weakref
+
+import config as ConfigService
+import storage.accounting as StorageAccounting
+import storage.storage as StorageService
+import utils as Utils
+
+_semaphores_lock = threading.Lock()
+_semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+  """Returns the semaphore bounding concurrent operations on the running loop."""
+  loop = asyncio.get_running_loop()
+  with _semaphores_lock:
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+      semaphore = asyncio.Semaphore(
+          ConfigService.CONFIG_GCS_ASYNC_MAX_CONCURRENCY
+      )
+      _semaphores[loop] = semaphore
+    return semaphore
+
+
+async def _run(func, *args, **kwargs):
+  """Runs a blocking storage function in a worker thread, within the bound."""
+  bound_func = StorageAccounting.bind_stage(func)
+  async with _get_semaphore():
+    return await asyncio.to_thread(
+        functools.partial(bound_func, *args, **kwargs)
+    )
+
+
+async def download_gcs_file(
+    file_path: Utils.TriggerFile,
+    bucket_name: str,
+    output_dir: Optional[str] = None,
+    fetch_contents: bool = False,
+    sliced: bool = False,
+    cached: bool = False,
+    small: bool = False,
+) -> Union[Optional[str], Optional[bytes]]:
+  """Downloads a file from the given GCS bucket. See `download_gcs_file`."""
+  return await _run(
+      StorageService.download_gcs_file,
+      file_path=file_path,
+      bucket_name=bucket_name,
+      output_dir=output_dir,
+      fetch_contents=fetch_contents,
+      sliced=sliced,
+      cached=cached,
+      small=small,
+  )
+
+
+async def download_gcs_files(
+    file_paths: Sequence[Utils.TriggerFile],
+    bucket_name: str,
+    output_dir: Optional[str] = None,
+    fetch_contents: bool = False,
+    sliced: bool = False,
+    cached: bool = False,
+    small: bool = False,
+) -> Sequence[Union[Optional[str], Optional[bytes]]]:
+  """Downloads several files concurrently. See `download_gcs_files`."""
+  return await asyncio.gather(
+      *[
+          download_gcs_file(
+              file_path=file_path,
+              bucket_name=bucket_name,
+              output_dir=output_dir,
+              fetch_contents=fetch_contents,
+              sliced=sliced,
+              cached=cached,
+              small=small,
+          ) for file_path in file_paths
+      ]
+  )
+
+
+async def upload_gcs_file(
+    file_path: str,
+    destination_file_name: str,
+    bucket_name: str,
+    overwrite: bool = False,
+) -> None:
+  """Uploads a file to the given GCS bucket. See `upload_gcs_file`."""
+  await _run(
+      StorageService.upload_gcs_file,
+      file_path=file_path,
+      destination_file_name=destination_file_name,
+      bucket_name=bucket_name,
+      overwrite=overwrite,
+  )
+
+
+async def upload_gcs_dir(
+    source_directory: str,
+    bucket_name: str,
+    target_dir: str,
+    incremental: bool = False,
+) -> None:
+  """Uploads all files in a directory to a GCS bucket. See `upload_gcs_dir`."""
+  await _run(
+      StorageService.upload_gcs_dir,
+      source_directory=source_directory,
+      bucket_name=bucket_name,
+      target_dir=target_dir,
+      incremental=incremental,
+  )
+
+
+async def filter_video_files(
+    prefix: str,
+    bucket_name: str,
+    first_only: bool = False,
+) -> Sequence[str]:
+  """Lists video files under a prefix. See `filter_video_files`."""
+  return await _run(
+      StorageService.filter_video_files,
+      prefix=prefix,
+      bucket_name=bucket_name,
+      first_only=first_only,
+  )
+
+
+async def filter_files(
+    bucket_name: str,
+    prefix: str,
+    suffix: str,
+    fetch_content=False,
+    download=False,
+    download_dir=None,
+) -> Sequence[Union[bytes, str]]:
+  """Lists files under a prefix based on a suffix. See `filter_files`."""
+  return await _run(
+      StorageService.filter_files,
+      bucket_name=bucket_name,
+      prefix=prefix,
+      suffix=suffix,
+      fetch_content=fetch_content,
+      download=download,
+      download_dir=download_dir,
+  )
@@ -0,0 +1,369 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Vigenair storage backends.
+
+This module defines the object storage operations the storage service is built
+on, along with implementations backed by a local directory and by memory. The
+Google Cloud Storage implementation lives in `storage.gcs`.
+"""
+
+import abc
+import dataclasses
+import fnmatch
+import itertools
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from google.api_core import exceptions
+
+
+@dataclasses.dataclass(frozen=True)
+class ObjectInfo:
+  """Metadata of a stored object.
+
+  Attributes:
+    name: The path of the object within its bucket.
+    size: The size of the object in bytes.
+    generation: The generation of the object, which changes whenever the
+      object is overwritten.
+    handle: Optional backend-specific handle to the object, which backends may
+      use to avoid re-fetching metadata.
+  """
+
+  name: str
+  size: int
+  generation: int
+  handle: Any = dataclasses.field(default=None, compare=False, repr=False)
+
+
+ObjectRef = Union[str, ObjectInfo]
+
+
+def object_name(ref: ObjectRef) -> str:
+  """Returns the object path of the given object name or metadata."""
+  return ref.name if isinstance(ref, ObjectInfo) else ref
+
+
+class StorageBackend(abc.ABC):
+  """Object storage operations used by the storage service.
+
+  Objects are addressed by bucket name and object path. Missing objects are
+  reported with `google.api_core.exceptions.NotFound` and conflicting writes
+  with `google.api_core.exceptions.PreconditionFailed`, whichever the backend.
+  Operations that accept an `ObjectRef` can be passed the `ObjectInfo` of a
+  previous `stat` or `list` call, which pins reads to that generation.
+  """
+
+  @abc.abstractmethod
+  def stat(self, bucket_name: str, name: str) -> Optional[ObjectInfo]:
+    """Returns the metadata of an object, or None if it does not exist."""
+
+  @abc.abstractmethod
+  def list(
+      self,
+      bucket_name: str,
+      prefix: str,
+      match_glob: Optional[str] = None,
+  ) -> Iterator[ObjectInfo]:
+    """Lists objects under a prefix, sorted by name.
+
+    Args:
+      bucket_name: The name of the bucket to list objects from.
+      prefix: The prefix to list objects under.
+      match_glob: Optional glob that object paths must match, where `**`
+        matches across directories.
+
+    Returns:
+      An iterator of the matching objects' metadata.
+    """
+
+  @abc.abstractmethod
+  def read(
+      self,
+      bucket_name: str,
+      ref: ObjectRef,
+      start: Optional[int] = None,
+      end: Optional[int] = None,
+  ) -> bytes:
+    """Returns the contents of an object, or of the inclusive byte range."""
+
+  @abc.abstractmethod
+  def download(self, bucket_name: str, ref: ObjectRef, file_name: str):
+    """Downloads an object to a local file."""
+
+  @abc.abstractmethod
+  def upload(
+      self,
+      bucket_name: str,
+      name: str,
+      file_name: str,
+      overwrite: bool = False,
+  ):
+    """Uploads a local file, failing if the object exists unless `overwrite`."""
+
+  @abc.abstractmethod
+  def delete(self, bucket_name: str, name: str):
+    """Deletes an object."""
+
+  def download_many(
+      self,
+      bucket_name: str,
+      ref_file_pairs: Sequence[Tuple[ObjectRef, str]],
+  ) -> List[Optional[Exception]]:
+    """Downloads several objects to local files.
+
+    Args:
+      bucket_name: The name of the bucket to download from.
+      ref_file_pairs: The objects to download, each paired with the local path
+        to download it to.
+
+    Returns:
+      For each pair in order, None on success or the raised exception.
+    """
+    return [
+        _capture(self.download, bucket_name, ref, file_name)
+        for ref, file_name in ref_file_pairs
+    ]
+
+  def upload_many(
+      self,
+      bucket_name: str,
+      file_name_pairs: Sequence[Tuple[str, str]],
+  ) -> List[Optional[Exception]]:
+    """Uploads several local files, skipping objects that already exist.
+
+    Args:
+      bucket_name: The name of the bucket to upload to.
+      file_name_pairs: The local paths to upload, each paired with the object
+        path to upload it as.
+
+    Returns:
+      For each pair in order, None on success or the raised exception, which
+      is `PreconditionFailed` for skipped files.
+    """
+    return [
+        _capture(self.upload, bucket_name, name, file_name)
+        for file_name, name in file_name_pairs
+    ]
+
+
+class LocalBackend(StorageBackend):
+  """Stores objects as files under `<root_dir>/<bucket_name>/<object path>`.
+
+  Generations are the files' modification times in nanoseconds. Writes go via a
+  temporary file that is renamed into place, so readers never observe partial
+  objects.
+  """
+
+  def __init__(self, root_dir: str):
+    """Initialiser.
+
+    Args:
+      root_dir: The local directory that holds one subdirectory per bucket.
+    """
+    self.root_dir = root_dir
+
+  def _path(self, bucket_name: str, name: str) -> pathlib.Path:
+    return pathlib.Path(self.root_dir, bucket_name, name)
+
+  def _info(self, bucket_name: str, name: str) -> Optional[ObjectInfo]:
+    try:
+      stat = os.stat(self._path(bucket_name, name))
+    except FileNotFoundError:
+      return None
+    return ObjectInfo(name=name, size=stat.st_size, generation=stat.st_mtime_ns)
+
+  def _existing_path(self, bucket_name: str, ref: ObjectRef) -> pathlib.Path:
+    """Returns the file of an object, checking the pinned generation if any."""
+    name = object_name(ref)
+    info = self._info(bucket_name, name)
+    if info is None or (
+        isinstance(ref, ObjectInfo) and ref.generation != info.generation
+    ):
+      raise exceptions.NotFound(name)
+    return self._path(bucket_name, name)
+
+  def stat(self, bucket_name: str, name: str) -> Optional[ObjectInfo]:
+    return self._info(bucket_name, name)
+
+  def list(
+      self,
+      bucket_name: str,
+      prefix: str,
+      match_glob: Optional[str] = None,
+  ) -> Iterator[ObjectInfo]:
+    bucket_dir = pathlib.Path(self.root_dir, bucket_name)
+    names = sorted(
+        path.relative_to(bucket_dir).as_posix()
+        for path in bucket_dir.rglob('*') if path.is_file()
+    ) if bucket_dir.is_dir() else []
+    for name in names:
+      if name.startswith(prefix) and _matches_glob(name, match_glob):
+        info = self._info(bucket_name, name)
+        if info:
+          yield info
+
+  def read(
+      self,
+      bucket_name: str,
+      ref: ObjectRef,
+      start: Optional[int] = None,
+      end: Optional[int] = None,
+  ) -> bytes:
+    with open(self._existing_path(bucket_name, ref), 'rb') as f:
+      f.seek(start or 0)
+      return f.read() if end is None else f.read(end - (start or 0) + 1)
+
+  def download(self, bucket_name: str, ref: ObjectRef, file_name: str):
+    shutil.copyfile(self._existing_path(bucket_name, ref), file_name)
+
+  def upload(
+      self,
+      bucket_name: str,
+      name: str,
+      file_name: str,
+      overwrite: bool = False,
+  ):
+    path = self._path(bucket_name, name)
+    if not overwrite and path.exists():
+      raise exceptions.PreconditionFailed(f'File "{name}" already exists.')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.upload-')
+    os.close(fd)
+    try:
+      shutil.copyfile(file_name, tmp_path)
+      os.replace(tmp_path, path)
+    finally:
+      pathlib.Path(tmp_path).unlink(missing_ok=True)
+
+  def delete(self, bucket_name: str, name: str):
+    try:
+      os.remove(self._path(bucket_name, name))
+    except FileNotFoundError as e:
+      raise exceptions.NotFound(name) from e
+
+
+class InMemoryBackend(StorageBackend):
+  """Stores objects in a dictionary, for tests and throughput experiments."""
+
+  def __init__(
+      self,
+      objects: Optional[Dict[Tuple[str, str], bytes]] = None,
+  ):
+    """Initialiser.
+
+    Args:
+      objects: Optional initial objects, keyed by (bucket name, object path).
+    """
+    self._lock = threading.Lock()
+    self._generations = itertools.count(1)
+    self._objects: Dict[Tuple[str, str], Tuple[bytes, int]] = {
+        key: (contents, next(self._generations))
+        for key, contents in (objects or {}).items()
+    }
+
+  def put(self, bucket_name: str, name: str, contents: bytes):
+    """Stores the given contents as an object, overwriting it if it exists."""
+    with self._lock:
+      self._objects[(bucket_name, name)] = (contents, next(self._generations))
+
+  def _contents(self, bucket_name: str, ref: ObjectRef) -> bytes:
+    name = object_name(ref)
+    with self._lock:
+      entry = self._objects.get((bucket_name, name))
+    if entry is None or (
+        isinstance(ref, ObjectInfo) and ref.generation != entry[1]
+    ):
+      raise exceptions.NotFound(name)
+    return entry[0]
+
+  def stat(self, bucket_name: str, name: str) -> Optional[ObjectInfo]:
+    with self._lock:
+      entry = self._objects.get((bucket_name, name))
+    if entry is None:
+      return None
+    return ObjectInfo(name=name, size=len(entry[0]), generation=entry[1])
+
+  def list(
+      self,
+      bucket_name: str,
+      prefix: str,
+      match_glob: Optional[str] = None,
+  ) -> Iterator[ObjectInfo]:
+    with self._lock:
+      entries = sorted(
+          (name, contents, generation)
+          for (bucket, name), (contents, generation) in self._objects.items()
+          if bucket == bucket_name and name.startswith(prefix)
+      )
+    for name, contents, generation in entries:
+      if _matches_glob(name, match_glob):
+        yield ObjectInfo(name=name, size=len(contents), generation=generation)
+
+  def read(
+      self,
+      bucket_name: str,
+      ref: ObjectRef,
+      start: Optional[int] = None,
+      end: Optional[int] = None,
+  ) -> bytes:
+    contents = self._contents(bucket_name, ref)
+    return contents[start or 0:None if end is None else end + 1]
+
+  def download(self, bucket_name: str, ref: ObjectRef, file_name: str):
+    contents = self._contents(bucket_name, ref)
+    with open(file_name, 'wb') as f:
+      f.write(contents)
+
+  def upload(
+      self,
+      bucket_name: str,
+      name: str,
+      file_name: str,
+      overwrite: bool = False,
+  ):
+    with open(file_name, 'rb') as f:
+      contents = f.read()
+    with self._lock:
+      if not overwrite and (bucket_name, name) in self._objects:
+        raise exceptions.PreconditionFailed(f'File "{name}" already exists.')
+      self._objects[(bucket_name, name)] = (contents, next(self._generations))
+
+  def delete(self, bucket_name: str, name: str):
+    with self._lock:
+      if self._objects.pop((bucket_name, name), None) is None:
+        raise exceptions.NotFound(name)
+
+
+def _matches_glob(name: str, match_glob: Optional[str]) -> bool:
+  """Approximates GCS `match_glob` semantics for the suffix globs we use."""
+  return not match_glob or fnmatch.fnmatchcase(
+      name, match_glob.replace('**', '*')
+  )
+
+
+def _capture(func, *args) -> Optional[Exception]:
+  """Calls `func`, returning the raised exception instead of raising it."""
+  try:
+    func(*args)
+    return None
+  # Failures are reported per file, as for GCS transfer manager operations
+  # pylint: disable=broad-exception-caught
+  except Exception as e:
+    return e
@@ -0,0 +1,169 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Vigenair storage cache.
+
+This module provides a local, size-bounded cache for objects fetched from GCS,
+so that warm instances do not download the same inputs over and over again.
+"""
+
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import threading
+from typing import Optional
+
+import config as ConfigService
+
+_cache_lock = threading.Lock()
+_cache = None
+
+
+class ObjectCache:
+  """Caches downloaded GCS objects on local disk.
+
+  Entries are content-addressed by bucket, object path and object generation,
+  so a new upload to the same path never yields a stale hit. Once the total
+  size of all entries exceeds `max_size`, the least recently used entries are
+  evicted. Files are copied in and out of the cache rather than hard-linked, as
+  working copies are often overwritten in place, e.g. by downloads or ffmpeg
+  outputs, which would otherwise rewrite the cached entries too.
+  """
+
+  def __init__(self, cache_dir: str, max_size: int):
+    """Initialiser.
+
+    Args:
+      cache_dir: The local directory to store cached objects in.
+      max_size: The maximum total size of all cached objects, in bytes.
+    """
+    self.cache_dir = cache_dir
+    self.max_size = max_size
+    os.makedirs(cache_dir, exist_ok=True)
+
+  def fetch(
+      self,
+      bucket_name: str,
+      blob_name: str,
+      generation: int,
+      destination_file_name: str,
+  ) -> bool:
+    """Places a cached object at the given path, if it is cached.
+
+    Args:
+      bucket_name: The name of the bucket the object belongs to.
+      blob_name: The path of the object in the bucket.
+      generation: The current generation of the object.
+      destination_file_name: Where to place the cached object.
+
+    Returns:
+      Whether the object was found in the cache.
+    """
+    entry_path = self._entry_path(bucket_name, blob_name, generation)
+    try:
+      os.utime(entry_path)
+      _copy(entry_path, destination_file_name)
+    except FileNotFoundError:
+      return False
+
+    logging.info(
+        'CACHE - Hit for "%s" (generation %s) in bucket "%s".',
+        blob_name,
+        generation,
+        bucket_name,
+    )
+    return True
+
+  def store(
+      self,
+      bucket_name: str,
+      blob_name: str,
+      generation: int,
+      file_name: str,
+  ):
+    """Adds a downloaded object to the cache, evicting older entries if needed.
+
+    Args:
+      bucket_name: The name of the bucket the object belongs to.
+      blob_name: The path of the object in the bucket.
+      generation: The generation of the downloaded object.
+      file_name: The local path the object was downloaded to.
+    """
+    if os.path.getsize(file_name) > self.max_size:
+      return
+
+    entry_path = self._entry_path(bucket_name, blob_name, generation)
+    tmp_entry_path = f'{entry_path}.{os.getpid()}-{threading.get_ident()}.tmp'
+    _copy(file_name, tmp_entry_path)
+    os.replace(tmp_entry_path, entry_path)
+    logging.info(
+        'CACHE - Stored "%s" (generation %s) from bucket "%s".',
+        blob_name,
+        generation,
+        bucket_name,
+    )
+    self._evict()
+
+  def _entry_path(
+      self,
+      bucket_name: str,
+      blob_name: str,
+      generation: int,
+  ) -> str:
+    key = hashlib.sha256(
+        f'{bucket_name}/{blob_name}#{generation}'.encode('utf-8')
+    ).hexdigest()
+    _, file_ext = os.path.splitext(blob_name)
+    return str(pathlib.Path(self.cache_dir, f'{key}{file_ext}'))
+
+  def _evict(self):
+    """Evicts least recently used entries until the cache fits its budget."""
+    entries = []
+    for entry in os.scandir(self.cache_dir):
+      if entry.is_file() and not entry.name.endswith('.tmp'):
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+      if total_size <= self.max_size:
+        break
+      try:
+        os.remove(path)
+        total_size -= size
+        logging.info('CACHE - Evicted "%s" (%d bytes).', path, size)
+      except FileNotFoundError:
+        pass
+
+
+def get_object_cache() -> Optional[ObjectCache]:
+  """Returns the process-wide object cache, or None if caching is disabled."""
+  global _cache
+  if ConfigService.CONFIG_GCS_CACHE_MAX_SIZE <= 0:
+    return None
+  with _cache_lock:
+    if _cache is None:
+      _cache = ObjectCache(
+          cache_dir=ConfigService.CONFIG_GCS_CACHE_DIR,
+          max_size=ConfigService.CONFIG_GCS_CACHE_MAX_SIZE,
+      )
+    return _cache
+
+
+def _copy(source: str, destination: str):
+  """Copies a file into a new inode, never sharing it with the source."""
+  pathlib.Path(destination).unlink(missing_ok=True)
+  shutil.copyfile(source, destination)
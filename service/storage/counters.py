@@ -0,0 +1,53 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Vigenair storage counters.
+
+This module keeps process-wide counters of noteworthy storage events, such as
+retried requests and hedged reads.
+"""
+
+import collections
+import os
+import threading
+from typing import Dict
+
+_counters_lock = threading.Lock()
+_counters = collections.Counter()
+
+
+def _reset_after_fork():
+  global _counters_lock
+  _counters_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def increment(name: str, value: int = 1):
+  """Increments the named counter by the given value."""
+  with _counters_lock:
+    _counters[name] += value
+
+
+def get_counters() -> Dict[str, int]:
+  """Returns a snapshot of all counters of this process."""
+  with _counters_lock:
+    return dict(_counters)
+
+
+def reset_counters():
+  """Resets all counters of this process to zero."""
+  with _counters_lock:
+    _counters.clear()
@@ -0,0 +1,403 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Vigenair Google Cloud Storage backend.
+
+This module implements the storage backend interface on top of Google Cloud
+Storage, with a shared pooled client and concurrent transfers.
+"""
+
+import functools
+import logging
+import mimetypes
+import os
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import uuid
+
+import config as ConfigService
+import google.auth
+from google.api_core import exceptions
+from google.api_core import retry as api_retry
+from google.api_core.client_info import ClientInfo
+from google.auth import exceptions as auth_exceptions
+from google.auth.transport import requests as google_auth_requests
+from google.cloud import storage
+from google.cloud.storage import transfer_manager
+import requests
+from requests import adapters
+import storage.backend as StorageBackend
+import storage.counters as StorageCounters
+
+_RETRYABLE_EXCEPTIONS = (
+    exceptions.TooManyRequests,
+    exceptions.InternalServerError,
+    exceptions.BadGateway,
+    exceptions.ServiceUnavailable,
+    exceptions.GatewayTimeout,
+    auth_exceptions.TransportError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+)
+
+_client_lock = threading.Lock()
+_client: Optional[storage.Client] = None
+_buckets: Dict[str, storage.Bucket] = {}
+
+
+def _reset_after_fork():
+  """Drops the shared client in a forked child, as sockets can't be shared."""
+  global _client_lock, _client, _buckets
+  _client_lock = threading.Lock()
+  _client = None
+  _buckets = {}
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _create_client() -> storage.Client:
+  """Creates a GCS client backed by a connection pool of configurable size."""
+  if os.environ.get('STORAGE_EMULATOR_HOST'):
+    # Talk to a local fake GCS server, which needs no credentials.
+    logging.info(
+        'STORAGE - Using emulator at %s.', os.environ['STORAGE_EMULATOR_HOST']
+    )
+    return storage.Client.create_anonymous_client()
+  credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+  session = google_auth_requests.AuthorizedSession(credentials)
+  pool_size = ConfigService.CONFIG_GCS_CONNECTION_POOL_SIZE
+  session.mount(
+      'https://',
+      adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size),
+  )
+  logging.info('STORAGE - Created client with pool size %d.', pool_size)
+  return storage.Client(
+      project=project,
+      credentials=credentials,
+      _http=session,
+      client_info=ClientInfo(user_agent=ConfigService.USER_AGENT_ID),
+  )
+
+
+def get_client() -> storage.Client:
+  """Returns the process-wide GCS client, creating it on first use.
+
+  The client is shared by all threads of the current process so that TLS
+  connections and auth tokens are reused across calls. Its connection pool is
+  sized via `CONFIG_GCS_CONNECTION_POOL_SIZE`, which should be at least the
+  number of threads issuing concurrent requests.
+
+  Returns:
+    The shared GCS client.
+  """
+  global _client
+  with _client_lock:
+    if _client is None:
+      _client = _create_client()
+    return _client
+
+
+def get_bucket(bucket_name: str) -> storage.Bucket:
+  """Returns a cached handle to the given GCS bucket, bound to the client.
+
+  Args:
+    bucket_name: The name of the bucket.
+
+  Returns:
+    The bucket handle. No request is issued to GCS.
+  """
+  client = get_client()
+  with _client_lock:
+    bucket = _buckets.get(bucket_name)
+    if bucket is None:
+      bucket = client.bucket(bucket_name)
+      _buckets[bucket_name] = bucket
+    return bucket
+
+
+def _worker_type() -> str:
+  """Returns the transfer manager worker type to use from the calling thread.
+
+  Process workers are forked, and forking while other threads are running can
+  leave the children with locks that are held forever, e.g. by a concurrent
+  download or a model registry. Such callers, like the worker threads of
+  `download_gcs_files`, use thread workers instead.
+
+  Returns:
+    `CONFIG_GCS_TRANSFER_WORKER_TYPE`, unless it is `process` and other threads
+    are running, in which case `thread`.
+  """
+  worker_type = ConfigService.CONFIG_GCS_TRANSFER_WORKER_TYPE
+  if worker_type == transfer_manager.PROCESS and threading.active_count() > 1:
+    return transfer_manager.THREAD
+  return worker_type
+
+
+def _is_retryable(error: Exception) -> bool:
+  """Checks whether a failed request is transient and should be retried."""
+  return isinstance(error, _RETRYABLE_EXCEPTIONS)
+
+
+def _on_retryable_error(op_type: str, error: Exception):
+  StorageCounters.increment(f'retries_{op_type}')
+  logging.info('STORAGE - Retrying %s request after error: %r', op_type, error)
+
+
+def _request_options(op_type: str) -> Dict[str, Any]:
+  """Returns the retry and timeout arguments for the given operation type.
+
+  Args:
+    op_type: One of the operation types of `CONFIG_GCS_RETRY_POLICIES`.
+
+  Returns:
+    Keyword arguments for GCS client calls. They only hold picklable values, so
+    can also be passed to transfer manager process workers.
+  """
+  policy = ConfigService.CONFIG_GCS_RETRY_POLICIES[op_type]
+  return {
+      'retry': api_retry.Retry(
+          predicate=_is_retryable,
+          initial=policy['initial'],
+          maximum=policy['maximum'],
+          multiplier=policy['multiplier'],
+          timeout=policy['deadline'],
+          on_error=functools.partial(_on_retryable_error, op_type),
+      ),
+      'timeout': policy['timeout'],
+  }
+
+
+class GcsBackend(StorageBackend.StorageBackend):
+  """Stores objects in Google Cloud Storage.
+
+  Files larger than `CONFIG_GCS_SLICED_TRANSFER_THRESHOLD` are transferred in
+  concurrent slices when their size is known, and batch transfers use the
+  transfer manager, both parallelised as per `CONFIG_GCS_TRANSFER_WORKER_TYPE`
+  and `CONFIG_GCS_TRANSFER_MAX_WORKERS`, with threads rather than processes
+  while other threads are running. Transient errors are retried as per
+  the policy of each operation type in `CONFIG_GCS_RETRY_POLICIES`, counting
+  retries in the `retries_<operation type>` storage counters. Retries within
+  transfer manager process workers are not counted.
+  """
+
+  def stat(
+      self,
+      bucket_name: str,
+      name: str,
+  ) -> Optional[StorageBackend.ObjectInfo]:
+    blob = get_bucket(bucket_name).get_blob(
+        name, **_request_options('metadata')
+    )
+    return _object_info(blob) if blob else None
+
+  def list(
+      self,
+      bucket_name: str,
+      prefix: str,
+      match_glob: Optional[str] = None,
+  ) -> Iterator[StorageBackend.ObjectInfo]:
+    blobs = get_bucket(bucket_name).list_blobs(
+        prefix=prefix, match_glob=match_glob, **_request_options('list')
+    )
+    return (_object_info(blob) for blob in blobs)
+
+  def read(
+      self,
+      bucket_name: str,
+      ref: StorageBackend.ObjectRef,
+      start: Optional[int] = None,
+      end: Optional[int] = None,
+  ) -> bytes:
+    blob = _blob(bucket_name, ref)
+    if start is None and end is None:
+      return blob.download_as_bytes(**_request_options('read'))
+    # Checksums only cover whole objects, so can't be validated for ranges.
+    return blob.download_as_bytes(
+        start=start, end=end, checksum=None, **_request_options('read')
+    )
+
+  def download(
+      self,
+      bucket_name: str,
+      ref: StorageBackend.ObjectRef,
+      file_name: str,
+  ):
+    blob = _blob(bucket_name, ref)
+    if _is_sliced_transfer(blob.size):
+      logging.info(
+          'DOWNLOAD - Downloading %d bytes of "%s" in slices.',
+          blob.size,
+          blob.name,
+      )
+      transfer_manager.download_chunks_concurrently(
+          blob,
+          file_name,
+          chunk_size=ConfigService.CONFIG_GCS_SLICED_TRANSFER_CHUNK_SIZE,
+          download_kwargs=_request_options('read'),
+          worker_type=_worker_type(),
+          max_workers=ConfigService.CONFIG_GCS_TRANSFER_MAX_WORKERS,
+      )
+    else:
+      blob.download_to_filename(file_name, **_request_options('read'))
+
+  def upload(
+      self,
+      bucket_name: str,
+      name: str,
+      file_name: str,
+      overwrite: bool = False,
+  ):
+    blob = get_bucket(bucket_name).blob(name)
+    if _is_sliced_transfer(os.path.getsize(file_name)):
+      if overwrite:
+        _upload_from_filename_sliced(file_name, blob)
+      else:
+        _upload_from_filename_sliced_if_absent(file_name, blob)
+    else:
+      # Retried even when overwriting, as the same file would be written.
+      blob.upload_from_filename(
+          file_name,
+          if_generation_match=None if overwrite else 0,
+          **_request_options('write'),
+      )
+
+  def delete(self, bucket_name: str, name: str):
+    get_bucket(bucket_name).blob(name).delete(**_request_options('delete'))
+
+  def download_many(
+      self,
+      bucket_name: str,
+      ref_file_pairs: Sequence[Tuple[StorageBackend.ObjectRef, str]],
+  ) -> List[Optional[Exception]]:
+    if not ref_file_pairs:
+      return []
+    return transfer_manager.download_many(
+        [(_blob(bucket_name, ref), file_name)
+         for ref, file_name in ref_file_pairs],
+        download_kwargs=_request_options('read'),
+        worker_type=_worker_type(),
+        max_workers=ConfigService.CONFIG_GCS_TRANSFER_MAX_WORKERS,
+    )
+
+  def upload_many(
+      self,
+      bucket_name: str,
+      file_name_pairs: Sequence[Tuple[str, str]],
+  ) -> List[Optional[Exception]]:
+    bucket = get_bucket(bucket_name)
+    sliced_indices = []
+    string_indices = []
+    for index, (file_name, _) in enumerate(file_name_pairs):
+      if _is_sliced_transfer(os.path.getsize(file_name)):
+        sliced_indices.append(index)
+      else:
+        string_indices.append(index)
+    results = [None] * len(file_name_pairs)
+
+    if string_indices:
+      string_results = transfer_manager.upload_many(
+          [(file_name_pairs[index][0], bucket.blob(file_name_pairs[index][1]))
+           for index in string_indices],
+          skip_if_exists=True,
+          upload_kwargs=_request_options('write'),
+          worker_type=_worker_type(),
+          max_workers=ConfigService.CONFIG_GCS_TRANSFER_MAX_WORKERS,
+      )
+      for index, result in zip(string_indices, string_results):
+        results[index] = result
+    for index in sliced_indices:
+      file_name, name = file_name_pairs[index]
+      try:
+        self.upload(bucket_name, name, file_name)
+      # Failures are reported per file, as for the non-sliced uploads
+      # pylint: disable=broad-exception-caught
+      except Exception as e:
+        results[index] = e
+    return results
+
+
+def _object_info(blob: storage.Blob) -> StorageBackend.ObjectInfo:
+  return StorageBackend.ObjectInfo(
+      name=blob.name,
+      size=blob.size,
+      generation=blob.generation,
+      handle=blob,
+  )
+
+
+def _blob(bucket_name: str, ref: StorageBackend.ObjectRef) -> storage.Blob:
+  """Returns the blob for a reference, reusing the metadata of `ObjectInfo`s."""
+  if isinstance(ref, StorageBackend.ObjectInfo) and ref.handle is not None:
+    return ref.handle
+  return get_bucket(bucket_name).blob(StorageBackend.object_name(ref))
+
+
+def _is_sliced_transfer(size: Optional[int]) -> bool:
+  """Checks whether a file of the given size should be transferred in slices."""
+  return (
+      size is not None
+      and size >= ConfigService.CONFIG_GCS_SLICED_TRANSFER_THRESHOLD
+  )
+
+
+def _upload_from_filename_sliced(file_name: str, blob: storage.Blob):
+  """Uploads a file as a multipart upload of concurrently uploaded parts."""
+  logging.info('UPLOAD - Uploading "%s" in parts.', blob.name)
+  transfer_manager.upload_chunks_concurrently(
+      file_name,
+      blob,
+      chunk_size=ConfigService.CONFIG_GCS_SLICED_TRANSFER_CHUNK_SIZE,
+      worker_type=_worker_type(),
+      max_workers=ConfigService.CONFIG_GCS_TRANSFER_MAX_WORKERS,
+      **_request_options('write'),
+  )
+
+
+def _upload_from_filename_sliced_if_absent(file_name: str, blob: storage.Blob):
+  """Uploads a file in parts, only if the object does not exist yet.
+
+  Multipart uploads can't be made conditional, so the parts are uploaded to a
+  temporary object under `OUTPUT_PARTIAL_UPLOADS_DIR`, outside of the watched
+  video folders, which is then composed into the destination object with an
+  `if_generation_match=0` precondition. Of several concurrent writers, exactly
+  one therefore succeeds.
+
+  Args:
+    file_name: The path of the file to upload.
+    blob: The destination object.
+
+  Raises:
+    `google.api_core.exceptions.PreconditionFailed` if the object exists.
+  """
+  tmp_blob = blob.bucket.blob(
+      f'{ConfigService.OUTPUT_PARTIAL_UPLOADS_DIR}/{uuid.uuid4().hex}'
+  )
+  _upload_from_filename_sliced(file_name, tmp_blob)
+  blob.content_type = (
+      mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+  )
+  try:
+    blob.compose(
+        [tmp_blob],
+        if_generation_match=0,
+        **_request_options('write'),
+    )
+  finally:
+    try:
+      tmp_blob.delete(**_request_options('delete'))
+    except exceptions.NotFound:
+      pass
@@ -14,17 +14,110 @@
 
 """Vigenair storage service.
 
-This module provides methods for interacting with Google Cloud Storage.
+This module provides methods for interacting with Google Cloud Storage, or
+with any other storage backend selected via `CONFIG_STORAGE_BACKEND`.
 """
 
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import fcntl
+import json
 import logging
 import os
 import pathlib
-from typing import Optional, Sequence, Union
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple, Union
 
+import config as ConfigService
+from google.api_core import exceptions
+import storage.accounting as StorageAccounting
+import storage.backend as StorageBackend
+import storage.cache as StorageCache
+import storage.counters as StorageCounters
 import utils as Utils
-from google.cloud import storage
-from google.cloud.storage import transfer_manager
+
+_HEDGE_MIN_SAMPLES = 20
+_DIR_MANIFEST_FILE = '.vigenair-manifest.json'
+_DIR_LOCK_FILE = '.vigenair-lock'
+
+_backend_lock = threading.Lock()
+_backend: Optional[StorageBackend.StorageBackend] = None
+_synced_files_lock = threading.Lock()
+_synced_files: Dict[Tuple[str, str], Tuple[str, int, int]] = {}
+_hedge_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_read_latencies = collections.deque(maxlen=200)
+_media_probes_lock = threading.Lock()
+_media_probes: Dict[Tuple[str, str, int], Utils.MediaProbe] = {}
+
+
+def _reset_after_fork():
+  """Recreates locks and threads in a forked child, as they don't survive."""
+  global _backend_lock, _synced_files_lock, _hedge_executor, _media_probes_lock
+  _backend_lock = threading.Lock()
+  _synced_files_lock = threading.Lock()
+  _hedge_executor = None
+  _media_probes_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _create_backend() -> StorageBackend.StorageBackend:
+  """Creates the storage backend selected via `CONFIG_STORAGE_BACKEND`."""
+  backend_type = ConfigService.CONFIG_STORAGE_BACKEND
+  logging.info('STORAGE - Using the "%s" storage backend.', backend_type)
+  if backend_type == 'local':
+    return StorageBackend.LocalBackend(ConfigService.CONFIG_STORAGE_LOCAL_DIR)
+  if backend_type == 'memory':
+    return StorageBackend.InMemoryBackend()
+  # Imported lazily so that other backends work without GCS client libraries.
+  import storage.gcs as StorageGcs  # pylint: disable=import-outside-toplevel
+  return StorageGcs.GcsBackend()
+
+
+def get_backend() -> StorageBackend.StorageBackend:
+  """Returns the process-wide storage backend, creating it on first use.
+
+  Returns:
+    The storage backend all functions of this module operate on, wrapped to
+    record its operations in `storage.accounting`.
+  """
+  global _backend
+  with _backend_lock:
+    if _backend is None:
+      _backend = StorageAccounting.AccountingBackend(_create_backend())
+    return _backend
+
+
+def set_backend(backend: Optional[StorageBackend.StorageBackend]):
+  """Replaces the process-wide storage backend, e.g. with an in-memory one.
+
+  Args:
+    backend: The backend to use from now on, or None to recreate the backend
+      selected via `CONFIG_STORAGE_BACKEND` on next use.
+  """
+  global _backend
+  with _backend_lock:
+    _backend = StorageAccounting.AccountingBackend(backend) if backend else None
+  with _synced_files_lock:
+    _synced_files.clear()
+
+
+def get_counters() -> Dict[str, int]:
+  """Returns the storage counters of this process.
+
+  These include `retries_<operation type>` for retried GCS requests,
+  `hedged_reads` for duplicate reads issued and `hedged_reads_won` for those
+  that finished before the original read.
+
+  Returns:
+    A snapshot of the counters, keyed by name.
+  """
+  return StorageCounters.get_counters()
 
 
 def download_gcs_file(
@@ -32,6 +125,9 @@ def download_gcs_file(
     bucket_name: str,
     output_dir: Optional[str] = None,
     fetch_contents: bool = False,
+    sliced: bool = False,
+    cached: bool = False,
+    small: bool = False,
 ) -> Union[Optional[str], Optional[bytes]]:
   """Downloads a file from the given GCS bucket and returns its path.
 
@@ -41,39 +137,284 @@ def download_gcs_file(
     output_dir: Directory path to store the downloaded file in.
     fetch_contents: Whether to fetch the file contents instead of writing to a
       file.
+    sliced: Whether to download the file in concurrent ranged slices if it is
+      larger than `CONFIG_GCS_SLICED_TRANSFER_THRESHOLD`. This costs an extra
+      metadata request, so should only be used for potentially large files.
+      Ignored if `fetch_contents` is set.
+    cached: Whether to serve the file from, and add it to, the local object
+      cache. Cache entries are validated against the object's generation with
+      a metadata request, so this should only be used for files that are
+      fetched repeatedly. Ignored if `fetch_contents` is set.
+    small: Whether the file is known to be small, e.g. a JSON file written by
+      the pipeline, so that fetching its contents can be hedged. Only used if
+      `fetch_contents` is set.
 
   Returns:
     The retrieved file path or contents based on `fetch_contents`, or None if
     the file was not found.
   """
-  storage_client = storage.Client()
-  bucket = storage_client.bucket(bucket_name)
+  backend = get_backend()
+  ref = file_path.full_gcs_path
+
+  try:
+    if fetch_contents:
+      result = _read_small(bucket_name, ref, small=small)
+    else:
+      if sliced or cached:
+        ref = backend.stat(bucket_name, file_path.full_gcs_path)
+        if ref is None:
+          raise exceptions.NotFound(file_path.full_gcs_path)
+      result = str(pathlib.Path(output_dir, file_path.file_name_ext))
+      object_cache = StorageCache.get_object_cache() if cached else None
+      cache_hit = bool(object_cache) and object_cache.fetch(
+          bucket_name, ref.name, ref.generation, result
+      )
+      if object_cache:
+        StorageAccounting.record(
+            'object_cache',
+            requests=0,
+            cache_hits=int(cache_hit),
+            cache_misses=int(not cache_hit),
+        )
+      if not cache_hit:
+        try:
+          backend.download(bucket_name, ref, result)
+        except exceptions.NotFound:
+          pathlib.Path(result).unlink(missing_ok=True)
+          raise
+        if object_cache:
+          object_cache.store(bucket_name, ref.name, ref.generation, result)
+      _record_synced(bucket_name, file_path.full_gcs_path, result)
+  except exceptions.NotFound:
+    logging.warning(
+        'DOWNLOAD - Could not find file "%s" in bucket "%s".',
+        file_path.full_gcs_path,
+        bucket_name,
+    )
+    return None
 
-  blob = bucket.blob(file_path.full_gcs_path)
-  result = None
+  logging.info(
+      'DOWNLOAD - Fetched file "%s" from bucket "%s".',
+      file_path.full_gcs_path,
+      bucket_name,
+  )
+  return result
+
+
+@contextlib.contextmanager
+def stream_gcs_file(
+    file_path: Utils.TriggerFile,
+    bucket_name: str,
+) -> Iterator[Optional[str]]:
+  """Serves a GCS file over local HTTP for ffmpeg instead of downloading it.
+
+  ffmpeg reads the returned URL with HTTP range requests, each of which is
+  answered by a ranged read of the blob, so only the parts of the file that
+  ffmpeg actually reads are transferred. The object's generation is pinned so
+  that all reads see the same object.
 
-  if not blob.exists():
+  Args:
+    file_path: The path of the file to stream.
+    bucket_name: The name of the bucket to stream the file from.
+
+  Yields:
+    A local URL that ffmpeg can use as input for as long as the context is
+    open, or None if the file was not found.
+  """
+  backend = get_backend()
+  info = backend.stat(bucket_name, file_path.full_gcs_path)
+  if info is None:
     logging.warning(
         'DOWNLOAD - Could not find file "%s" in bucket "%s".',
         file_path.full_gcs_path,
         bucket_name,
     )
-  else:
-    if fetch_contents:
-      result = blob.download_as_bytes()
-    else:
-      destination_file_name = str(
-          pathlib.Path(output_dir, file_path.file_name_ext)
-      )
-      blob.download_to_filename(destination_file_name)
-      result = destination_file_name
+    yield None
+    return
 
+  # Reads happen on the server's threads, but belong to the caller's stage.
+  @StorageAccounting.bind_stage
+  def read_range(start: int, end: int) -> bytes:
+    return backend.read(bucket_name, info, start=start, end=end)
+
+  with Utils.RangedStreamServer(
+      file_name=file_path.file_name_ext,
+      size=info.size,
+      read_range=read_range,
+  ) as stream:
     logging.info(
-        'DOWNLOAD - Fetched file "%s" from bucket "%s".',
+        'DOWNLOAD - Streaming file "%s" from bucket "%s".',
         file_path.full_gcs_path,
         bucket_name,
     )
-  return result
+    yield stream.url
+
+
+def open_gcs_input(
+    stack: contextlib.ExitStack,
+    file_path: Utils.TriggerFile,
+    bucket_name: str,
+    output_dir: str,
+    sliced: bool = False,
+    cached: bool = False,
+) -> Optional[str]:
+  """Returns an ffmpeg input for a GCS file, streamed or downloaded per config.
+
+  If `CONFIG_FFMPEG_STREAM_INPUT` is set, the file is streamed with
+  `stream_gcs_file` for as long as `stack` is open; otherwise it is downloaded
+  into `output_dir` with `download_gcs_file`.
+
+  Args:
+    stack: The exit stack that keeps the stream open.
+    file_path: The path of the file to use as input.
+    bucket_name: The name of the bucket to retrieve the file from.
+    output_dir: Directory path to store the downloaded file in.
+    sliced: Whether to download large files in concurrent ranged slices. See
+      `download_gcs_file` for more information.
+    cached: Whether to use the local object cache. See `download_gcs_file` for
+      more information.
+    small: Whether the files are known to be small. See `download_gcs_file`
+      for more information.
+
+  Returns:
+    The streamed file URL or the downloaded file path, or None if the file was
+    not found.
+  """
+  if ConfigService.CONFIG_FFMPEG_STREAM_INPUT:
+    return stack.enter_context(
+        stream_gcs_file(file_path=file_path, bucket_name=bucket_name)
+    )
+  return download_gcs_file(
+      file_path=file_path,
+      bucket_name=bucket_name,
+      output_dir=output_dir,
+      sliced=sliced,
+      cached=cached,
+  )
+
+
+def probe_gcs_media(
+    file_path: Utils.TriggerFile,
+    bucket_name: str,
+    local_file_path: str,
+) -> Utils.MediaProbe:
+  """Probes a GCS media file once per object generation, across triggers.
+
+  Probes are memoized in-process and persisted as a sidecar JSON file, named as
+  the object plus `OUTPUT_MEDIA_PROBE_SUFFIX` under `OUTPUT_MEDIA_PROBES_DIR`,
+  so that later triggers and instances reuse them instead of running ffprobe
+  again. Sidecars are kept out of the video folders, so they are not listed
+  along with the video's files, and their upload events are ignored by main.
+  The probe is also memoized for `local_file_path`, so that
+  `Utils.probe_media` calls on the local copy are served from memory.
+
+  Args:
+    file_path: The path of the media file in GCS.
+    bucket_name: The name of the bucket holding the file.
+    local_file_path: The path or URL of a local copy of the file, which is
+      probed if no probe has been persisted yet.
+
+  Returns:
+    The technical metadata of the media file.
+  """
+  info = get_backend().stat(bucket_name, file_path.full_gcs_path)
+  if info is None:
+    return Utils.probe_media(local_file_path)
+
+  key = (bucket_name, info.name, info.generation)
+  with _media_probes_lock:
+    probe = _media_probes.get(key)
+
+  sidecar_name = (
+      f'{ConfigService.OUTPUT_MEDIA_PROBES_DIR}/{file_path.full_gcs_path}'
+      f'{ConfigService.OUTPUT_MEDIA_PROBE_SUFFIX}'
+  )
+  if probe is None:
+    try:
+      sidecar = json.loads(_read_small(bucket_name, sidecar_name, small=True))
+      if sidecar.get('generation') == info.generation:
+        probe = Utils.MediaProbe(**sidecar['probe'])
+        logging.info('PROBE - Reusing persisted probe "%s".', sidecar_name)
+    except exceptions.NotFound:
+      pass
+
+  if probe is None:
+    probe = Utils.probe_media(local_file_path)
+    with tempfile.NamedTemporaryFile(
+        'w', suffix='.json', encoding='utf8'
+    ) as sidecar_file:
+      json.dump(
+          {
+              'generation': info.generation,
+              'probe': dataclasses.asdict(probe),
+          },
+          sidecar_file,
+      )
+      sidecar_file.flush()
+      upload_gcs_file(
+          file_path=sidecar_file.name,
+          destination_file_name=sidecar_name,
+          bucket_name=bucket_name,
+          overwrite=True,
+      )
+
+  with _media_probes_lock:
+    _media_probes[key] = probe
+  Utils.remember_media_probe(local_file_path, probe)
+  return probe
+
+
+def download_gcs_files(
+    file_paths: Sequence[Utils.TriggerFile],
+    bucket_name: str,
+    output_dir: Optional[str] = None,
+    fetch_contents: bool = False,
+    sliced: bool = False,
+    cached: bool = False,
+    small: bool = False,
+) -> Sequence[Union[Optional[str], Optional[bytes]]]:
+  """Downloads several, possibly missing, files from a GCS bucket concurrently.
+
+  Args:
+    file_paths: The paths of the files to download.
+    bucket_name: The name of the bucket to retrieve the files from.
+    output_dir: Directory path to store the downloaded files in.
+    fetch_contents: Whether to fetch the files contents instead of writing to
+      files.
+    sliced: Whether to download large files in concurrent ranged slices. See
+      `download_gcs_file` for more information.
+    cached: Whether to use the local object cache. See `download_gcs_file` for
+      more information.
+    small: Whether the files are known to be small. See `download_gcs_file`
+      for more information.
+
+  Returns:
+    The retrieved file paths or contents based on `fetch_contents`, in the same
+    order as `file_paths`, with None for each file that was not found.
+  """
+  if not file_paths:
+    return []
+
+  max_workers = min(
+      len(file_paths), ConfigService.CONFIG_GCS_CONNECTION_POOL_SIZE
+  )
+  with concurrent.futures.ThreadPoolExecutor(max_workers) as thread_executor:
+    return list(
+        thread_executor.map(
+            StorageAccounting.bind_stage(
+                lambda file_path: download_gcs_file(
+                    file_path=file_path,
+                    bucket_name=bucket_name,
+                    output_dir=output_dir,
+                    fetch_contents=fetch_contents,
+                    sliced=sliced,
+                    cached=cached,
+                    small=small,
+                )
+            ),
+            file_paths,
+        )
+    )
 
 
 def upload_gcs_file(
@@ -84,60 +425,99 @@ def upload_gcs_file(
 ) -> None:
   """Uploads a file to the given GCS bucket.
 
+  Files larger than `CONFIG_GCS_SLICED_TRANSFER_THRESHOLD` are uploaded in
+  concurrent parts.
+
   Args:
     file_path: The path of the file to upload.
     destination_file_name: The name of the file to upload as.
     bucket_name: The name of the bucket to upload the file to.
-  """
-  storage_client = storage.Client()
-  bucket = storage_client.bucket(bucket_name)
+    overwrite: Whether to overwrite the file if it already exists.
 
-  blob = bucket.blob(destination_file_name)
-  blob.upload_from_filename(
-      file_path, if_generation_match=None if overwrite else 0
+  Raises:
+    `google.api_core.exceptions.PreconditionFailed` if the file exists and
+    `overwrite` is not set.
+  """
+  get_backend().upload(
+      bucket_name, destination_file_name, file_path, overwrite=overwrite
   )
-
+  _record_synced(bucket_name, destination_file_name, file_path)
   logging.info('UPLOAD - Uploaded path "%s".', destination_file_name)
 
 
 def upload_gcs_dir(
     source_directory: str,
-    bucket_name: storage.Bucket,
+    bucket_name: str,
     target_dir: str,
+    incremental: bool = False,
 ) -> None:
   """Uploads all files in a directory to a GCS bucket.
 
+  Files that already exist in the bucket are skipped.
+
   Args:
     source_directory: The directory to upload.
     bucket_name: The name of the bucket to upload to.
     target_dir: The directory within the bucket to upload to.
+    incremental: Whether to only consider files that are new or changed since
+      they were last uploaded to, or downloaded from, the same path by this
+      process. This avoids a precondition request per unchanged file when the
+      same growing directory is uploaded repeatedly.
   """
-  storage_client = storage.Client()
-  bucket = storage_client.bucket(bucket_name)
-
   directory_path = pathlib.Path(source_directory)
   paths = directory_path.rglob('*')
 
   file_paths = [path for path in paths if path.is_file()]
-  relative_paths = [path.relative_to(source_directory) for path in file_paths]
-  string_paths = [str(path) for path in relative_paths]
-
-  results = transfer_manager.upload_many_from_filenames(
-      bucket,
-      string_paths,
-      source_directory=source_directory,
-      blob_name_prefix=f'{target_dir}/',
-      skip_if_exists=True,
-  )
-  for file_path, result in zip(string_paths, results):
-    if isinstance(result, Exception) and result.code and result.code != 412:
+  relative_paths = [
+      str(path.relative_to(source_directory)) for path in file_paths
+  ]
+  if incremental:
+    unchanged_paths = {
+        path for path in relative_paths if _is_synced(
+            bucket_name, f'{target_dir}/{path}', str(directory_path / path)
+        )
+    }
+    relative_paths = [
+        path for path in relative_paths if path not in unchanged_paths
+    ]
+    logging.info(
+        'UPLOAD - Skipped %d unchanged files in "%s", saving %d bytes and %d '
+        'requests.',
+        len(unchanged_paths),
+        source_directory,
+        sum(os.path.getsize(directory_path / path) for path in unchanged_paths),
+        len(unchanged_paths),
+    )
+    StorageAccounting.record(
+        'sync_manifest',
+        requests=0,
+        cache_hits=len(unchanged_paths),
+        cache_misses=len(relative_paths),
+    )
+  results = get_backend().upload_many(
+      bucket_name,
+      [(str(directory_path / path), f'{target_dir}/{path}')
+       for path in relative_paths],
+  ) if relative_paths else []
+
+  for file_path, result in zip(relative_paths, results):
+    if (
+        isinstance(result, Exception)
+        and getattr(result, 'code', None) != 412
+    ):
       logging.warning(
           'UPLOAD - Failed to upload path "%s" due to exception: %r.',
           file_path,
           result,
       )
-    elif result is None:
+      continue
+    if result is None:
       logging.info('UPLOAD - Uploaded path "%s".', file_path)
+    _record_synced(
+        bucket_name,
+        f'{target_dir}/{file_path}',
+        str(directory_path / file_path),
+    )
 
 
 def filter_video_files(
@@ -156,21 +536,8 @@ def filter_video_files(
     A list of video files matching the given prefix, or an empty list if no
     files match.
   """
-  storage_client = storage.Client()
-  blobs = storage_client.list_blobs(bucket_name, prefix=prefix)
-  result = []
-
-  for blob in blobs:
-    logging.info('FILTER - Found blob with name "%s".', blob.name)
-    _, file_ext = os.path.splitext(blob.name)
-    file_ext = file_ext[1:]
-
-    if file_ext and Utils.VideoExtension.has_value(file_ext):
-      logging.info('FILTER - Found video file "%s".', blob.name)
-      result.append(blob.name)
-      if first_only:
-        break
-  return result
+  blobs = get_backend().list(bucket_name, prefix)
+  return _filter_video_blobs(blobs, first_only)
 
 
 def filter_files(
@@ -197,25 +564,117 @@ def filter_files(
     A list of file contents matching the given suffix, or an empty list if no
     files match.
   """
-  storage_client = storage.Client()
-  blobs = storage_client.list_blobs(bucket_name, prefix=prefix)
-  result = []
+  blobs = get_backend().list(
+      bucket_name, prefix, match_glob=_suffix_glob(suffix)
+  )
+  return _filter_blobs(
+      bucket_name,
+      blobs,
+      suffix,
+      fetch_content,
+      download,
+      download_dir,
+  )
 
-  for blob in blobs:
-    if blob.name.endswith(suffix):
-      logging.info('FILTER - Found matching file "%s".', blob.name)
-      if download:
-        file_path, file_ext = os.path.splitext(blob.name)
-        file_path = pathlib.Path(file_path)
-        file_name = file_path.name
-        destination_file_name = str(
-            pathlib.Path(download_dir, f'{file_name}{file_ext}')
-        )
-        blob.download_to_filename(destination_file_name)
-        result.append(destination_file_name)
-      else:
-        result.append(blob.download_as_bytes() if fetch_content else blob.name)
-  return result
+
+class PrefixSnapshot:
+  """A point-in-time listing of all files under a prefix in a GCS bucket.
+
+  The prefix is listed once and indexed by file extension, after which any
+  number of `filter_files` and `filter_video_files` queries are served without
+  further listing requests. Call `refresh` to pick up changes in the bucket.
+  """
+
+  def __init__(self, bucket_name: str, prefix: str):
+    """Initialiser.
+
+    Args:
+      bucket_name: The name of the bucket to list files from.
+      prefix: The prefix to list files under.
+    """
+    self.bucket_name = bucket_name
+    self.prefix = prefix
+    self.refresh()
+
+  def refresh(self):
+    """Lists the prefix again, replacing the current snapshot."""
+    blobs = list(get_backend().list(self.bucket_name, self.prefix))
+    blobs_by_ext = {}
+    for blob in blobs:
+      _, file_ext = os.path.splitext(blob.name)
+      blobs_by_ext.setdefault(file_ext, []).append(blob)
+
+    self._blobs = blobs
+    self._blobs_by_ext = blobs_by_ext
+    logging.info(
+        'FILTER - Listed %d files under "%s" in bucket "%s".',
+        len(blobs),
+        self.prefix,
+        self.bucket_name,
+    )
+
+  def filter_video_files(
+      self,
+      prefix: Optional[str] = None,
+      first_only: bool = False,
+  ) -> Sequence[str]:
+    """Filters video files in the snapshot. See `filter_video_files`.
+
+    Args:
+      prefix: Optional narrower prefix to filter files by. Defaults to None,
+        indicating all files in the snapshot.
+      first_only: Whether to only return the first matching file.
+
+    Returns:
+      A list of matching video files, or an empty list if no files match.
+    """
+    blobs = sorted(
+        [
+            blob for item in Utils.VideoExtension
+            for blob in self._blobs_by_ext.get(f'.{item.value}', [])
+            if blob.name.startswith(prefix or self.prefix)
+        ],
+        key=lambda blob: blob.name,
+    )
+    return _filter_video_blobs(blobs, first_only)
+
+  def filter_files(
+      self,
+      suffix: str,
+      prefix: Optional[str] = None,
+      fetch_content=False,
+      download=False,
+      download_dir=None,
+  ) -> Sequence[Union[bytes, str]]:
+    """Filters files in the snapshot based on a suffix. See `filter_files`.
+
+    Args:
+      suffix: The suffix to filter files by.
+      prefix: Optional narrower prefix to filter files by. Defaults to None,
+        indicating all files in the snapshot.
+      fetch_content: Optional boolean whether to return file names or their
+        content. Defaults to False (names only).
+      download: Optional boolean whether to store the content of the file
+        locally. Defaults to False.
+      download_dir: Optional download directory. Defaults to None.
+
+    Returns:
+      A list of file contents matching the given suffix, or an empty list if no
+      files match.
+    """
+    ext_index = suffix.rfind('.')
+    blobs = (
+        self._blobs_by_ext.get(suffix[ext_index:], [])
+        if ext_index != -1 else self._blobs
+    )
+    return _filter_blobs(
+        self.bucket_name,
+        [blob for blob in blobs if blob.name.startswith(prefix or self.prefix)],
+        suffix,
+        fetch_content,
+        download,
+        download_dir,
+    )
 
 
 def delete_gcs_file(
@@ -228,30 +687,29 @@ def delete_gcs_file(
     file_path: The path of the file to download.
     bucket_name: The name of the bucket to retrieve the file from.
   """
-  storage_client = storage.Client()
-  bucket = storage_client.bucket(bucket_name)
-
-  blob = bucket.blob(file_path.full_gcs_path)
-
-  if not blob.exists():
+  _forget_synced(bucket_name, file_path.full_gcs_path)
+  try:
+    get_backend().delete(bucket_name, file_path.full_gcs_path)
+  except exceptions.NotFound:
     logging.warning(
         'DELETE - Could not find file "%s" in bucket "%s".',
         file_path.full_gcs_path,
         bucket_name,
     )
-  else:
-    blob.delete()
-    logging.info(
-        'DELETE - Deleted file "%s" from bucket "%s".',
-        file_path.full_gcs_path,
-        bucket_name,
-    )
+    return
+
+  logging.info(
+      'DELETE - Deleted file "%s" from bucket "%s".',
+      file_path.full_gcs_path,
+      bucket_name,
+  )
 
 
 def download_gcs_dir(
     bucket_name: str,
     dir_path: str,
     output_dir: str,
+    versioned: bool = False,
 ) -> int:
   """Downloads all files in a directory from a GCS bucket.
 
@@ -259,21 +717,26 @@ def download_gcs_dir(
     bucket_name: The name of the bucket to download from.
     dir_path: The directory to download.
     output_dir: The directory to download to.
+    versioned: Whether to keep the output directory in sync with the directory
+      in GCS across invocations and processes, as per `_sync_gcs_dir`, rather
+      than downloading all files every time.
 
   Returns:
-    The number of files downloaded.
+    The number of files downloaded, or in sync if `versioned`.
   """
-  storage_client = storage.Client()
   prefix = f'{dir_path}/'
-  blobs = storage_client.list_blobs(bucket_name, prefix=prefix)
-  count_files = 0
+  blobs = [
+      blob for blob in get_backend().list(bucket_name, prefix)
+      if blob.name != prefix
+  ]
+  if versioned:
+    return _sync_gcs_dir(bucket_name, prefix, blobs, output_dir)
 
-  for blob in blobs:
-    if blob.name == prefix:
-      continue
-    filename = blob.name.replace(prefix, '')
-    blob.download_to_filename(str(pathlib.Path(output_dir, filename)))
-    count_files += 1
+  blob_file_pairs = [(
+      blob,
+      str(pathlib.Path(output_dir, blob.name.replace(prefix, ''))),
+  ) for blob in blobs]
+  count_files = len(_download_many(blob_file_pairs, bucket_name))
 
   logging.info(
       'DOWNLOAD - Fetched "%d" files from bucket "%s" and folder "%s" '
@@ -284,3 +747,303 @@ def download_gcs_dir(
       output_dir,
   )
   return count_files
+
+
+def _sync_gcs_dir(
+    bucket_name: str,
+    prefix: str,
+    blobs: Sequence[StorageBackend.ObjectInfo],
+    output_dir: str,
+) -> int:
+  """Brings a local directory in sync with the given objects.
+
+  A manifest in the directory records the generation and size of each synced
+  file, so only files that are new, changed or missing locally are downloaded,
+  concurrently. Files are downloaded to temporary names and renamed once
+  complete, and syncs of the same directory are serialised via a file lock, so
+  concurrent processes never see partially written files.
+
+  Args:
+    bucket_name: The name of the bucket the objects belong to.
+    prefix: The prefix of the objects, which is stripped from local paths.
+    blobs: The objects to sync.
+    output_dir: The directory to sync to.
+
+  Returns:
+    The number of files in sync.
+  """
+  os.makedirs(output_dir, exist_ok=True)
+  manifest_path = pathlib.Path(output_dir, _DIR_MANIFEST_FILE)
+  with open(pathlib.Path(output_dir, _DIR_LOCK_FILE), 'a') as lock_file:
+    # Released when the file is closed.
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    try:
+      with open(manifest_path, 'r', encoding='utf8') as manifest_file:
+        manifest = json.load(manifest_file)
+    except (FileNotFoundError, ValueError):
+      manifest = {}
+
+    wanted = {blob.name[len(prefix):]: blob for blob in blobs}
+    for relative_path in set(manifest) - set(wanted):
+      with contextlib.suppress(FileNotFoundError):
+        os.remove(pathlib.Path(output_dir, relative_path))
+      del manifest[relative_path]
+
+    blob_file_pairs = []
+    for relative_path, blob in wanted.items():
+      file_name = str(pathlib.Path(output_dir, relative_path))
+      entry = manifest.get(relative_path)
+      if (
+          entry and entry['generation'] == blob.generation
+          and os.path.isfile(file_name)
+          and os.path.getsize(file_name) == entry['size']
+      ):
+        continue
+      manifest.pop(relative_path, None)
+      blob_file_pairs.append((blob, f'{file_name}.{os.getpid()}.tmp'))
+
+    downloaded = set(_download_many(blob_file_pairs, bucket_name))
+    for blob, temp_file_name in blob_file_pairs:
+      relative_path = blob.name[len(prefix):]
+      if temp_file_name in downloaded:
+        file_name = str(pathlib.Path(output_dir, relative_path))
+        os.replace(temp_file_name, file_name)
+        _record_synced(bucket_name, blob.name, file_name)
+        manifest[relative_path] = {
+            'generation': blob.generation,
+            'size': os.path.getsize(file_name),
+        }
+      else:
+        with contextlib.suppress(FileNotFoundError):
+          os.remove(temp_file_name)
+
+    with tempfile.NamedTemporaryFile(
+        'w', dir=output_dir, delete=False, encoding='utf8'
+    ) as manifest_file:
+      json.dump(manifest, manifest_file)
+    os.replace(manifest_file.name, manifest_path)
+
+  StorageAccounting.record(
+      'dir_manifest',
+      requests=0,
+      cache_hits=len(wanted) - len(blob_file_pairs),
+      cache_misses=len(blob_file_pairs),
+  )
+  logging.info(
+      'DOWNLOAD - Synced %d of %d files from bucket "%s" and folder "%s" into '
+      'path "%s", downloading %d.',
+      len(manifest),
+      len(wanted),
+      bucket_name,
+      prefix,
+      output_dir,
+      len(downloaded),
+  )
+  return len(manifest)
+
+
+def _download_many(
+    blob_file_pairs: Sequence[Tuple[StorageBackend.ObjectInfo, str]],
+    bucket_name: str,
+) -> Sequence[str]:
+  """Downloads objects to local files concurrently.
+
+  Parallelism is controlled via `CONFIG_GCS_TRANSFER_WORKER_TYPE` and
+  `CONFIG_GCS_TRANSFER_MAX_WORKERS`. Failures are logged per file rather than
+  raised, mirroring `upload_gcs_dir`.
+
+  Args:
+    blob_file_pairs: The blobs to download, each paired with the local path to
+      download it to.
+    bucket_name: The name of the bucket the blobs belong to.
+
+  Returns:
+    The local paths of the successfully downloaded files, in input order.
+  """
+  if not blob_file_pairs:
+    return []
+
+  for _, file_name in blob_file_pairs:
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+
+  results = get_backend().download_many(bucket_name, blob_file_pairs)
+  downloaded = []
+  for (blob, file_name), result in zip(blob_file_pairs, results):
+    if isinstance(result, Exception):
+      logging.warning(
+          'DOWNLOAD - Failed to download path "%s" due to exception: %r.',
+          blob.name,
+          result,
+      )
+    else:
+      logging.info('DOWNLOAD - Downloaded path "%s".', blob.name)
+      _record_synced(bucket_name, blob.name, file_name)
+      downloaded.append(file_name)
+  return downloaded
+
+
+def _file_fingerprint(file_name: str) -> Tuple[str, int, int]:
+  stat = os.stat(file_name)
+  return os.path.realpath(file_name), stat.st_size, stat.st_mtime_ns
+
+
+def _record_synced(bucket_name: str, blob_name: str, file_name: str):
+  """Records that a local file matches the given object, for incremental use."""
+  fingerprint = _file_fingerprint(file_name)
+  with _synced_files_lock:
+    _synced_files[(bucket_name, blob_name)] = fingerprint
+
+
+def _forget_synced(bucket_name: str, blob_name: str):
+  with _synced_files_lock:
+    _synced_files.pop((bucket_name, blob_name), None)
+
+
+def _is_synced(bucket_name: str, blob_name: str, file_name: str) -> bool:
+  """Checks whether a local file is unchanged since it was last synced."""
+  with _synced_files_lock:
+    fingerprint = _synced_files.get((bucket_name, blob_name))
+  return fingerprint == _file_fingerprint(file_name)
+
+
+def _suffix_glob(suffix: str) -> Optional[str]:
+  """Returns a glob matching names ending in `suffix`, for server filtering."""
+  if any(char in suffix for char in '*?[]{}\\'):
+    return None
+  return f'**{suffix}'
+
+
+def _filter_video_blobs(
+    blobs: Iterable[StorageBackend.ObjectInfo],
+    first_only: bool,
+) -> Sequence[str]:
+  """Returns the names of the given blobs that are video files."""
+  result = []
+
+  for blob in blobs:
+    logging.info('FILTER - Found blob with name "%s".', blob.name)
+    _, file_ext = os.path.splitext(blob.name)
+    file_ext = file_ext[1:]
+
+    if file_ext and Utils.VideoExtension.has_value(file_ext):
+      logging.info('FILTER - Found video file "%s".', blob.name)
+      result.append(blob.name)
+      if first_only:
+        break
+  return result
+
+
+def _filter_blobs(
+    bucket_name: str,
+    blobs: Iterable[StorageBackend.ObjectInfo],
+    suffix: str,
+    fetch_content: bool,
+    download: bool,
+    download_dir: Optional[str],
+) -> Sequence[Union[bytes, str]]:
+  """Returns the names, contents or downloaded paths of the matching blobs."""
+  result = []
+  blob_file_pairs = []
+
+  for blob in blobs:
+    if blob.name.endswith(suffix):
+      logging.info('FILTER - Found matching file "%s".', blob.name)
+      if download:
+        destination_file_name = str(
+            pathlib.Path(download_dir, pathlib.Path(blob.name).name)
+        )
+        blob_file_pairs.append((blob, destination_file_name))
+      else:
+        result.append(
+            _read_small(bucket_name, blob) if fetch_content else blob.name
+        )
+
+  if download:
+    result = _download_many(blob_file_pairs, bucket_name)
+  return result
+
+
+def _read_small(
+    bucket_name: str,
+    ref: StorageBackend.ObjectRef,
+    small: bool = False,
+) -> bytes:
+  """Reads a whole object, hedging the read if it is small and enabled.
+
+  With `CONFIG_GCS_HEDGED_READS`, a duplicate read is issued if the original
+  has not finished within the `CONFIG_GCS_HEDGE_PERCENTILE` percentile of
+  recent read latencies, and whichever finishes first is used. This bounds the
+  tail latency of the many small JSON and text objects the pipeline fetches,
+  at the cost of a few extra requests. Only objects known to be small are
+  hedged, as duplicating the read of a large object would be costly: those the
+  caller marks as `small`, and `ObjectInfo` refs listed with a size of at most
+  `CONFIG_GCS_HEDGE_MAX_SIZE`. A listed size above the limit always disables
+  hedging, even for objects marked as `small`.
+
+  Args:
+    bucket_name: The name of the bucket to read from.
+    ref: The object to read.
+    small: Whether the caller knows the object to be small, e.g. a JSON file
+      written by the pipeline, so that it can be hedged without a known size.
+
+  Returns:
+    The object contents.
+  """
+  backend = get_backend()
+  size = ref.size if isinstance(ref, StorageBackend.ObjectInfo) else None
+  if (
+      not ConfigService.CONFIG_GCS_HEDGED_READS
+      or (size is None and not small)
+      or (size is not None and size > ConfigService.CONFIG_GCS_HEDGE_MAX_SIZE)
+  ):
+    return backend.read(bucket_name, ref)
+
+  executor = _get_hedge_executor()
+  read = StorageAccounting.bind_stage(backend.read)
+  started = time.monotonic()
+  primary = executor.submit(read, bucket_name, ref)
+  primary.add_done_callback(
+      lambda _: _read_latencies.append(time.monotonic() - started)
+  )
+  pending = {primary}
+  done, _ = concurrent.futures.wait(pending, timeout=_hedge_delay())
+  if not done:
+    StorageCounters.increment('hedged_reads')
+    logging.info(
+        'DOWNLOAD - Hedging slow read of "%s".', StorageBackend.object_name(ref)
+    )
+    pending.add(executor.submit(read, bucket_name, ref))
+
+  error = None
+  while pending:
+    done, pending = concurrent.futures.wait(
+        pending, return_when=concurrent.futures.FIRST_COMPLETED
+    )
+    for future in done:
+      if future.exception() is None:
+        if future is not primary:
+          StorageCounters.increment('hedged_reads_won')
+        return future.result()
+      error = future.exception()
+  raise error
+
+
+def _hedge_delay() -> float:
+  """Returns how long to wait for a read before hedging it, in seconds."""
+  latencies = sorted(_read_latencies)
+  if len(latencies) < _HEDGE_MIN_SAMPLES:
+    return ConfigService.CONFIG_GCS_HEDGE_DEFAULT_DELAY
+  index = int(
+      (len(latencies) - 1) * ConfigService.CONFIG_GCS_HEDGE_PERCENTILE / 100
+  )
+  return latencies[index]
+
+
+def _get_hedge_executor() -> concurrent.futures.ThreadPoolExecutor:
+  global _hedge_executor
+  with _backend_lock:
+    if _hedge_executor is None:
+      _hedge_executor = concurrent.futures.ThreadPoolExecutor(
+          ConfigService.CONFIG_GCS_CONNECTION_POOL_SIZE
+      )
+    return _hedge_executor
@@ -0,0 +1,86 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the replay script.
+
+Usage:
+  python -m unittest discover -s tests -p '*_test.py'
+"""
+
+import os
+import pathlib
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+import config as ConfigService
+import replay
+import storage as StorageService
+
+_BUCKET = 'bucket'
+_VIDEO_FOLDER = 'video--n--0--user'
+_INTERNAL_FILES = [
+    f'.vigenair-probes/{_VIDEO_FOLDER}/input.mp4.probe.json',
+    '.vigenair-uploads/abcdef',
+]
+
+
+class ReplayTest(unittest.TestCase):
+
+  def test_follow_skips_internal_files(self):
+    root = tempfile.mkdtemp()
+    video_dir = pathlib.Path(root, _BUCKET, _VIDEO_FOLDER)
+    video_dir.mkdir(parents=True)
+    (video_dir / 'input.mp4').write_bytes(b'')
+    replayed = []
+
+    def gcs_file_uploaded(cloud_event):
+      """Writes internal files, as probing the input during extraction does."""
+      replayed.append(cloud_event.data['name'])
+      for name in _INTERNAL_FILES:
+        path = pathlib.Path(root, _BUCKET, name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('{}', encoding='utf8')
+
+    fake_main = types.ModuleType('main')
+    fake_main.gcs_file_uploaded = gcs_file_uploaded
+    argv = [
+        'replay.py',
+        '--root',
+        root,
+        '--bucket',
+        _BUCKET,
+        '--follow',
+        f'{_VIDEO_FOLDER}/input.mp4',
+    ]
+    # The configuration may already have been read by other tests.
+    self.addCleanup(StorageService.set_backend, None)
+    StorageService.set_backend(None)
+    with mock.patch.dict(sys.modules, {'main': fake_main}), mock.patch.object(
+        sys, 'argv', argv
+    ), mock.patch.dict(os.environ), mock.patch.object(
+        ConfigService, 'CONFIG_STORAGE_BACKEND', 'local'
+    ), mock.patch.object(ConfigService, 'CONFIG_STORAGE_LOCAL_DIR', root):
+      replay.main()
+
+    self.assertEqual(replayed, [f'{_VIDEO_FOLDER}/input.mp4'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,100 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the storage module.
+
+Usage:
+  python -m unittest discover -s tests -p '*_test.py'
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+import config as ConfigService
+import storage as StorageService
+import storage.backend as StorageBackend
+import storage.counters as StorageCounters
+import utils as Utils
+
+_BUCKET = 'bucket'
+_RENDER_FILE = 'video--n--0--user/1700000000000/render.json'
+_RENDER_CONTENTS = b'{"render_settings": {}}'
+
+
+class _SlowFirstReadBackend(StorageBackend.InMemoryBackend):
+  """Stalls the first read, as a straggling request would."""
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self._stalled = threading.Event()
+
+  def read(self, bucket_name, ref, start=None, end=None):
+    if not self._stalled.is_set():
+      self._stalled.set()
+      time.sleep(1)
+    return super().read(bucket_name, ref, start, end)
+
+
+class HedgedReadsTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.addCleanup(StorageService.set_backend, None)
+    StorageService.set_backend(
+        _SlowFirstReadBackend({(_BUCKET, _RENDER_FILE): _RENDER_CONTENTS})
+    )
+    StorageCounters.reset_counters()
+    for name, value in (
+        ('CONFIG_GCS_HEDGED_READS', True),
+        ('CONFIG_GCS_HEDGE_DEFAULT_DELAY', 0.05),
+    ):
+      patcher = mock.patch.object(ConfigService, name, value, create=True)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def _download_render_file(self, **kwargs) -> bytes:
+    return StorageService.download_gcs_file(
+        file_path=Utils.TriggerFile(_RENDER_FILE),
+        bucket_name=_BUCKET,
+        fetch_contents=True,
+        **kwargs,
+    )
+
+  def test_slow_small_read_is_hedged(self):
+    started = time.monotonic()
+    contents = self._download_render_file(small=True)
+    elapsed = time.monotonic() - started
+
+    self.assertEqual(contents, _RENDER_CONTENTS)
+    counters = StorageService.get_counters()
+    self.assertEqual(counters.get('hedged_reads'), 1)
+    self.assertEqual(counters.get('hedged_reads_won'), 1)
+    self.assertLess(elapsed, 1)
+
+  def test_read_of_unknown_size_is_not_hedged(self):
+    contents = self._download_render_file()
+
+    self.assertEqual(contents, _RENDER_CONTENTS)
+    self.assertFalse(StorageService.get_counters().get('hedged_reads'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -17,15 +17,72 @@
 This module contains various utility functions used by Vigenair.
 """
 
+import asyncio
+import collections
+from concurrent import futures
+import contextlib
+import dataclasses
 import enum
+import functools
+from http import server
+import heapq
+import itertools
+import json
 import logging
 import os
 import pathlib
+import re
 import subprocess
-from typing import Optional, Sequence, Union
+import threading
+import time
+from typing import (
+    IO,
+    Any,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+from urllib import parse
 
 import config as ConfigService
 
+# How far into a file to read packets for estimating its keyframe interval.
+_KEYFRAME_PROBE_WINDOW_S = 10
+# How often to check on running subprocesses for timeouts and cancellation.
+_SUBPROCESS_POLL_INTERVAL_S = 0.5
+# How long to wait for a stopped subprocess to exit before killing it.
+_SUBPROCESS_TERMINATE_TIMEOUT_S = 5
+# The longest line of subprocess output that can be read asynchronously.
+_SUBPROCESS_LINE_LIMIT = 1024 * 1024
+
+_media_probes_lock = threading.Lock()
+_media_probes: Dict[Tuple[str, int, int], 'MediaProbe'] = {}
+
+
+_generative_models_lock = threading.Lock()
+_generative_models: Dict[str, Any] = {}
+_vertexai_initialised = False
+
+
+def _reset_after_fork():
+  global _media_probes_lock, _generative_models_lock, _vertexai_initialised
+  _media_probes_lock = threading.Lock()
+  _ffmpeg_scheduler.reset()
+  # Model handles hold gRPC channels, which can't be used across a fork.
+  _generative_models_lock = threading.Lock()
+  _generative_models.clear()
+  _vertexai_initialised = False
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
 
 class TranscriptionService(enum.Enum):
   """Enum of supported transcription services."""
@@ -124,6 +181,24 @@ class VideoMetadata:
     )
 
 
+def is_internal_file(filepath: str) -> bool:
+  """Checks whether a GCS path is an internal file rather than a trigger.
+
+  Internal files, like media probes and the parts of sliced uploads, are kept
+  outside of the video folders and are not valid `TriggerFile` paths.
+
+  Args:
+    filepath: The path of the file in its bucket.
+
+  Returns:
+    Whether the file is internal and should be ignored by triggers.
+  """
+  return filepath.startswith((
+      f'{ConfigService.OUTPUT_MEDIA_PROBES_DIR}/',
+      f'{ConfigService.OUTPUT_PARTIAL_UPLOADS_DIR}/',
+  ))
+
+
 class TriggerFile:
   """Represents an input file that was uploaded to GCS and triggered the CF."""
 
@@ -217,14 +292,475 @@ class TriggerFile:
     )
 
 
+class JobPriority(enum.IntEnum):
+  """Enum of ffmpeg job priorities, where jobs of lower values run first."""
+
+  HIGH = 0
+  NORMAL = 1
+  LOW = 2
+
+
+class FfmpegScheduler:
+  """Shares a budget of cores between the concurrent ffmpeg jobs of a process.
+
+  Jobs are admitted in order of priority and then arrival, while fewer than
+  `max_jobs` jobs are running and some of the budget is free. Each admitted job
+  is assigned an even share of the free cores between itself and the jobs
+  queued behind it that could also be admitted, capped at `max_job_cores`, and
+  should limit its threads to that share. The cap keeps a job started on an
+  idle scheduler from taking the whole budget, which would make every job that
+  arrives while it runs wait for it to finish.
+  """
+
+  def __init__(self, core_budget: int, max_jobs: int, max_job_cores: int = 0):
+    """Initialiser.
+
+    Args:
+      core_budget: The number of cores to share between jobs.
+      max_jobs: The maximum number of jobs to run concurrently.
+      max_job_cores: The maximum number of cores of a single job. 0 allows
+        half of the budget, or all of it if only one job may run at a time.
+    """
+    self.core_budget = max(1, core_budget)
+    self.max_jobs = max(1, max_jobs)
+    self.max_job_cores = max(0, max_job_cores)
+    self.reset()
+
+  def reset(self):
+    """Forgets all running and queued jobs, e.g. in a forked child process."""
+    self._condition = threading.Condition()
+    self._async_waiters = set()
+    self._queue = []
+    self._tickets = itertools.count()
+    self._running = 0
+    self._cores_used = 0
+    self._jobs = 0
+    self._wait_s = 0
+    self._max_queue_depth = 0
+
+  @contextlib.contextmanager
+  def job(
+      self,
+      priority: JobPriority = JobPriority.NORMAL,
+      cancel_event: Optional[threading.Event] = None,
+  ) -> Iterator[int]:
+    """Waits for the job's turn and holds its share of cores within the context.
+
+    Args:
+      priority: The priority of the job.
+      cancel_event: Optional event which stops waiting once set.
+
+    Yields:
+      The number of threads the job may use.
+
+    Raises:
+      `concurrent.futures.CancelledError` if `cancel_event` is set while
+      waiting.
+    """
+    ticket, queued = self._enqueue(priority)
+    with self._condition:
+      threads = self._admit(ticket)
+      while threads is None:
+        if cancel_event is not None and cancel_event.is_set():
+          self._withdraw(ticket)
+          raise futures.CancelledError('Cancelled while waiting for ffmpeg.')
+        self._condition.wait(_SUBPROCESS_POLL_INTERVAL_S)
+        threads = self._admit(ticket)
+    self._log_wait(queued, threads)
+    try:
+      yield threads
+    finally:
+      self._release(threads)
+
+  @contextlib.asynccontextmanager
+  async def job_async(
+      self,
+      priority: JobPriority = JobPriority.NORMAL,
+  ) -> AsyncIterator[int]:
+    """Awaits the job's turn and holds its share of cores within the context.
+
+    Args:
+      priority: The priority of the job.
+
+    Yields:
+      The number of threads the job may use.
+    """
+    ticket, queued = self._enqueue(priority)
+    wakeup = asyncio.Event()
+    waiter = functools.partial(
+        asyncio.get_running_loop().call_soon_threadsafe, wakeup.set
+    )
+    try:
+      while True:
+        wakeup.clear()
+        with self._condition:
+          threads = self._admit(ticket)
+          if threads is not None:
+            self._async_waiters.discard(waiter)
+            break
+          self._async_waiters.add(waiter)
+        await wakeup.wait()
+    except BaseException:
+      with self._condition:
+        self._async_waiters.discard(waiter)
+        self._withdraw(ticket)
+      raise
+    self._log_wait(queued, threads)
+    try:
+      yield threads
+    finally:
+      self._release(threads)
+
+  def _enqueue(self, priority: JobPriority) -> Tuple[Tuple[int, int], float]:
+    with self._condition:
+      ticket = (int(priority), next(self._tickets))
+      heapq.heappush(self._queue, ticket)
+      self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+    return ticket, time.monotonic()
+
+  def _admit(self, ticket: Tuple[int, int]) -> Optional[int]:
+    """Admits a queued job if it is its turn, returning its thread share."""
+    if (
+        self._queue[0] != ticket or self._running >= self.max_jobs
+        or self._cores_used >= self.core_budget
+    ):
+      return None
+    heapq.heappop(self._queue)
+    admissible = min(len(self._queue), self.max_jobs - self._running - 1)
+    threads = max(
+        1,
+        min(
+            (self.core_budget - self._cores_used) // (1 + admissible),
+            self._get_max_job_cores(),
+        ),
+    )
+    self._running += 1
+    self._cores_used += threads
+    self._jobs += 1
+    # The next job in the queue may be admissible as well.
+    self._notify()
+    return threads
+
+  def _get_max_job_cores(self) -> int:
+    if self.max_job_cores:
+      return self.max_job_cores
+    if self.max_jobs == 1:
+      return self.core_budget
+    return max(1, -(-self.core_budget // 2))
+
+  def _withdraw(self, ticket: Tuple[int, int]):
+    self._queue.remove(ticket)
+    heapq.heapify(self._queue)
+    self._notify()
+
+  def _release(self, threads: int):
+    with self._condition:
+      self._running -= 1
+      self._cores_used -= threads
+      self._notify()
+
+  def _notify(self):
+    """Wakes up all waiting jobs. Must be called with the condition held."""
+    self._condition.notify_all()
+    for waiter in list(self._async_waiters):
+      try:
+        waiter()
+      except RuntimeError:
+        # The waiter's event loop is closed.
+        self._async_waiters.discard(waiter)
+
+  def _log_wait(self, queued: float, threads: int):
+    waited = time.monotonic() - queued
+    with self._condition:
+      self._wait_s += waited
+      queue_depth = len(self._queue)
+    if waited >= _SUBPROCESS_POLL_INTERVAL_S:
+      logging.info(
+          'SUBPROCESS - Waited %.1fs to run ffmpeg with %d threads, %d jobs '
+          'queued.',
+          waited,
+          threads,
+          queue_depth,
+      )
+
+  def get_metrics(self) -> Dict[str, Any]:
+    """Returns the current load and cumulative statistics of the scheduler."""
+    with self._condition:
+      return {
+          'core_budget': self.core_budget,
+          'max_jobs': self.max_jobs,
+          'max_job_cores': self._get_max_job_cores(),
+          'running': self._running,
+          'cores_used': self._cores_used,
+          'queue_depth': len(self._queue),
+          'max_queue_depth': self._max_queue_depth,
+          'jobs': self._jobs,
+          'wait_s': round(self._wait_s, 3),
+      }
+
+
+_ffmpeg_scheduler = FfmpegScheduler(
+    core_budget=ConfigService.CONFIG_FFMPEG_CORE_BUDGET or os.cpu_count() or 1,
+    max_jobs=(
+        ConfigService.CONFIG_FFMPEG_MAX_JOBS
+        or ConfigService.CONFIG_FFMPEG_CORE_BUDGET or os.cpu_count() or 1
+    ),
+    max_job_cores=ConfigService.CONFIG_FFMPEG_MAX_JOB_CORES,
+)
+
+
+def get_ffmpeg_scheduler_metrics() -> Dict[str, Any]:
+  """Returns the metrics of the process-wide ffmpeg scheduler."""
+  return _ffmpeg_scheduler.get_metrics()
+
+
+def share_ffmpeg_core_budget(processes: int):
+  """Splits the ffmpeg core budget of this process between child processes.
+
+  Use this as the initializer of process pools whose workers run ffmpeg
+  concurrently, as each worker process has its own scheduler.
+
+  Args:
+    processes: The number of processes sharing the budget.
+  """
+  _ffmpeg_scheduler.core_budget = max(
+      1, _ffmpeg_scheduler.core_budget // processes
+  )
+  _ffmpeg_scheduler.max_jobs = max(1, _ffmpeg_scheduler.max_jobs // processes)
+  if _ffmpeg_scheduler.max_job_cores:
+    _ffmpeg_scheduler.max_job_cores = min(
+        _ffmpeg_scheduler.max_job_cores, _ffmpeg_scheduler.core_budget
+    )
+
+
+@dataclasses.dataclass
+class FfmpegProgress:
+  """Progress of an ffmpeg command, as reported via `-progress`.
+
+  Attributes:
+    frame: The number of frames encoded so far.
+    fps: The encoding throughput in frames per second.
+    speed: The encoding speed relative to real time, if known.
+    out_time_s: The duration of the output encoded so far, in seconds.
+    eta_s: The estimated remaining time in seconds, if known.
+    done: Whether encoding has finished.
+  """
+
+  frame: int = 0
+  fps: float = 0
+  speed: Optional[float] = None
+  out_time_s: float = 0
+  eta_s: Optional[float] = None
+  done: bool = False
+
+
+class _FfmpegProgressParser:
+  """Parses the `key=value` blocks that ffmpeg writes via `-progress`."""
+
+  _KEYS = frozenset([
+      'frame',
+      'fps',
+      'bitrate',
+      'total_size',
+      'out_time_us',
+      'out_time_ms',
+      'out_time',
+      'dup_frames',
+      'drop_frames',
+      'speed',
+      'progress',
+  ])
+
+  def __init__(
+      self,
+      description: str,
+      media_duration: Optional[float],
+      on_progress: Optional[Callable[[FfmpegProgress], None]],
+  ):
+    self.description = description
+    self.media_duration = media_duration
+    self.on_progress = on_progress
+    self.values = {}
+    self.last_logged = time.monotonic()
+
+  def feed(self, line: str) -> bool:
+    """Consumes a line of output, returning whether it was a progress line."""
+    key, sep, value = line.partition('=')
+    if not sep or (key not in self._KEYS and not key.startswith('stream_')):
+      return False
+    self.values[key] = value.strip()
+    if key == 'progress':
+      self._report(self._progress())
+      self.values = {}
+    return True
+
+  def _progress(self) -> FfmpegProgress:
+    progress = FfmpegProgress(
+        frame=int(_parse_number(self.values.get('frame')) or 0),
+        fps=_parse_number(self.values.get('fps')) or 0,
+        speed=_parse_number(self.values.get('speed', '').rstrip('x')),
+        out_time_s=(_parse_number(self.values.get('out_time_us')) or 0) / 1e6,
+        done=self.values.get('progress') == 'end',
+    )
+    if progress.done:
+      progress.eta_s = 0
+    elif self.media_duration and progress.speed:
+      progress.eta_s = max(
+          0, (self.media_duration - progress.out_time_s) / progress.speed
+      )
+    return progress
+
+  def _report(self, progress: FfmpegProgress):
+    if self.on_progress:
+      self.on_progress(progress)
+    now = time.monotonic()
+    if (
+        progress.done or now - self.last_logged
+        >= ConfigService.CONFIG_SUBPROCESS_PROGRESS_LOG_INTERVAL
+    ):
+      self.last_logged = now
+      logging.info(
+          'SUBPROCESS - Progress of [%s]: frame=%d fps=%.1f speed=%s '
+          'out_time=%.1fs eta=%s',
+          self.description,
+          progress.frame,
+          progress.fps,
+          f'{progress.speed:.2f}x' if progress.speed is not None else 'N/A',
+          progress.out_time_s,
+          f'{progress.eta_s:.1f}s' if progress.eta_s is not None else 'N/A',
+      )
+
+
+def _parse_number(value: Optional[str]) -> Optional[float]:
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return None
+
+
+def _is_ffmpeg_command(cmds: Union[str, Sequence[str]]) -> bool:
+  return (
+      not isinstance(cmds, str) and bool(cmds)
+      and os.path.basename(cmds[0]) == 'ffmpeg'
+  )
+
+
+# ffmpeg options which take no value.
+_FFMPEG_FLAGS = frozenset([
+    '-accurate_seek',
+    '-an',
+    '-autorotate',
+    '-copyinkf',
+    '-copyts',
+    '-dn',
+    '-hide_banner',
+    '-n',
+    '-noaccurate_seek',
+    '-noautorotate',
+    '-nostats',
+    '-nostdin',
+    '-re',
+    '-shortest',
+    '-sn',
+    '-stats',
+    '-vn',
+    '-y',
+])
+
+
+def _with_ffmpeg_progress(cmds: Sequence[str]) -> Sequence[str]:
+  """Makes an ffmpeg command report its progress on stdout, if applicable."""
+  if '-progress' in cmds or any(
+      arg in ('-', 'pipe:', 'pipe:1') for arg in cmds
+  ):
+    return cmds
+  return [cmds[0], '-progress', 'pipe:1', '-nostats', *cmds[1:]]
+
+
+def _with_ffmpeg_threads(cmds: Sequence[str], threads: int) -> Sequence[str]:
+  """Limits the decoding, filtering and encoding threads of an ffmpeg command.
+
+  Args:
+    cmds: The ffmpeg command.
+    threads: The number of threads to use for each stage.
+
+  Returns:
+    The command with thread options before each of its inputs and outputs,
+    unless it already had some.
+  """
+  if any(arg.endswith('threads') for arg in cmds):
+    return cmds
+  limited_cmds = [
+      cmds[0],
+      '-filter_threads',
+      str(threads),
+      '-filter_complex_threads',
+      str(threads),
+  ]
+  index = 1
+  while index < len(cmds):
+    arg = cmds[index]
+    if arg == '-i' or not _is_ffmpeg_option(arg):
+      # Inputs follow `-i`, any other argument that is not an option or an
+      # option's value is an output.
+      limited_cmds.extend(['-threads', str(threads)])
+    limited_cmds.append(arg)
+    if _is_ffmpeg_option(arg) and arg not in _FFMPEG_FLAGS:
+      index += 1
+      if index < len(cmds):
+        limited_cmds.append(cmds[index])
+    index += 1
+  return limited_cmds
+
+
+def _is_ffmpeg_option(arg: str) -> bool:
+  """Checks whether an ffmpeg argument is an option, rather than a file name."""
+  return arg.startswith('-') and arg != '-'
+
+
+def _read_output(
+    stream: IO[str],
+    output_tail: Deque[str],
+    progress_parser: _FfmpegProgressParser,
+):
+  """Reads the output of a process line by line until it is closed."""
+  with stream:
+    for line in stream:
+      line = line.rstrip('\n')
+      if not progress_parser.feed(line):
+        output_tail.append(line)
+
+
+def _stop_process(process: subprocess.Popen):
+  """Terminates a process, killing it if it does not exit in time."""
+  process.terminate()
+  try:
+    process.wait(timeout=_SUBPROCESS_TERMINATE_TIMEOUT_S)
+  except subprocess.TimeoutExpired:
+    process.kill()
+    process.wait()
+
+
 def execute_subprocess_commands(
     cmds: Union[str, Sequence[str]],
     description: str,
     cwd: Optional[str] = None,
     shell: bool = False,
+    timeout: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+    media_duration: Optional[float] = None,
+    on_progress: Optional[Callable[[FfmpegProgress], None]] = None,
+    priority: JobPriority = JobPriority.NORMAL,
 ) -> str:
   """Executes the given commands and returns results.
 
+  The combined stdout and stderr of the commands is streamed line by line, and
+  only the last `CONFIG_SUBPROCESS_OUTPUT_BUFFER_LINES` lines are kept for
+  logging and error reporting. ffmpeg commands are made to report their
+  progress, which is logged every `CONFIG_SUBPROCESS_PROGRESS_LOG_INTERVAL`
+  seconds, and are run through the process-wide ffmpeg scheduler, which limits
+  their threads to their share of the core budget.
+
   Args:
     cmds: Command(s) to execute, which are expected to be in the $PATH value of
       the executing process.
@@ -233,35 +769,238 @@ def execute_subprocess_commands(
       None, indicating that the commands are to be executed in the current
       working directory of the executing process.
     shell: Whether to execute the commands in a shell. Defaults to False.
+    timeout: Optional number of seconds after which the commands are stopped.
+      Defaults to `CONFIG_SUBPROCESS_TIMEOUT`.
+    cancel_event: Optional event which stops the commands once set.
+    media_duration: Optional duration in seconds of the media an ffmpeg command
+      outputs, used to estimate the remaining time.
+    on_progress: Optional callback receiving the progress of an ffmpeg command.
+    priority: The scheduling priority of an ffmpeg command.
 
   Returns:
-    The output of executing the given commands.
+    The last lines of output of executing the given commands.
 
   Raises:
     `subprocess.CalledProcessError` if a failure happens.
+    `subprocess.TimeoutExpired` if the timeout expires.
+    `concurrent.futures.CancelledError` if `cancel_event` is set.
   """
+  if timeout is None:
+    timeout = ConfigService.CONFIG_SUBPROCESS_TIMEOUT or None
+  progress_parser = _FfmpegProgressParser(
+      description, media_duration, on_progress
+  )
+  if not _is_ffmpeg_command(cmds):
+    return _execute(
+        cmds, description, cwd, shell, timeout, cancel_event, progress_parser
+    )
+  with _ffmpeg_scheduler.job(priority, cancel_event) as threads:
+    cmds = _with_ffmpeg_progress(_with_ffmpeg_threads(cmds, threads))
+    return _execute(
+        cmds, description, cwd, shell, timeout, cancel_event, progress_parser
+    )
+
+
+def _execute(
+    cmds: Union[str, Sequence[str]],
+    description: str,
+    cwd: Optional[str],
+    shell: bool,
+    timeout: Optional[float],
+    cancel_event: Optional[threading.Event],
+    progress_parser: _FfmpegProgressParser,
+) -> str:
+  """Executes commands as per `execute_subprocess_commands`."""
   logging.info('SUBPROCESS - Executing commands [%r]...', cmds)
 
+  started = time.monotonic()
+  output_tail = collections.deque(
+      maxlen=ConfigService.CONFIG_SUBPROCESS_OUTPUT_BUFFER_LINES
+  )
+  process = subprocess.Popen(
+      args=cmds,
+      stdout=subprocess.PIPE,
+      stderr=subprocess.STDOUT,
+      cwd=cwd,
+      shell=shell,
+      text=True,
+      errors='replace',
+  )
+  reader = threading.Thread(
+      target=_read_output,
+      args=(process.stdout, output_tail, progress_parser),
+      daemon=True,
+  )
+  reader.start()
   try:
-    output = subprocess.run(
-        args=cmds,
+    while True:
+      try:
+        process.wait(timeout=_SUBPROCESS_POLL_INTERVAL_S)
+        break
+      except subprocess.TimeoutExpired:
+        pass
+      if cancel_event is not None and cancel_event.is_set():
+        raise futures.CancelledError(f'Cancelled [{description}].')
+      if timeout and time.monotonic() - started >= timeout:
+        raise subprocess.TimeoutExpired(cmds, timeout)
+  except BaseException as e:
+    _stop_process(process)
+    reader.join(_SUBPROCESS_TERMINATE_TIMEOUT_S)
+    logging.error(
+        'Stopped executing [%s] after %.1fs: %r\noutput=[%r]',
+        description,
+        time.monotonic() - started,
+        e,
+        '\n'.join(output_tail),
+    )
+    raise
+  # Descendants may keep the output open, so don't wait for them forever.
+  reader.join(_SUBPROCESS_TERMINATE_TIMEOUT_S)
+  return _check_output(
+      cmds, description, process.returncode, output_tail, started
+  )
+
+
+def _check_output(
+    cmds: Union[str, Sequence[str]],
+    description: str,
+    returncode: int,
+    output_tail: Deque[str],
+    started: float,
+) -> str:
+  """Logs the outcome of executed commands and returns their output."""
+  output = '\n'.join(output_tail)
+  if returncode:
+    logging.error(
+        'Error while executing [%s]!\noutput=[%r]', description, output
+    )
+    raise subprocess.CalledProcessError(returncode, cmds, output)
+  logging.info(
+      'SUBPROCESS - Executed [%s] in %.1fs.',
+      description,
+      time.monotonic() - started,
+  )
+  logging.debug(
+      'SUBPROCESS - Output of [%s]:\noutput=[%r]', description, output
+  )
+  return output
+
+
+async def execute_subprocess_commands_async(
+    cmds: Union[str, Sequence[str]],
+    description: str,
+    cwd: Optional[str] = None,
+    shell: bool = False,
+    timeout: Optional[float] = None,
+    media_duration: Optional[float] = None,
+    on_progress: Optional[Callable[[FfmpegProgress], None]] = None,
+    priority: JobPriority = JobPriority.NORMAL,
+) -> str:
+  """Executes the given commands without blocking the event loop.
+
+  This is the asyncio counterpart of `execute_subprocess_commands`, with the
+  same output handling, ffmpeg scheduling, logging and errors. The commands are
+  stopped when the awaiting task is cancelled.
+
+  Args:
+    cmds: Command(s) to execute, which are expected to be in the $PATH value of
+      the executing process.
+    description: Description to output in logging messages.
+    cwd: Optional working directory to execute the commands in.
+    shell: Whether to execute the commands in a shell. Defaults to False.
+    timeout: Optional number of seconds after which the commands are stopped.
+      Defaults to `CONFIG_SUBPROCESS_TIMEOUT`.
+    media_duration: Optional duration in seconds of the media an ffmpeg command
+      outputs, used to estimate the remaining time.
+    on_progress: Optional callback receiving the progress of an ffmpeg command.
+    priority: The scheduling priority of an ffmpeg command.
+
+  Returns:
+    The last lines of output of executing the given commands.
+
+  Raises:
+    `subprocess.CalledProcessError` if a failure happens.
+    `subprocess.TimeoutExpired` if the timeout expires.
+  """
+  if timeout is None:
+    timeout = ConfigService.CONFIG_SUBPROCESS_TIMEOUT or None
+  progress_parser = _FfmpegProgressParser(
+      description, media_duration, on_progress
+  )
+  if not _is_ffmpeg_command(cmds):
+    return await _execute_async(
+        cmds, description, cwd, shell, timeout, progress_parser
+    )
+  async with _ffmpeg_scheduler.job_async(priority) as threads:
+    cmds = _with_ffmpeg_progress(_with_ffmpeg_threads(cmds, threads))
+    return await _execute_async(
+        cmds, description, cwd, shell, timeout, progress_parser
+    )
+
+
+async def _execute_async(
+    cmds: Union[str, Sequence[str]],
+    description: str,
+    cwd: Optional[str],
+    shell: bool,
+    timeout: Optional[float],
+    progress_parser: _FfmpegProgressParser,
+) -> str:
+  """Executes commands as per `execute_subprocess_commands_async`."""
+  logging.info('SUBPROCESS - Executing commands [%r]...', cmds)
+
+  started = time.monotonic()
+  output_tail = collections.deque(
+      maxlen=ConfigService.CONFIG_SUBPROCESS_OUTPUT_BUFFER_LINES
+  )
+  if shell:
+    process = await asyncio.create_subprocess_shell(
+        cmds,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         cwd=cwd,
-        shell=shell,
-        check=True,
-        text=True,
-    ).stdout
-
-    logging.info(
-        'SUBPROCESS - Output of [%s]:\noutput=[%r]', description, output
+        limit=_SUBPROCESS_LINE_LIMIT,
     )
-    return output
-  except subprocess.CalledProcessError as e:
-    logging.exception(
-        'Error while executing [%s]!\noutput=[%r]', description, e.output
+  else:
+    process = await asyncio.create_subprocess_exec(
+        *cmds,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        cwd=cwd,
+        limit=_SUBPROCESS_LINE_LIMIT,
     )
-    raise e
+
+  async def read_output():
+    async for line in process.stdout:
+      line = line.decode('utf-8', errors='replace').rstrip('\n')
+      if not progress_parser.feed(line):
+        output_tail.append(line)
+    return await process.wait()
+
+  try:
+    try:
+      returncode = await asyncio.wait_for(read_output(), timeout)
+    except asyncio.TimeoutError:
+      raise subprocess.TimeoutExpired(cmds, timeout) from None
+  except BaseException as e:
+    if process.returncode is None:
+      process.terminate()
+      try:
+        await asyncio.wait_for(
+            process.wait(), _SUBPROCESS_TERMINATE_TIMEOUT_S
+        )
+      except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+    logging.error(
+        'Stopped executing [%s] after %.1fs: %r\noutput=[%r]',
+        description,
+        time.monotonic() - started,
+        e,
+        '\n'.join(output_tail),
+    )
+    raise
+  return _check_output(cmds, description, returncode, output_tail, started)
 
 
 def timestring_to_seconds(timestring: str) -> float:
@@ -281,20 +1020,335 @@ def rename_chunks(result: Sequence[str], file_suffix: str):
     )
 
 
-def get_media_duration(input_file_path: str) -> float:
-  """Retrieves the duration of the input media file."""
-  output = execute_subprocess_commands(
-      cmds=[
-          'ffprobe',
-          '-i',
-          input_file_path,
-          '-show_entries',
-          'format=duration',
-          '-v',
-          'quiet',
-          '-of',
-          'default=noprint_wrappers=1:nokey=1',
-      ],
-      description=f'get duration of [{input_file_path}] with ffprobe',
+@dataclasses.dataclass
+class MediaProbe:
+  """Technical metadata of a media file, as reported by ffprobe.
+
+  Attributes:
+    duration: The duration in seconds, or None if unknown.
+    size: The size in bytes, or 0 if unknown.
+    bit_rate: The overall bit rate in bits per second, or None if unknown.
+    has_video: Whether the file contains a video stream.
+    has_audio: Whether the file contains an audio stream.
+    video_codec: The codec of the first video stream, or None.
+    audio_codec: The codec of the first audio stream, or None.
+    frame_rate: The average frame rate of the first video stream, or None.
+    keyframe_interval: The average interval between keyframes of the first
+      video stream in seconds, estimated from the start of the file, or None.
+    streams: All streams as reported by ffprobe.
+  """
+
+  duration: Optional[float]
+  size: int
+  bit_rate: Optional[int]
+  has_video: bool
+  has_audio: bool
+  video_codec: Optional[str]
+  audio_codec: Optional[str]
+  frame_rate: Optional[float]
+  keyframe_interval: Optional[float]
+  streams: List[Dict[str, Any]]
+
+  @classmethod
+  def from_ffprobe(cls, ffprobe_output: Dict[str, Any]) -> 'MediaProbe':
+    """Creates a probe from the JSON output of ffprobe."""
+    media_format = ffprobe_output.get('format', {})
+    streams = ffprobe_output.get('streams', [])
+    video_stream = next(
+        (
+            stream for stream in streams
+            if stream.get('codec_type') == 'video'
+            and not stream.get('disposition', {}).get('attached_pic')
+        ),
+        None,
+    )
+    audio_stream = next(
+        (stream for stream in streams if stream.get('codec_type') == 'audio'),
+        None,
+    )
+    frame_rate = None
+    keyframe_interval = None
+    if video_stream:
+      numerator, _, denominator = video_stream.get(
+          'avg_frame_rate', '0/0'
+      ).partition('/')
+      if float(denominator or 0) and float(numerator):
+        frame_rate = float(numerator) / float(denominator)
+      keyframe_times = [
+          float(packet['pts_time'])
+          for packet in ffprobe_output.get('packets', [])
+          if packet.get('stream_index') == video_stream['index']
+          and 'K' in packet.get('flags', '')
+          and packet.get('pts_time') not in (None, 'N/A')
+      ]
+      if len(keyframe_times) > 1:
+        keyframe_interval = (max(keyframe_times) - min(keyframe_times)) / (
+            len(keyframe_times) - 1
+        )
+
+    def number(value, number_type):
+      return number_type(value) if value not in (None, 'N/A') else None
+
+    return cls(
+        duration=number(media_format.get('duration'), float),
+        size=number(media_format.get('size'), int) or 0,
+        bit_rate=number(media_format.get('bit_rate'), int),
+        has_video=video_stream is not None,
+        has_audio=audio_stream is not None,
+        video_codec=video_stream.get('codec_name') if video_stream else None,
+        audio_codec=audio_stream.get('codec_name') if audio_stream else None,
+        frame_rate=frame_rate,
+        keyframe_interval=keyframe_interval,
+        streams=streams,
+    )
+
+
+def _media_probe_key(input_file_path: str) -> Tuple[str, int, int]:
+  """Returns a key that changes whenever the given file changes."""
+  try:
+    stat = os.stat(input_file_path)
+  except OSError:
+    # Not a local file, e.g. a URL.
+    return input_file_path, 0, 0
+  return os.path.realpath(input_file_path), stat.st_size, stat.st_mtime_ns
+
+
+def probe_media(input_file_path: str) -> MediaProbe:
+  """Probes a media file with a single ffprobe call, memoized per file version.
+
+  Args:
+    input_file_path: The path or URL of the media file.
+
+  Returns:
+    The technical metadata of the media file.
+
+  Raises:
+    `subprocess.CalledProcessError` if ffprobe fails.
+  """
+  key = _media_probe_key(input_file_path)
+  with _media_probes_lock:
+    probe = _media_probes.get(key)
+  if probe:
+    return probe
+
+  try:
+    output = subprocess.run(
+        args=[
+            'ffprobe',
+            '-v',
+            'error',
+            '-of',
+            'json',
+            '-show_format',
+            '-show_streams',
+            '-show_entries',
+            'packet=stream_index,pts_time,flags',
+            '-read_intervals',
+            f'%+{_KEYFRAME_PROBE_WINDOW_S}',
+            '-i',
+            input_file_path,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+        text=True,
+    ).stdout
+  except subprocess.CalledProcessError as e:
+    logging.exception(
+        'Error while probing [%s]!\noutput=[%r]', input_file_path, e.stderr
+    )
+    raise e
+  probe = MediaProbe.from_ffprobe(json.loads(output))
+  logging.info(
+      'PROBE - Probed [%s]: duration=%ss, video=%s@%s fps, audio=%s, '
+      'keyframe interval=%s s.',
+      input_file_path,
+      probe.duration,
+      probe.video_codec,
+      probe.frame_rate,
+      probe.audio_codec,
+      probe.keyframe_interval,
   )
-  return float(output)
+  remember_media_probe(input_file_path, probe)
+  return probe
+
+
+def remember_media_probe(input_file_path: str, probe: MediaProbe):
+  """Memoizes a probe obtained elsewhere, e.g. from a persisted sidecar."""
+  key = _media_probe_key(input_file_path)
+  with _media_probes_lock:
+    _media_probes[key] = probe
+
+
+def get_media_duration(input_file_path: str) -> float:
+  """Retrieves the duration of the input media file.
+
+  Raises:
+    `ValueError` if the duration of the file is unknown.
+  """
+  duration = probe_media(input_file_path).duration
+  if duration is None:
+    raise ValueError(f'Could not determine the duration of [{input_file_path}]')
+  return duration
+
+
+class RangedStreamServer:
+  """Serves a remote file to local consumers, e.g. ffmpeg, over HTTP.
+
+  Requests are answered with ranged reads of the remote file, so consumers that
+  seek, such as ffmpeg cutting a small time range out of a large video, only
+  transfer the bytes they actually read rather than the whole file.
+
+  Usage:
+    with RangedStreamServer('input.mp4', size, read_range) as stream:
+      ffmpeg -i stream.url ...
+  """
+
+  _RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)$')
+
+  def __init__(
+      self,
+      file_name: str,
+      size: int,
+      read_range: Callable[[int, int], bytes],
+      chunk_size: int = ConfigService.CONFIG_FFMPEG_STREAM_CHUNK_SIZE,
+  ):
+    """Initialiser.
+
+    Args:
+      file_name: The name to serve the file under. Its extension is kept so
+        that consumers can detect the container format.
+      size: The size of the remote file in bytes.
+      read_range: Callable returning the bytes of the remote file between the
+        given start and end offsets, both inclusive.
+      chunk_size: The maximum number of bytes to read from the remote file per
+        call to `read_range`.
+    """
+    self.file_name = file_name
+    self.size = size
+    self.read_range = read_range
+    self.chunk_size = chunk_size
+    self._server = None
+    self._thread = None
+
+  @property
+  def url(self) -> str:
+    host, port = self._server.server_address[:2]
+    return f'http://{host}:{port}/{parse.quote(self.file_name)}'
+
+  def __enter__(self) -> 'RangedStreamServer':
+    self._server = server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), self._create_handler()
+    )
+    self._server.daemon_threads = True
+    self._thread = threading.Thread(
+        target=self._server.serve_forever, daemon=True
+    )
+    self._thread.start()
+    logging.info('STREAM - Serving "%s" at %s.', self.file_name, self.url)
+    return self
+
+  def __exit__(self, *args):
+    self._server.shutdown()
+    self._server.server_close()
+    self._thread.join()
+
+  def _parse_range(self, header: Optional[str]):
+    """Returns the inclusive (start, end) byte range requested, or None."""
+    if not header:
+      return 0, self.size - 1
+    match = self._RANGE_PATTERN.match(header.strip())
+    if not match or not any(match.groups()):
+      return None
+    start, end = match.groups()
+    if not start:
+      start, end = max(self.size - int(end), 0), self.size - 1
+    else:
+      start = int(start)
+      end = min(int(end), self.size - 1) if end else self.size - 1
+    if start > end or start >= self.size:
+      return None
+    return start, end
+
+  def _create_handler(self):
+    stream = self
+
+    class Handler(server.BaseHTTPRequestHandler):
+      """Answers GET and HEAD requests with ranged reads of the file."""
+
+      protocol_version = 'HTTP/1.1'
+
+      def do_HEAD(self):
+        self._respond(send_body=False)
+
+      def do_GET(self):
+        self._respond(send_body=True)
+
+      def _respond(self, send_body: bool):
+        range_header = self.headers.get('Range')
+        byte_range = stream._parse_range(range_header)
+        if byte_range is None:
+          self.send_response(416)
+          self.send_header('Content-Range', f'bytes */{stream.size}')
+          self.send_header('Content-Length', '0')
+          self.end_headers()
+          return
+        start, end = byte_range
+        self.send_response(206 if range_header else 200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        if range_header:
+          self.send_header(
+              'Content-Range', f'bytes {start}-{end}/{stream.size}'
+          )
+        self.end_headers()
+        if not send_body:
+          return
+        try:
+          while start <= end:
+            chunk_end = min(start + stream.chunk_size - 1, end)
+            self.wfile.write(stream.read_range(start, chunk_end))
+            start = chunk_end + 1
+        except (BrokenPipeError, ConnectionResetError):
+          # Consumers like ffmpeg drop the connection once they seek elsewhere
+          # or have read enough, so the rest of the range is never fetched.
+          self.close_connection = True
+
+      def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logging.debug('STREAM - %s', format % args)
+
+    return Handler
+
+
+def get_generative_model(model_name: str) -> Any:
+  """Returns a shared handle to a Gemini model.
+
+  Vertex AI is initialised on first use in each process, and handles are
+  cached per model name for the lifetime of the process, so that credentials
+  and clients are reused across invocations on a warm instance. Forked child
+  processes initialise and create their own handles.
+
+  Args:
+    model_name: The name of the model, e.g. `gemini-2.5-flash`.
+
+  Returns:
+    The `vertexai.generative_models.GenerativeModel`.
+  """
+  # Imported here so that triggers which don't use Gemini don't import it.
+  # pylint: disable=import-outside-toplevel
+  import vertexai
+  from vertexai.generative_models import GenerativeModel
+
+  global _vertexai_initialised
+  with _generative_models_lock:
+    if not _vertexai_initialised:
+      vertexai.init(
+          project=ConfigService.GCP_PROJECT_ID,
+          location=ConfigService.GCP_LOCATION,
+      )
+      _vertexai_initialised = True
+    model = _generative_models.get(model_name)
+    if model is None:
+      model = _generative_models[model_name] = GenerativeModel(model_name)
+    return model